@@ -0,0 +1,365 @@
+"""
+Akiba 買取表: 直接呼叫「もっと見る」背後的分頁請求
+
+Akiba 的買取表一次只顯示一批，其餘要點擊「もっと見る」載入。原本以瀏覽器開啟頁面後反覆點擊
+(根目錄腳本每次點擊後還 sleep 0.5~1.5 秒)，全部載入後才一次擷取: 整份列表的 DOM 都留在瀏覽器裡，
+越後面的點擊越慢，而且要等到最後才有資料可以寫入。
+
+本模組改為:
+
+1. 第 1 批: 以 HTTP (fetcher.PageFetcher) 抓取買取頁的 HTML，以 extraction.parse_listing 解析。
+2. 探測分頁請求 (每個買取表一次，結果保存於 AKIBA_ENDPOINT_CACHE): 以瀏覽器開啟頁面並點擊
+   「もっと見る」兩次，記錄按鈕送出的 XHR / fetch 請求 (方法、網址、查詢參數或表單內容)。
+   兩次請求中數值遞增的參數就是分頁參數，差值為步進 (page=2,3 -> 1；offset=50,100 -> 50)。
+   點擊後沒有送出請求但列數增加時，表示其餘的列已在 HTML 中 (只是隱藏)，第 1 步已取得全部。
+3. 第 2 批之後: 以 HTTP 直接送出分頁請求，每批回應 (HTML 片段，或 JSON 中的 HTML 字串)
+   解析後立即交給 on_batch (呼叫端直接送進 ingest / 寫入 Sheets)，回應沒有新列時結束。
+   保存的請求失效 (HTTP 錯誤，或 WordPress admin-ajax 的 "-1" / "0") 時重新探測一次。
+4. 探測不到分頁請求時才退回瀏覽器點擊，但每次點擊後只擷取新出現的列並立即交出，
+   已擷取的列隨即清空 (extraction.extract_new_in_page)，瀏覽器內的 DOM 不會隨列表變大。
+
+不論哪一種方式，資料都是一批一批交出，記憶體用量與列表長度無關。
+
+用法:
+    async with PageFetcher() as fetcher:
+        pool = BrowserPool(throttle=fetcher.throttle)   # 只在需要探測/退回點擊時才啟動瀏覽器
+        batches = await crawl_buy_list(fetcher, "https://akihabara-cardshop.com/onepice-kaitori/", on_batch, pool)
+
+    load_buy_list(url, on_batch)    # 同步程式 (根目錄的 Sheets 腳本) 使用
+"""
+
+import json
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from browser_pool import BrowserPool, wait_for_more
+from checkpoint import CHECKPOINT_DIR
+from extraction import AKIBA_BUY_SPEC, extract_new_in_page, parse_listing
+from fetcher import PageFetcher, run_async
+
+# --- [設定區域] ---
+AKIBA_ENDPOINT_CACHE = os.getenv("AKIBA_ENDPOINT_CACHE") or os.path.join(CHECKPOINT_DIR, "akiba_endpoints.json")
+AKIBA_MAX_BATCHES = int(os.getenv("AKIBA_MAX_BATCHES", "500"))   # 單一買取表的批次上限 (防止分頁參數無效時無限循環)
+
+LOAD_MORE_BUTTON_SELECTOR = "button#loadMoreButton"
+VISIBLE_LOAD_MORE_SELECTOR = LOAD_MORE_BUTTON_SELECTOR + ":not([style*='display: none'])"
+FIRST_CARD_SELECTOR = "div.tr"
+ROW_SELECTOR = AKIBA_BUY_SPEC["item"]
+
+# 只點擊一次就沒有下一批時 (無法比較兩次請求)，依參數名稱推測步進
+PAGE_PARAM_NAMES = ("page", "paged", "pageno", "page_no", "p")
+OFFSET_PARAM_NAMES = ("offset", "start", "from", "skip")
+
+# 探測時記錄的請求類型與保留的標頭
+_XHR_TYPES = ("xhr", "fetch")
+_KEPT_HEADERS = ("x-requested-with", "content-type")
+# WordPress admin-ajax 在 nonce 失效或 action 不存在時的回應
+_AJAX_FAILURE_BODIES = ("-1", "0")
+
+# 探測結果: 其餘的列已在頁面 HTML 中 (按鈕只是顯示隱藏的列)
+STATIC_ENDPOINT = {"static": True}
+
+
+# --- [分頁請求的描述] ---
+
+def _int(value):
+    try:
+        return int(str(value))
+    except ValueError:
+        return None
+
+
+def _request_fields(captured: dict):
+    """回傳 (參數位置, 參數): 位置為 "query" / "form" (參數為 [(鍵, 值)]) 或 "json" (參數為 dict)"""
+    if captured["method"] == "GET" or not captured["body"]:
+        return "query", parse_qsl(urlsplit(captured["url"]).query, keep_blank_values=True)
+    if "json" in captured["headers"].get("content-type", ""):
+        data = json.loads(captured["body"])
+        return ("json", data) if isinstance(data, dict) else (None, None)
+    return "form", parse_qsl(captured["body"], keep_blank_values=True)
+
+
+def infer_endpoint(first: dict, second: dict = None, rows_added: int = 0):
+    """由「もっと見る」送出的請求推算分頁請求 (無法判斷時回傳 None)
+
+    first / second: 第 1、2 次點擊的請求 {"method", "url", "body", "headers"}
+    rows_added: 只有一次點擊時，該次新增的列數 (offset 類參數的步進)
+    """
+    where, fields = _request_fields(first)
+    if where is None:
+        return None
+    values = dict(fields)
+
+    param = step = None
+    if second is not None:
+        where2, fields2 = _request_fields(second)
+        if where2 != where or urlsplit(second["url"]).path != urlsplit(first["url"]).path:
+            return None
+        values2 = dict(fields2)
+        for key, value in values.items():
+            a, b = _int(value), _int(values2.get(key))
+            if a is not None and b is not None and b > a:
+                param, step = key, b - a
+                break
+    else:
+        for key, value in values.items():
+            name = key.lower().strip("[]")
+            if _int(value) is None:
+                continue
+            if name in PAGE_PARAM_NAMES:
+                param, step = key, 1
+            elif name in OFFSET_PARAM_NAMES and rows_added > 0:
+                param, step = key, rows_added
+            if param:
+                break
+    if param is None:
+        return None
+
+    url = first["url"]
+    if where == "query":
+        url = urlunsplit(urlsplit(url)._replace(query=""))
+    return {
+        "method": first["method"], "url": url, "where": where,
+        "fields": fields if where == "json" else [list(pair) for pair in fields],
+        "headers": first["headers"], "param": param, "start": _int(values[param]), "step": step,
+    }
+
+
+def batch_request(endpoint: dict, batch: int) -> dict:
+    """第 batch 批的請求 (第 2 批為探測到的第一個請求)，回傳 fetcher.request_text 的參數"""
+    value = endpoint["start"] + (batch - 2) * endpoint["step"]
+    param, where = endpoint["param"], endpoint["where"]
+    request = {"method": endpoint["method"], "url": endpoint["url"], "headers": dict(endpoint["headers"])}
+    if where == "json":
+        request["json"] = {**endpoint["fields"], param: value}
+        return request
+    pairs = [(key, str(value) if key == param else v) for key, v in endpoint["fields"]]
+    if where == "query":
+        request["params"] = pairs
+    else:
+        # 表單保留原本的參數順序與重複的鍵 (a[]=1&a[]=2)
+        request["content"] = urlencode(pairs)
+        request["headers"].setdefault("content-type", "application/x-www-form-urlencoded; charset=UTF-8")
+    return request
+
+
+def _html_strings(value):
+    if isinstance(value, str):
+        if "<" in value:
+            yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _html_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _html_strings(item)
+
+
+def parse_batch(text: str) -> list:
+    """解析一批分頁回應 (HTML 片段，或 JSON 中的 HTML 字串)；請求已失效時拋出 ValueError"""
+    body = text.strip()
+    if body in _AJAX_FAILURE_BODIES:
+        raise ValueError(f"分頁請求失效 (回應 {body!r})")
+    html = body
+    if body[:1] in "{[":
+        try:
+            html = "".join(_html_strings(json.loads(body)))
+        except ValueError:
+            pass
+    if not html:
+        return []
+    # 片段中的列沒有外層 div.tbody，包上後沿用同一份規格 (lxml 的根元素本身不在搜尋範圍內，再包一層)
+    records, _, _ = parse_listing(f'<div><div class="tbody">{html}</div></div>', AKIBA_BUY_SPEC)
+    return records
+
+
+# --- [探測結果的保存] ---
+
+def load_endpoints(path: str = AKIBA_ENDPOINT_CACHE) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_endpoint(url: str, endpoint: dict, path: str = AKIBA_ENDPOINT_CACHE):
+    """寫入 (或移除) 某買取表的探測結果 (先寫暫存檔再取代)"""
+    endpoints = load_endpoints(path)
+    if endpoint is None:
+        endpoints.pop(url, None)
+    else:
+        endpoints[url] = endpoint
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(endpoints, f, ensure_ascii=False, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+# --- [瀏覽器: 探測 / 退回逐批點擊] ---
+
+async def _open_list(page, url: str) -> bool:
+    """開啟買取頁並等待第一列 (頁面為空時回傳 False)"""
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+    await page.goto(url, wait_until="domcontentloaded", timeout=120000)
+    try:
+        await page.wait_for_selector(FIRST_CARD_SELECTOR, timeout=15000)
+    except PlaywrightTimeoutError:
+        print(f" ⚠️ 警告: 頁面可能為空或未加載: {url}")
+        return False
+    return True
+
+
+async def _click_more(pool: BrowserPool, page, url: str) -> int:
+    """點擊「もっと見る」一次，回傳新增的列數 (沒有按鈕或沒有新列時回傳 0)"""
+    button = page.locator(VISIBLE_LOAD_MORE_SELECTOR)
+    if not await button.is_visible():
+        return 0
+    rows_before = await page.locator(ROW_SELECTOR).count()
+    await pool.throttle.pace(url)
+    await button.click()
+    try:
+        await wait_for_more(page, ROW_SELECTOR, rows_before, timeout=15000)
+    except Exception:
+        return 0
+    return await page.locator(ROW_SELECTOR).count() - rows_before
+
+
+async def probe_endpoint(pool: BrowserPool, url: str):
+    """點擊「もっと見る」並記錄其請求，回傳分頁請求的描述
+
+    其餘的列已在 HTML 中時回傳 STATIC_ENDPOINT；沒有按鈕或無法判斷時回傳 None
+    """
+    site = urlsplit(url).netloc
+    captured = []
+
+    def on_request(request):
+        if request.resource_type in _XHR_TYPES and urlsplit(request.url).netloc == site:
+            captured.append({
+                "method": request.method, "url": request.url, "body": request.post_data or "",
+                "headers": {k: v for k, v in request.headers.items() if k.lower() in _KEPT_HEADERS},
+            })
+
+    clicks = []   # 每次點擊: (送出的請求, 新增列數)
+    async with pool.page(url) as page:
+        page.on("request", on_request)
+        try:
+            if await _open_list(page, url):
+                for _ in range(2):
+                    captured.clear()
+                    rows_added = await _click_more(pool, page, url)
+                    if not rows_added:
+                        break
+                    clicks.append((list(captured), rows_added))
+        finally:
+            page.remove_listener("request", on_request)
+
+    if not clicks:
+        return None
+    if not any(requests for requests, _ in clicks):
+        return STATIC_ENDPOINT
+    if len(clicks) == 2:
+        for first in clicks[0][0]:
+            for second in clicks[1][0]:
+                endpoint = infer_endpoint(first, second)
+                if endpoint:
+                    return endpoint
+        return None
+    for first in clicks[0][0]:
+        endpoint = infer_endpoint(first, rows_added=clicks[0][1])
+        if endpoint:
+            return endpoint
+    return None
+
+
+async def click_through(pool: BrowserPool, url: str, on_batch, start_batch: int = 1) -> int:
+    """(備援) 以瀏覽器逐次點擊，每次只擷取新出現的列交給 on_batch，回傳批次數"""
+    batch = 0
+    async with pool.page(url) as page:
+        if not await _open_list(page, url):
+            return 0
+        seen = 0
+        while batch < AKIBA_MAX_BATCHES:
+            records, seen = await extract_new_in_page(page, AKIBA_BUY_SPEC, seen)
+            batch += 1
+            if batch >= start_batch:
+                on_batch(records, batch)
+            if not await _click_more(pool, page, url):
+                break
+    return batch
+
+
+# --- [對外介面] ---
+
+async def crawl_buy_list(fetcher: PageFetcher, url: str, on_batch, pool: BrowserPool, start_batch: int = 1) -> int:
+    """抓取一個買取表的所有批次，每批以 on_batch(records, batch) 處理，回傳最後的批次編號
+
+    第 1 批為頁面 HTML 中的列，之後每批為一次「もっと見る」。
+    start_batch: 斷點續傳時從第幾批開始交給 on_batch (分頁請求可直接從該批開始抓取)
+    pool: 需要探測或退回點擊時才會啟動瀏覽器
+    """
+    def emit(records, batch):
+        print(f"     -> {url} 第 {batch} 批: {len(records)} 條買取情報")
+        on_batch(records, batch)
+
+    endpoint = load_endpoints().get(url)
+
+    first_batch = []
+    if start_batch <= 1 or not endpoint or endpoint.get("static"):
+        first_batch, _, _ = parse_listing(await fetcher.get_html(url), AKIBA_BUY_SPEC)
+    if endpoint is None:
+        print(f" -> {url}: 探測「もっと見る」的分頁請求...")
+        endpoint = await probe_endpoint(pool, url)
+        if endpoint is not None:
+            save_endpoint(url, endpoint)
+    if endpoint is not None and endpoint.get("static"):
+        if start_batch <= 1 and first_batch:
+            emit(first_batch, 1)
+        return 1
+    if endpoint is None:
+        if not first_batch or start_batch > 1:
+            print(f" -> {url}: 找不到分頁請求，改以瀏覽器逐批點擊。")
+            return await click_through(pool, url, emit, start_batch)
+        emit(first_batch, 1)   # 沒有「もっと見る」: 第 1 批就是全部
+        return 1
+
+    batch = start_batch
+    if batch <= 1 and first_batch:
+        emit(first_batch, 1)
+        batch = 2
+    reprobed = False
+    previous = None
+    while batch <= AKIBA_MAX_BATCHES:
+        try:
+            records = parse_batch(await fetcher.request_text(**batch_request(endpoint, batch)))
+        except (httpx.HTTPStatusError, ValueError) as e:
+            if reprobed:
+                raise
+            print(f" -> ⚠️ {url}: 第 {batch} 批的分頁請求失效 ({str(e)[:60]})，重新探測。")
+            reprobed = True
+            endpoint = await probe_endpoint(pool, url)
+            save_endpoint(url, endpoint)
+            if endpoint is None or endpoint.get("static"):
+                return await click_through(pool, url, emit, batch)
+            continue
+        # 分頁參數無效時伺服器會一直回傳同一批
+        if not records or records == previous:
+            break
+        emit(records, batch)
+        previous = records
+        batch += 1
+    return batch - 1
+
+
+def load_buy_list(url: str, on_batch) -> int:
+    """同步版 crawl_buy_list (根目錄的 Sheets 腳本使用)，回傳批次數"""
+    async def sweep():
+        async with PageFetcher() as fetcher:
+            pool = BrowserPool(throttle=fetcher.throttle)
+            try:
+                return await crawl_buy_list(fetcher, url, on_batch, pool)
+            finally:
+                await pool.close()
+
+    return run_async(sweep())
@@ -0,0 +1,184 @@
+"""
+非同步瀏覽器池: 單一瀏覽器程序內同時操作多個頁面
+
+確實需要 JavaScript 的來源 (例如 Akiba 的「更多」按鈕)，原本是一個 page 物件
+依序走訪每個網址並以 time.sleep 間隔。BrowserPool 改為:
+
+- 只啟動一個瀏覽器程序，內含 BROWSER_CONCURRENCY 個各自獨立的 context/page。
+- map(urls, handler) 並行處理多個網址，每個工作在開始前向 HostThrottle 取得名額，
+  因此每個網站的並行數與請求間隔由 host_throttle 統一控管，不再散落在迴圈裡。
+- 輕量載入: 爬蟲只使用 HTML 文字與圖片網址屬性，因此每個 context 都會攔截並中止
+  圖片/字型/影音、追蹤與廣告、以及第三方非腳本請求；頁面以 domcontentloaded
+  加上目標選擇器等待，不再等 networkidle。context 建立後重複使用 (保留 cookie 與快取)。
+
+根目錄的同步 Playwright 爬蟲可使用 new_light_context_sync(browser) 與 wait_for_more_sync()。
+
+用法:
+    async def handle(page, url):
+        await page.goto(url, wait_until="domcontentloaded")
+        return await page.content()
+
+    async with BrowserPool() as pool:
+        results = await pool.map(urls, handle)   # 與 urls 同順序，失敗的項目為 None
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from host_throttle import HostThrottle
+
+# --- [設定區域] ---
+BROWSER_CONCURRENCY = int(os.getenv("BROWSER_CONCURRENCY", "4"))   # 同時開啟的頁面數
+BROWSER_TYPE = os.getenv("BROWSER_TYPE", "firefox")                # firefox / chromium / webkit
+
+# 一律中止的資源類型 (只需要 HTML 與圖片網址，不需要圖片本身)
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+# 第三方網域只放行腳本與 XHR (部分網站的「更多」按鈕依賴 CDN 上的 jQuery)
+THIRD_PARTY_ALLOWED_TYPES = {"document", "script", "xhr", "fetch"}
+# 追蹤/廣告網域 (含子網域)，不論類型一律中止
+BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "googlesyndication.com", "doubleclick.net",
+    "googleadservices.com", "facebook.net", "facebook.com", "twitter.com", "clarity.ms",
+    "hotjar.com", "criteo.com", "yahoo.co.jp", "yimg.jp", "line-scdn.net", "adsrvr.org",
+)
+
+
+# --- [資源攔截] ---
+
+def _site_of(host: str) -> str:
+    """粗略取得網站的主網域 (www.cardrush-dm.jp -> cardrush-dm.jp)"""
+    host = host.split(":")[0].lower()
+    labels = host.split(".")
+    # 日本的 .co.jp / .ne.jp 等二級網域保留三段
+    keep = 3 if len(labels) >= 3 and labels[-1] == "jp" and len(labels[-2]) == 2 else 2
+    return ".".join(labels[-keep:])
+
+
+def should_block(resource_type: str, request_url: str, page_url: str) -> bool:
+    """判斷請求是否應該中止"""
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlsplit(request_url).netloc.split(":")[0].lower()
+    if any(host == blocked or host.endswith("." + blocked) for blocked in BLOCKED_HOSTS):
+        return True
+    if not page_url or not page_url.startswith("http"):
+        return False
+    third_party = _site_of(host) != _site_of(urlsplit(page_url).netloc)
+    return third_party and resource_type not in THIRD_PARTY_ALLOWED_TYPES
+
+
+def _page_url_of(request) -> str:
+    try:
+        return request.frame.url
+    except Exception:
+        return ""
+
+
+async def install_resource_blocking(context):
+    async def handle(route):
+        request = route.request
+        if should_block(request.resource_type, request.url, _page_url_of(request)):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await context.route("**/*", handle)
+
+
+def install_resource_blocking_sync(context):
+    def handle(route):
+        request = route.request
+        if should_block(request.resource_type, request.url, _page_url_of(request)):
+            route.abort()
+        else:
+            route.continue_()
+
+    context.route("**/*", handle)
+
+
+def new_light_context_sync(browser):
+    """(同步 API) 建立已攔截重資源的 context，整個爬蟲流程重複使用同一個"""
+    context = browser.new_context(service_workers="block")
+    install_resource_blocking_sync(context)
+    return context
+
+
+# 等待列表筆數增加 (點擊「更多」後取代 networkidle)
+_MORE_ROWS_JS = "([selector, count]) => document.querySelectorAll(selector).length > count"
+
+
+async def wait_for_more(page, selector: str, count_before: int, timeout: int = 15000):
+    await page.wait_for_function(_MORE_ROWS_JS, arg=[selector, count_before], timeout=timeout)
+
+
+def wait_for_more_sync(page, selector: str, count_before: int, timeout: int = 15000):
+    page.wait_for_function(_MORE_ROWS_JS, arg=[selector, count_before], timeout=timeout)
+
+
+class BrowserPool:
+    def __init__(self, concurrency: int = BROWSER_CONCURRENCY, throttle: HostThrottle = None,
+                 browser_type: str = BROWSER_TYPE, headless: bool = True):
+        self.concurrency = concurrency
+        self.throttle = throttle or HostThrottle()
+        self.browser_type = browser_type
+        self.headless = headless
+        self._playwright = None
+        self._browser = None
+        self._pages = None
+        self._start_lock = asyncio.Lock()
+        self.pages_loaded = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def start(self):
+        async with self._start_lock:
+            if self._browser is not None:
+                return
+            from playwright.async_api import async_playwright
+            print(f"\n>> 啟動瀏覽器 ({self.browser_type}, {self.concurrency} 個並行頁面)...")
+            self._playwright = await async_playwright().start()
+            self._browser = await getattr(self._playwright, self.browser_type).launch(headless=self.headless)
+            self._pages = asyncio.Queue()
+            # 每個 context 只建立一次並重複使用 (保留 cookie/快取，省去每頁的冷啟動)
+            for _ in range(self.concurrency):
+                context = await self._browser.new_context(service_workers="block")
+                await install_resource_blocking(context)
+                self._pages.put_nowait(await context.new_page())
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+            await self._playwright.stop()
+            self._browser = None
+
+    @asynccontextmanager
+    async def page(self, url: str):
+        """借出一個閒置頁面，並佔用 url 所屬網站的並行名額"""
+        await self.start()
+        page = await self._pages.get()
+        try:
+            async with self.throttle.slot(url):
+                yield page
+                self.pages_loaded += 1
+        finally:
+            self._pages.put_nowait(page)
+
+    async def map(self, urls, handler):
+        """並行執行 handler(page, url)，回傳與 urls 同順序的結果 (失敗為 None)"""
+        async def run(url):
+            try:
+                async with self.page(url) as page:
+                    return await handler(page, url)
+            except Exception as e:
+                print(f"    ❌ {url} 處理失敗: {str(e)[:80]}")
+                return None
+
+        return await asyncio.gather(*(run(url) for url in urls))
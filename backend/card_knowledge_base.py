@@ -21,10 +21,12 @@ OP_KNOWLEDGE = {
     
     # 卡號格式
     "card_number_patterns": [
-        r"OP(\d{2})-(\d{3})",           # OP01-001 ~ OP14-119
-        r"ST(\d{2})-(\d{3})",           # ST01-001 (起始牌組)
-        r"EB(\d{2})-(\d{3})",           # EB01-001 (擴充包)
-        r"POP(\d{2})-(\d{3})",          # 促銷卡
+        # 部分網站省略 "-" (OP01001)、系列編號為三位數 (OP100-001) 或卡號帶字母 (ST21-E001)
+        r"OP(\d{2,3})-?([A-Z]?)(\d{3})",    # OP01-001 ~ OP14-119
+        r"ST(\d{2,3})-?([A-Z]?)(\d{3})",    # ST01-001 (起始牌組)
+        r"EB(\d{2,3})-?([A-Z]?)(\d{3})",    # EB01-001 (擴充包)
+        r"POP(\d{2,3})-?([A-Z]?)(\d{3})",   # 促銷卡
+        r"PRB(\d{2,3})-?([A-Z]?)(\d{3})",   # PRB01-001 (プレミアムブースター)
         r"P-(\d{3})",                    # 促銷卡
     ],
     
@@ -212,9 +214,9 @@ UA_KNOWLEDGE = {
     
     # 卡號格式
     "card_number_patterns": [
-        r"UA(\d{2})BT/([A-Z]{3})-(\d)-(\d{3})",    # UA01BT/JJK-1-001
-        r"UA(\d{2})BT-(\d{3})",                     # UA01BT-001
-        r"EX(\d{2})BT/([A-Z]{3})-(\d)-(\d{3})",    # EX01BT/HTR-1-001
+        r"UA(\d{2})([A-Z]{2})/([A-Z0-9]{2,5})-(\d)-([A-Z0-9]{3,4})",   # UA01BT/JJK-1-001、UA01ST/...
+        r"UA(\d{2})([A-Z]{2})-(\d{3})",                                # UA01BT-001
+        r"EX(\d{2})([A-Z]{2})/([A-Z0-9]{2,5})-(\d)-([A-Z0-9]{3,4})",   # EX01BT/HTR-1-001
     ],
     
     # 卡牌顏色
@@ -496,28 +498,10 @@ DM_KNOWLEDGE = {
 # 遊戲識別函數
 # ============================================================
 def identify_game_from_card_number(card_number: str) -> str:
-    """根據卡號識別所屬遊戲"""
-    import re
-    
-    card_number = card_number.upper().strip()
-    
-    # OP 格式
-    if re.match(r'^(OP|ST|EB|POP|P-)\d', card_number):
-        return "OP"
-    
-    # UA 格式
-    if re.match(r'^(UA|EX)\d{2}BT', card_number):
-        return "UA"
-    
-    # VG 格式
-    if re.match(r'^(D-|DZ-|V-|G-|CP/)', card_number):
-        return "VG"
-    
-    # DM 格式
-    if re.match(r'^(DM|DMR|DMRP|RP\d|BD)', card_number):
-        return "DM"
-    
-    return "UNKNOWN"
+    """根據卡號識別所屬遊戲 (由 card_numbers 的編譯引擎處理，無法判斷時回傳 "UNKNOWN")"""
+    from card_numbers import identify_game
+
+    return identify_game(card_number) or "UNKNOWN"
 
 
 def get_game_knowledge(game_code: str) -> dict:
@@ -0,0 +1,422 @@
+"""
+卡號辨識引擎 (編譯一次，爬蟲 / OCR / 搜尋共用)
+
+卡號原本由各處各自的正則解析: 每個爬蟲一條 ([A-Z]{2,3}\\d{2,3}-?[A-Z]?\\d{3}、\\{([^}]+)\\} ...)，
+perform_advanced_ocr 有自己的 card_patterns，identify_game_from_card_number 每次呼叫都重新 re.match。
+本模組以 card_knowledge_base 各遊戲的 card_number_patterns 為唯一來源，啟動時編譯:
+
+- 每條格式 (例如 EB(\\d{2})-(\\d{3})) 拆成「字面前綴 + 擷取群組」，得到標準寫法的範本 (EB{}-{})；
+  可省略的字面字元 (-?) 在範本中一律寫出。
+- 所有格式合併成一條正則 (每條格式一個具名群組，前綴長的優先)，文字只掃描一次，
+  由命中的群組 (lastgroup) 分派到對應的遊戲與範本。
+- 只看開頭的 identify_game() 依前兩個字元查表，只試可能的少數格式，並快取結果。
+- loose=True (OCR): 分隔符號可省略或以空白/底線代替、字面的 O 可能被讀成 0、
+  固定位數的數字可少位數 (依格式補零)，例如 "0P 1-1" -> OP01-001。
+
+每個結果 (CardNumber) 包含標準卡號、遊戲代碼、系列代碼與版本提示:
+- 標準卡號: 全形轉半形、轉大寫後依範本重組；格式正確的輸入與原文相同 (既有卡片的身分不變)，
+  省略分隔符號的寫法補回 (OP01001 -> OP01-001)。
+- 系列代碼: 卡號中 "/" 之前的部分，沒有 "/" 時為最後一個 "-" 之前 (OP01-001 -> OP01、
+  UA01BT/JJK-1-001 -> UA01BT、D-BT01/001 -> D-BT01、DMR-01/001 -> DMR-01)。
+- 版本提示: 依名稱中的關鍵字 (パラレル -> Parallel、未開封 -> Sealed)，沒有時為 Normal。
+
+用法:
+    parse_card_number("モンキー・D・ルフィ OP05-119 SEC", game="OP")
+        # -> CardNumber(card_number='OP05-119', game_code='OP', set_code='OP05', version_hint='Normal')
+    identify_game("D-BT01/001")                 # -> "VG"
+    find_card_numbers(ocr_text, loose=True)     # OCR 文字中的所有卡號
+    parse_card_number("P-001", "OP", sets_only=True)   # -> None (只接受有系列編號的卡號)
+
+    python card_numbers.py "UA01BT/JJK-1-001"   # 解析並顯示結果
+    python card_numbers.py --bench              # 每秒可處理的字串數
+    python card_numbers.py --check              # 與舊版 Mercadop 正則比對 LEGACY_SAMPLES
+"""
+
+import argparse
+import re
+import time
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+from card_knowledge_base import DM_KNOWLEDGE, OP_KNOWLEDGE, UA_KNOWLEDGE, VG_KNOWLEDGE
+
+CardNumber = namedtuple("CardNumber", ["card_number", "game_code", "set_code", "version_hint"])
+
+KNOWLEDGE_BASES = [OP_KNOWLEDGE, UA_KNOWLEDGE, VG_KNOWLEDGE, DM_KNOWLEDGE]
+
+# 名稱中的版本關鍵字 (依序比對，第一個命中者為準)
+VERSION_KEYWORDS = [
+    ("パラレル", "Parallel"),
+    ("未開封", "Sealed"),
+]
+
+KNOWN_CACHE_SIZE = 200_000   # 已解析卡號的快取上限
+
+# Card Rush 商品名稱以 {卡號} 標示卡號
+BRACED_RE = re.compile(r'\{([^}]+)\}')
+_FIXED_DIGITS_RE = re.compile(r'\\d\{(\d+)(?:,(\d+))?\}')   # \d{3}、\d{2,3} (補零到最少位數)
+
+
+class CardRule:
+    """一條卡號格式: 字面前綴 + 擷取群組 (例如 DMR-(\\d{2})/(\\d{1,3}))"""
+
+    def __init__(self, game_code: str, pattern: str):
+        self.game_code = game_code
+        self.pattern = pattern
+        self.tokens = _tokenize(pattern)   # [(是否為群組, 內容), ...]
+        self.prefix = ""
+        for is_group, value in self.tokens:
+            if is_group or value.endswith("?"):
+                break
+            self.prefix += value
+        self.template = "".join("{}" if is_group else value.rstrip("?").replace("{", "{{").replace("}", "}}")
+                                for is_group, value in self.tokens)
+        # 固定位數的群組 (\d{3}、\d{2,3}) 補零到最少位數
+        self.widths = [int(m.group(1)) if (m := _FIXED_DIGITS_RE.fullmatch(value)) else 0
+                       for is_group, value in self.tokens if is_group]
+        self.group_count = len(self.widths)
+        # 系列代碼含有擷取群組 (OP{} 有，P-001、D-PR/001 這類促銷卡號沒有)
+        self.has_set = "{}" in set_code_of(self.template)
+
+    def source(self, loose: bool = False, skip_head: bool = False) -> str:
+        """本格式的正則 (skip_head: 省略前綴的第一個字元，由合併正則的分派層比對)"""
+        tokens = self.tokens
+        if skip_head and self.prefix:
+            tokens = [(False, tokens[0][1][1:])] + tokens[1:] if len(tokens[0][1]) > 1 else tokens[1:]
+        if not loose:
+            return "".join(f"({value})" if is_group else _literal(value, {}) for is_group, value in tokens)
+        parts = []
+        for is_group, value in tokens:
+            if is_group:
+                width = _FIXED_DIGITS_RE.fullmatch(value)
+                parts.append(rf"(\d{{1,{width.group(2) or width.group(1)}}})" if width else f"({value})")
+            else:
+                parts.append(_literal(value, _LOOSE_LITERALS))
+        source = r"\s*".join(parts)
+        if len(self.prefix.rstrip("-/")) < 2:
+            # 單一字母的前綴 (P-、D-、V-) 省略分隔符號時太容易誤判，仍須有分隔符號
+            source = source.replace(_LOOSE_LITERALS["-"], r"\s*[-_]\s*")
+        return source
+
+    def canonical(self, groups) -> str:
+        return self.template.format(*(g.zfill(w) if w else g for g, w in zip(groups, self.widths)))
+
+
+# 寬鬆模式 (OCR) 的字面字元
+_LOOSE_LITERALS = {
+    "-": r"\s*[-_]?\s*",
+    "/": r"\s*/\s*",
+    "O": "[O0]",
+}
+
+
+def _literal(value: str, literals) -> str:
+    """字面字元的正則 (結尾為 ? 的是可省略的單一字元)"""
+    if value.endswith("?"):
+        return f"(?:{_literal(value[:-1], literals)})?"
+    return "".join(literals.get(ch, re.escape(ch)) for ch in value)
+
+
+def _tokenize(pattern: str):
+    """把格式拆成字面字元與擷取群組 (群組外只允許一般字元，單一字元後可加 ? 表示可省略)"""
+    tokens = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "(":
+            depth, j = 1, i + 1
+            while depth:
+                if pattern[j] == "\\":
+                    j += 1
+                elif pattern[j] == "(":
+                    depth += 1
+                elif pattern[j] == ")":
+                    depth -= 1
+                j += 1
+            tokens.append((True, pattern[i + 1:j - 1]))
+            i = j
+        elif ch.isalnum() or ch in "-/":
+            optional = pattern[i + 1:i + 2] == "?"
+            tokens.append((False, ch + "?" if optional else ch))
+            i += 2 if optional else 1
+        else:
+            raise ValueError(f"卡號格式只能由字面字元與擷取群組組成: {pattern}")
+    # 合併相鄰的字面字元
+    merged = []
+    for is_group, value in tokens:
+        if merged and not is_group and not merged[-1][0] and not value.endswith("?") \
+                and not merged[-1][1].endswith("?"):
+            merged[-1] = (False, merged[-1][1] + value)
+        else:
+            merged.append((is_group, value))
+    return merged
+
+
+class CardNumberEngine:
+    def __init__(self, knowledge_bases=KNOWLEDGE_BASES):
+        rules = [CardRule(kb["game_code"], pattern)
+                 for kb in knowledge_bases for pattern in kb.get("card_number_patterns", [])]
+        # 前綴長的優先 (DMRP- 先於 DMR- 先於 DM、D-PR/ 先於 D-)
+        self.rules = sorted(rules, key=lambda rule: -len(rule.prefix))
+        self.games = sorted({rule.game_code for rule in self.rules})
+        self._scanners = {}
+        self._known = {}   # (群組名, 命中的文字) -> (標準卡號, 遊戲, 系列)
+
+        # identify_game 的前綴分派表: 前兩個字元 -> 可能的格式
+        self._by_head = {}
+        self._headless = []
+        for rule in self.rules:
+            if len(rule.prefix) >= 2:
+                self._by_head.setdefault(rule.prefix[:2], []).append(rule)
+            else:
+                self._headless.append(rule)
+        self._anchored = {id(rule): re.compile(rule.pattern) for rule in self.rules}
+
+    def _scanner(self, game: str = None, loose: bool = False, sets_only: bool = False):
+        """合併後的掃描正則 (依遊戲/模式延遲編譯)；回傳 (正則, {群組名: (格式, 第一個群組編號)})
+
+        各格式依前綴的第一個字元分組 (O(?:P..|...)|D(?:MRP..|...)|...)，開頭再以字元集預先篩選，
+        每個位置只嘗試第一個字元相符的少數格式。
+        """
+        key = (game, loose, sets_only)
+        if key not in self._scanners:
+            heads = {}       # 第一個字元 -> [(群組名, 格式)]
+            headless = []
+            for i, rule in enumerate(self.rules):
+                if (game is None or rule.game_code == game) and (rule.has_set or not sets_only):
+                    (heads.setdefault(rule.prefix[0], []) if rule.prefix else headless).append((f"r{i}", rule))
+
+            def literal(ch):
+                return _LOOSE_LITERALS.get(ch, re.escape(ch)) if loose else re.escape(ch)
+
+            branches = []
+            dispatch = {}
+            group_index = 1
+
+            def add(name, rule, skip_head):
+                nonlocal group_index
+                dispatch[name] = (rule, group_index + 1)
+                group_index += 1 + rule.group_count
+                return f"(?P<{name}>{rule.source(loose, skip_head)})"
+
+            for ch, rules in heads.items():
+                branches.append(f"{literal(ch)}(?:{'|'.join(add(name, rule, True) for name, rule in rules)})")
+            branches.extend(add(name, rule, False) for name, rule in headless)
+
+            first_chars = "".join(sorted(heads)) + ("0-9" if headless or (loose and "O" in heads) else "")
+            regex = re.compile(rf"(?=[{first_chars}])(?<![A-Z0-9])(?:{'|'.join(branches)})(?![0-9])")
+            self._scanners[key] = (regex, dispatch)
+        return self._scanners[key]
+
+    def _result(self, match, dispatch, version_hint: str) -> CardNumber:
+        # 同一個卡號在一次執行中會重複出現很多次，標準寫法只計算一次
+        key = (match.lastgroup, match.group())
+        known = self._known.get(key)
+        if known is None:
+            rule, first = dispatch[match.lastgroup]
+            card_number = rule.canonical(match.groups()[first - 1:first - 1 + rule.group_count])
+            known = (card_number, rule.game_code, set_code_of(card_number))
+            if len(self._known) >= KNOWN_CACHE_SIZE:
+                self._known.clear()
+            self._known[key] = known
+        return CardNumber(*known, version_hint)
+
+    def parse(self, text: str, game: str = None, loose: bool = False, sets_only: bool = False):
+        """文字中第一個可辨識的卡號 (找不到時回傳 None；sets_only: 不接受沒有系列編號的促銷卡號)"""
+        if not text:
+            return None
+        normalized = normalize(text)
+        regex, dispatch = self._scanner(game, loose, sets_only)
+        match = regex.search(normalized)
+        if match is None:
+            return None
+        return self._result(match, dispatch, version_hint(text))
+
+    def find_all(self, text: str, game: str = None, loose: bool = False):
+        """文字中所有可辨識的卡號 (依出現順序，去除重複)"""
+        if not text:
+            return []
+        regex, dispatch = self._scanner(game, loose)
+        hint = version_hint(text)
+        results = {}
+        for match in regex.finditer(normalize(text)):
+            result = self._result(match, dispatch, hint)
+            results.setdefault(result.card_number, result)
+        return list(results.values())
+
+    def identify(self, card_number: str):
+        """卡號所屬的遊戲: 先依完整格式判斷，不符合時依前綴 (例如只有 "OP01")；無法判斷時回傳 None"""
+        text = normalize(card_number).strip()
+        candidates = self._by_head.get(text[:2], [])
+        for rule in candidates:
+            if self._anchored[id(rule)].match(text):
+                return rule.game_code
+        for rule in self._headless:
+            if self._anchored[id(rule)].match(text):
+                return rule.game_code
+        for rule in candidates:
+            rest = text[len(rule.prefix):len(rule.prefix) + 1]
+            if text.startswith(rule.prefix) and (rest.isdigit() or rule.prefix[-1] in "-/"):
+                return rule.game_code
+        return None
+
+
+def normalize(text: str) -> str:
+    """全形轉半形並轉大寫 (ＯＰ０１－００１ -> OP01-001)"""
+    if text.isascii():
+        return text.upper()
+    return unicodedata.normalize("NFKC", text).upper()
+
+
+def set_code_of(card_number: str) -> str:
+    """系列代碼: "/" 之前，沒有 "/" 時為最後一個 "-" 之前"""
+    if "/" in card_number:
+        return card_number.split("/")[0]
+    if "-" in card_number:
+        return card_number.rsplit("-", 1)[0]
+    return card_number[:4]
+
+
+def version_hint(text: str) -> str:
+    for keyword, version in VERSION_KEYWORDS:
+        if keyword in text:
+            return version
+    return "Normal"
+
+
+ENGINE = CardNumberEngine()
+
+
+def parse_card_number(text: str, game: str = None, loose: bool = False, sets_only: bool = False):
+    return ENGINE.parse(text, game, loose, sets_only)
+
+
+def find_card_numbers(text: str, game: str = None, loose: bool = False):
+    return ENGINE.find_all(text, game, loose)
+
+
+@lru_cache(maxsize=65536)
+def identify_game(card_number: str):
+    return ENGINE.identify(card_number)
+
+
+def braced_card_number(name: str, game: str = None):
+    """Card Rush 商品名稱中 {卡號} 的卡號
+
+    括號內的文字就是網站標示的卡號，即使不是已知格式也照原樣採用 (與既有卡片的身分一致)；
+    是已知格式時另外提供遊戲與系列代碼。
+    """
+    match = BRACED_RE.search(name)
+    if not match:
+        return None
+    card_number = match.group(1).strip()
+    if not card_number:
+        return None
+    known = ENGINE.parse(card_number, game)
+    return CardNumber(card_number, known.game_code if known else game, set_code_of(card_number), version_hint(name))
+
+
+# --- [效能基準] ---
+
+SAMPLE_NAMES = [
+    "モンキー・D・ルフィ OP05-119 SEC", "ロロノア・ゾロ(パラレル) ST01-013", "ナミ EB01-006 R",
+    "【SR】虎杖悠仁 UA01BT/JJK-1-001", "五条悟 EX01BT/JJK-2-045", "《ドラゴンエンパイア》 D-BT01/001 RRR",
+    "{DMR-01/001} 超次元", "ボルシャック・ドラゴン DM01-1", "{RP20KM3/KM5} 切札勝太", "未開封 OP01 ブースター",
+]
+SAMPLE_NUMBERS = ["OP05-119", "ST01-013", "EB01-006", "UA01BT/JJK-1-001", "D-BT01/001", "DZ-LBT01/001",
+                  "DMR-01/001", "DM01-1", "RP20KM3/KM5", "23BD21/16", "OP01", "XYZ"]
+
+
+def _legacy_identify(card_number: str) -> str:
+    """舊版 identify_game_from_card_number (每次呼叫都重新 re.match)，僅供比較"""
+    card_number = card_number.upper().strip()
+    if re.match(r'^(OP|ST|EB|POP|P-)\d', card_number):
+        return "OP"
+    if re.match(r'^(UA|EX)\d{2}BT', card_number):
+        return "UA"
+    if re.match(r'^(D-|DZ-|V-|G-|CP/)', card_number):
+        return "VG"
+    if re.match(r'^(DM|DMR|DMRP|RP\d|BD)', card_number):
+        return "DM"
+    return "UNKNOWN"
+
+
+# --- [舊版比對] ---
+
+# 舊版 Mercadop 爬蟲的卡號正則 (取代前的行為)
+LEGACY_MERCADOP_RE = re.compile(r'([A-Z]{2,3}\d{2,3}-?[A-Z]?\d{3})')
+
+# (Mercadop 的型號 / 商品名稱, 引擎的標準卡號)；None 表示兩者都不應辨識
+LEGACY_SAMPLES = [
+    ("OP01-001", "OP01-001"),
+    ("OP01001", "OP01-001"),
+    ("OP100-001", "OP100-001"),
+    ("ST21-E001", "ST21-E001"),
+    ("EB01-006", "EB01-006"),
+    ("PRB01-001", "PRB01-001"),
+    ("POP01-001", "POP01-001"),
+    ("モンキー・D・ルフィ OP05-119 SEC", "OP05-119"),
+    ("ロロノア・ゾロ(パラレル) ST01-013", "ST01-013"),
+    ("P-001", None),
+    ("OP01", None),
+    ("ブースターパック BOX", None),
+]
+
+
+def check_legacy(samples=LEGACY_SAMPLES) -> bool:
+    """確認 Mercadop 的解析方式 (game="OP", sets_only=True) 與舊版正則辨識的範圍一致"""
+    ok = True
+    for text, expected in samples:
+        legacy = LEGACY_MERCADOP_RE.search(text)
+        found = parse_card_number(text, "OP", sets_only=True)
+        card_number = found.card_number if found else None
+        agree = bool(legacy) == bool(found) and card_number == expected
+        ok = ok and agree
+        print(f"  {'✅' if agree else '❌'} {text:<36} 舊版: {legacy.group(1) if legacy else '-':<12} 引擎: {card_number or '-'}")
+    return ok
+
+
+def _bench(label, func, samples, count):
+    batch = samples * (count // len(samples) + 1)
+    batch = batch[:count]
+    start = time.perf_counter()
+    for text in batch:
+        func(text)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {count / elapsed:>12,.0f} 字串/秒")
+
+
+def run_benchmark(count: int):
+    print(f">> {count:,} 個字串 ({len(ENGINE.rules)} 條格式，{len(ENGINE.games)} 個遊戲)")
+    _bench("identify (舊版 re.match)", _legacy_identify, SAMPLE_NUMBERS, count)
+    _bench("identify (引擎)", ENGINE.identify, SAMPLE_NUMBERS, count)
+    _bench("identify (引擎+快取)", identify_game, SAMPLE_NUMBERS, count)
+    _bench("parse 商品名稱", parse_card_number, SAMPLE_NAMES, count)
+    _bench("parse 商品名稱 (OP)", lambda text: parse_card_number(text, "OP"), SAMPLE_NAMES, count)
+    _bench("find_all OCR (寬鬆)", lambda text: find_card_numbers(text, loose=True), SAMPLE_NAMES, count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="卡號辨識引擎")
+    parser.add_argument("texts", nargs="*", help="要解析的卡號或商品名稱")
+    parser.add_argument("--loose", action="store_true", help="寬鬆模式 (OCR)")
+    parser.add_argument("--bench", nargs="?", type=int, const=1_000_000, metavar="N", help="效能基準 (預設 100 萬個字串)")
+    parser.add_argument("--check", action="store_true", help="與舊版 Mercadop 正則比對 LEGACY_SAMPLES")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+    if args.check:
+        if not check_legacy():
+            raise SystemExit("❌ 引擎與舊版正則的辨識結果不一致")
+        print("✅ 引擎與舊版正則的辨識結果一致")
+        return
+    for text in args.texts:
+        found = find_card_numbers(text, loose=args.loose)
+        print(f"{text}: {found or '無法辨識'} (遊戲: {identify_game(text) or '未知'})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Card Rush Media 買取表: 直接抓取 Next.js 資料 (不需要瀏覽器)
+
+cardrush.media 的買取表是 Next.js 頁面，原本以 Edge 開啟每一頁、等待 script#__NEXT_DATA__
+再 json.loads 其內容，一頁 100 筆、逐頁抓取並間隔 1~3 秒。
+頁面資料其實可以直接以 HTTP 取得:
+
+1. 以 HTTP 抓第 1 頁的 HTML，從 __NEXT_DATA__ 取出 buildId 與第 1 頁的 pageProps
+   (buyingPrices、lastPage)。
+2. 其餘頁面改抓 Next.js 的資料路徑 /_next/data/<buildId>/<路徑>.json?<相同查詢參數>，
+   只回傳 pageProps 的 JSON，不含 HTML。
+3. 已知 lastPage 時，第 2 頁之後並行抓取 (每個網站的並行數與間隔由 fetcher 的
+   HostThrottle 控管)；沒有 lastPage 時逐頁抓到空頁為止。
+4. 網站重新部署導致 buildId 失效 (404) 時，重新讀取 HTML 取得新的 buildId 後再試一次；
+   仍失敗則改從該頁 HTML 的 __NEXT_DATA__ 解析。
+
+每頁的 buyingPrices 一到就交給 on_page(records, page)，呼叫端可直接送進 ingest。
+重試後仍失敗的頁面不會被略過: 其他頁面處理完後拋出 PagesFailed (列出失敗的頁碼)，
+呼叫端據此保留斷點並把這次執行記為失敗。
+
+用法:
+    async with PageFetcher() as fetcher:
+        pages = await crawl_buying_prices(fetcher, "https://cardrush.media/vanguard/buying_prices", on_page)
+"""
+
+import asyncio
+import json
+import re
+from urllib.parse import urlencode, urlsplit
+
+import httpx
+
+from fetcher import FETCH_MAX_CONNECTIONS, gather_limited
+
+# 與原本瀏覽器版相同的查詢參數 (每頁 100 筆、依買取價排序、附商品圖片)
+BUYING_PRICES_QUERY = [
+    ("displayMode", "リスト"),
+    ("limit", "100"),
+    ("sort[key]", "amount"),
+    ("sort[order]", "desc"),
+    ("associations[]", "ocha_product"),
+    ("to_json_option[except][]", "original_image_source"),
+    ("to_json_option[except][]", "created_at"),
+    ("to_json_option[include][ocha_product][only][]", "id"),
+    ("to_json_option[include][ocha_product][methods][]", "image_source"),
+]
+
+NEXT_DATA_RE = re.compile(r'<script[^>]*\bid="__NEXT_DATA__"[^>]*>(.*?)</script>', re.S)
+
+
+class PagesFailed(Exception):
+    """買取表的部分頁面重試後仍抓取失敗 (其餘頁面已交給 on_page)"""
+
+    def __init__(self, list_url: str, pages, pages_done: int):
+        self.list_url = list_url
+        self.pages = sorted(pages)
+        self.pages_done = pages_done
+        super().__init__(f"{list_url}: {len(self.pages)} 頁抓取失敗 (第 {', '.join(map(str, self.pages[:10]))} 頁)，"
+                         f"成功 {pages_done} 頁")
+
+
+def parse_next_data(html: str) -> dict:
+    """從 HTML 取出 __NEXT_DATA__ 的 JSON (找不到時拋出 ValueError)"""
+    match = NEXT_DATA_RE.search(html)
+    if not match:
+        raise ValueError("頁面中沒有 __NEXT_DATA__")
+    return json.loads(match.group(1))
+
+
+class NextDataSource:
+    """一個 Next.js 頁面的資料來源: 以查詢參數取得各頁的 pageProps"""
+
+    def __init__(self, fetcher, page_url: str, query=BUYING_PRICES_QUERY):
+        parts = urlsplit(page_url)
+        self.fetcher = fetcher
+        self.page_url = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.path = parts.path.rstrip("/") or "/index"
+        self.query = list(query)
+        self.build_id = None
+        self._refresh_lock = asyncio.Lock()
+
+    def _query_string(self, page: int) -> str:
+        return urlencode(self.query + [("page", str(page))])
+
+    def html_url(self, page: int) -> str:
+        return f"{self.page_url}?{self._query_string(page)}"
+
+    def data_url(self, page: int) -> str:
+        return f"{self.origin}/_next/data/{self.build_id}{self.path}.json?{self._query_string(page)}"
+
+    async def from_html(self, page: int) -> dict:
+        """抓取 HTML 並解析 __NEXT_DATA__ (同時更新 buildId)，回傳 pageProps"""
+        data = parse_next_data(await self.fetcher.get_html(self.html_url(page)))
+        self.build_id = data.get("buildId") or self.build_id
+        return data["props"]["pageProps"]
+
+    async def _from_data_route(self, page: int) -> dict:
+        return json.loads(await self.fetcher.get_html(self.data_url(page)))["pageProps"]
+
+    async def page_props(self, page: int) -> dict:
+        """取得某一頁的 pageProps: 優先走資料路徑，buildId 失效時重新讀取 HTML"""
+        if self.build_id is None:
+            return await self.from_html(page)
+        stale_build = self.build_id
+        try:
+            return await self._from_data_route(page)
+        except (httpx.HTTPStatusError, ValueError, KeyError) as e:
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            print(f"   -> ⚠️ 第 {page} 頁資料路徑失敗 ({status or type(e).__name__})，改從 HTML 讀取。")
+
+        # 並行的其他頁面同時失敗時，只由第一個重新讀取 buildId，其餘沿用新的 buildId
+        async with self._refresh_lock:
+            if self.build_id == stale_build:
+                props = await self.from_html(page)
+                if self.build_id != stale_build:
+                    print(f"   -> ✅ 已更新 buildId: {self.build_id}")
+                return props
+        return await self._from_data_route(page)
+
+
+async def crawl_buying_prices(fetcher, list_url: str, on_page, query=BUYING_PRICES_QUERY,
+                              concurrency: int = FETCH_MAX_CONNECTIONS) -> int:
+    """抓取買取表的所有頁面，每頁以 on_page(buyingPrices, page) 處理，回傳成功的頁數
+
+    on_page 經 fetcher.call_handler 在專用執行緒中依序呼叫 (各頁完成順序不固定)
+    有頁面重試後仍失敗時，其他頁面處理完後拋出 PagesFailed
+    """
+    source = NextDataSource(fetcher, list_url, query)
+    first = await source.from_html(1)
+    last_page = first.get("lastPage")
+    print(f"   -> {list_url}: buildId={source.build_id}，總頁數 {last_page or '未知'}")
+    pages_done = 0
+    failed = []
+
+    async def handle(props, page) -> bool:
+        nonlocal pages_done
+        records = props.get("buyingPrices") or []
+        if not records:
+            return False
+        print(f"     -> 頁面 {page}: {len(records)} 條買取情報")
+        await fetcher.call_handler(on_page, records, page)
+        pages_done += 1
+        return True
+
+    if not await handle(first, 1):
+        return pages_done
+
+    if last_page:
+        async def fetch(page):
+            try:
+                await handle(await source.page_props(page), page)
+            except Exception as e:
+                print(f"     -> ❌ 頁面 {page} 抓取失敗: {str(e)[:80]}")
+                failed.append(page)
+
+        await gather_limited([fetch(page) for page in range(2, int(last_page) + 1)], concurrency)
+    else:
+        # 沒有總頁數時逐頁抓取，直到空頁
+        page = 2
+        while True:
+            try:
+                if not await handle(await source.page_props(page), page):
+                    break
+            except Exception as e:
+                print(f"     -> ❌ 頁面 {page} 抓取失敗: {str(e)[:80]}")
+                failed.append(page)
+                break
+            page += 1
+    if failed:
+        raise PagesFailed(list_url, failed, pages_done)
+    return pages_done
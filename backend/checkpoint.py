@@ -0,0 +1,168 @@
+"""
+爬蟲斷點續傳 (Checkpoint / Resume)
+
+run_all_scrapers.py 在逾時或 socket 錯誤時會終止子腳本並從頭重跑；Card Rush 一次要跑
+3 小時，在第 50/60 個系列失敗就等於白做。本模組為每個爬蟲保存一份斷點日誌
+(CHECKPOINT_DIR/<名稱>.jsonl)，每抓完一頁就追加一行並 fsync:
+
+    {"t": "start", "at": "..."}                                     # 檔頭 (建立時間)
+    {"t": "page", "series": url, "page": 3, "last": false, "rows": [...]}
+    {"t": "mark", "key": "history_written", "value": 400}           # 其他進度 (例如寫入位置)
+
+- 每頁只追加本頁的資料，不必重寫整份狀態；被強制終止 (kill) 時最多遺失正在處理的那一頁，
+  寫到一半的最後一行在讀取時略過。
+- 重跑時 load() 讀回日誌: 已完成的系列直接略過，未完成的系列從下一頁繼續，
+  已抓到的資料 (rows) 以 replay() 依原順序交還給爬蟲，視同剛抓到。
+- 成功結束時呼叫 clear() 刪除日誌；下一次正常執行從頭開始。
+- 指令列加上 --fresh (fresh_requested()) 或日誌超過 CHECKPOINT_MAX_AGE_HOURS
+  (預設 12 小時，價格已過時) 時忽略舊日誌，重新開始。
+
+用法:
+    checkpoint = ScrapeCheckpoint("cardrush_vg", fresh=fresh_requested())
+    checkpoint.load()
+    for rows in checkpoint.replay(): ...                      # 還原已抓到的資料
+    if checkpoint.is_done(url): continue
+    page = checkpoint.next_page(url)
+    ...
+    checkpoint.page_done(url, page, rows, last=not has_next)
+    ...
+    checkpoint.clear()
+"""
+
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+# --- [設定區域] ---
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "checkpoints"
+)
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv("CHECKPOINT_MAX_AGE_HOURS", "12"))
+
+FRESH_FLAG = "--fresh"
+
+
+def fresh_requested(argv=None) -> bool:
+    """指令列是否要求忽略斷點、重新開始"""
+    return FRESH_FLAG in (sys.argv[1:] if argv is None else argv)
+
+
+class ScrapeCheckpoint:
+    def __init__(self, name: str, fresh: bool = False, directory: str = CHECKPOINT_DIR,
+                 max_age_hours: float = CHECKPOINT_MAX_AGE_HOURS):
+        self.name = name
+        self.fresh = fresh
+        self.path = os.path.join(directory, re.sub(r"[^\w.-]+", "_", name) + ".jsonl")
+        self.max_age = timedelta(hours=max_age_hours)
+        self.pages = {}      # series -> [rows, rows, ...] (依頁序)
+        self.last_page = {}  # series -> 最後完成的頁碼
+        self.done = set()
+        self.marks = {}
+        self._file = None
+
+    # --- [讀取] ---
+
+    def load(self) -> bool:
+        """讀回舊日誌，回傳是否為續傳"""
+        if self.fresh or not os.path.exists(self.path):
+            self._reset("已指定 --fresh，忽略舊的斷點，重新開始。" if self.fresh and os.path.exists(self.path) else None)
+            return False
+
+        entries = []
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break  # 被終止時寫到一半的最後一行
+                valid_bytes += len(line)
+        header = entries[0] if entries and entries[0].get("t") == "start" else None
+        if header is None or datetime.now() - datetime.fromisoformat(header["at"]) > self.max_age:
+            self._reset("斷點已過期或格式不符，重新開始。")
+            return False
+
+        for entry in entries[1:]:
+            kind = entry.get("t")
+            if kind == "page":
+                series = entry["series"]
+                self.pages.setdefault(series, []).append(entry["rows"])
+                self.last_page[series] = entry["page"]
+                if entry.get("last"):
+                    self.done.add(series)
+            elif kind == "mark":
+                self.marks[entry["key"]] = entry["value"]
+
+        # 截掉寫到一半的尾端，之後的紀錄才不會接在殘行後面
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_bytes)
+        self._file = open(self.path, "a", encoding="utf-8")
+        page_count = sum(len(pages) for pages in self.pages.values())
+        print(f"✅ 斷點續傳 ({self.name}): 已完成 {len(self.done)} 個系列，還原 {page_count} 頁資料。")
+        return True
+
+    def is_done(self, series: str) -> bool:
+        return series in self.done
+
+    def in_progress(self, series: str) -> bool:
+        """該系列已保存部分頁面但尚未完成 (上次在中途被終止或抓取失敗)"""
+        return series in self.last_page and series not in self.done
+
+    def next_page(self, series: str) -> int:
+        """該系列下一個要抓的頁碼 (沒有紀錄時為 1)"""
+        return self.last_page.get(series, 0) + 1
+
+    def replay(self, series: str = None):
+        """依原順序逐頁交還已保存的資料 (series=None 時為所有系列)"""
+        for key, pages in self.pages.items():
+            if series is None or key == series:
+                yield from pages
+
+    def value(self, key: str, default=None):
+        return self.marks.get(key, default)
+
+    # --- [寫入] ---
+
+    def page_done(self, series: str, page: int, rows: list, last: bool = False):
+        """一頁處理完畢: 保存本頁資料 (last=True 表示該系列已完成)"""
+        self.pages.setdefault(series, []).append(rows)
+        self.last_page[series] = page
+        if last:
+            self.done.add(series)
+        self._append({"t": "page", "series": series, "page": page, "last": last, "rows": rows})
+
+    def series_done(self, series: str):
+        """系列完成但最後一頁沒有資料時使用"""
+        if series not in self.done:
+            self.page_done(series, self.last_page.get(series, 0), [], last=True)
+
+    def mark(self, key: str, value):
+        self.marks[key] = value
+        self._append({"t": "mark", "key": key, "value": value})
+
+    def clear(self):
+        """整個流程成功結束: 刪除日誌"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _reset(self, message: str = None):
+        if message:
+            print(f"✅ 斷點 ({self.name}): {message}")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._append({"t": "start", "at": datetime.now().isoformat()})
+
+    def _append(self, entry: dict):
+        if self._file is None:
+            self._reset()
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
@@ -0,0 +1,340 @@
+"""
+冷歷史價格封存 (Parquet)
+
+market_prices 中超過 ARCHIVE_AFTER_DAYS 天的紀錄幾乎只在長期走勢圖中被讀取。
+本模組把它們搬到本機 Parquet 檔 (zstd 壓縮)，並從資料庫刪除，讓熱表保持精簡:
+
+    price_archive/
+        _watermark.json                         # 已封存到哪個時間點 (不含)
+        game=OP/month=2026-01/part-<起點>.parquet
+        game=UA/month=2026-01/part-<起點>.parquet
+
+讀取端 (價格歷史、每日平均) 透過 load_price_history / daily_price_totals
+同時讀取資料庫與封存檔: 早於水位線的部分讀 Parquet，其餘讀資料庫，兩邊不會重複。
+
+用法:
+    python cold_archive.py              # 封存超過 ARCHIVE_AFTER_DAYS 天的價格
+    python cold_archive.py --days 90    # 自訂天數
+"""
+
+import argparse
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database import engine, ANALYTICS_ENGINE, get_analytics_connection
+from models import Game, CardSet, Card, MarketPrice
+from price_codes import PRICE_TYPE_CODES
+
+# --- [設定區域] ---
+ARCHIVE_DIR = os.getenv("PRICE_ARCHIVE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "price_archive"
+)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "120"))
+ARCHIVE_BATCH_SIZE = 50000
+WATERMARK_FILE = "_watermark.json"
+
+# 封存紀錄的欄位與 MarketPrice 同名，讀取端可以和 ORM 物件混用
+ArchivedPrice = namedtuple(
+    "ArchivedPrice",
+    ["id", "card_id", "source", "price_type", "price_jpy", "stock_status", "timestamp", "data_hash"],
+)
+
+
+# --- [時間 / 水位線工具] ---
+
+def as_utc(dt: datetime) -> datetime:
+    """統一轉為 UTC aware 時間 (naive 時間視為本機時間)"""
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return dt.astimezone(timezone.utc)
+
+
+def get_watermark():
+    """早於此時間的價格都已封存到 Parquet (None = 尚未封存過)"""
+    path = os.path.join(ARCHIVE_DIR, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return datetime.fromisoformat(json.load(f)["archived_before"])
+
+
+def set_watermark(dt: datetime):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, WATERMARK_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"archived_before": as_utc(dt).isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def _archive_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()),
+        ("card_id", pa.int32()),
+        ("source", pa.string()),
+        ("price_type", pa.string()),
+        ("price_jpy", pa.int32()),
+        ("stock_status", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("data_hash", pa.int64()),
+    ])
+
+
+def _open_dataset():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(pa.schema([("game", pa.string()), ("month", pa.string())]), flavor="hive")
+    return ds.dataset(ARCHIVE_DIR, format="parquet", partitioning=partitioning)
+
+
+def _archive_filter(since=None, until=None, card_id=None, price_type=None):
+    """組合 Parquet 篩選條件；month 條件讓讀取只打開相關月份的目錄"""
+    import pyarrow.dataset as ds
+    expr = None
+
+    def both(a, b):
+        return b if a is None else a & b
+
+    if since is not None:
+        since = as_utc(since)
+        expr = both(expr, ds.field("month") >= since.strftime("%Y-%m"))
+        expr = both(expr, ds.field("timestamp") >= since)
+    if until is not None:
+        until = as_utc(until)
+        expr = both(expr, ds.field("month") <= until.strftime("%Y-%m"))
+        expr = both(expr, ds.field("timestamp") < until)
+    if card_id is not None:
+        expr = both(expr, ds.field("card_id") == card_id)
+    if price_type is not None:
+        expr = both(expr, ds.field("price_type") == price_type)
+    return expr
+
+
+# --- [封存 (寫入端)] ---
+
+def archive_old_prices(max_age_days: int = ARCHIVE_AFTER_DAYS, bind=engine):
+    """把早於 max_age_days 天的價格寫入 Parquet，並從資料庫移除"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    start = get_watermark()
+    if start is not None and start >= cutoff:
+        print(f"✅ {cutoff:%Y-%m-%d} 以前的價格已全部封存，無需操作。")
+        return 0
+
+    # 同一起點的重試會覆蓋同名檔案，不會產生重複資料
+    part_name = f"part-{start:%Y%m%dT%H%M%S}.parquet" if start else "part-initial.parquet"
+    schema = _archive_schema()
+
+    query = (
+        select(
+            MarketPrice.id, MarketPrice.card_id, MarketPrice.source, MarketPrice.price_type,
+            MarketPrice.price_jpy, MarketPrice.stock_status, MarketPrice.timestamp,
+            MarketPrice.data_hash, Game.code,
+        )
+        .select_from(MarketPrice)
+        .outerjoin(Card, Card.id == MarketPrice.card_id)
+        .outerjoin(CardSet, CardSet.id == Card.card_set_id)
+        .outerjoin(Game, Game.id == CardSet.game_id)
+        .where(MarketPrice.timestamp < cutoff)
+    )
+    if start is not None:
+        query = query.where(MarketPrice.timestamp >= start)
+
+    print(f">> 步驟 1/3: 正在匯出 {cutoff:%Y-%m-%d} 以前的價格到 Parquet...")
+    writers = {}   # (game, month) -> (ParquetWriter, 暫存路徑, 正式路徑)
+    buffers = {}   # (game, month) -> 待寫入的列
+    total = 0
+
+    def flush(key):
+        rows = buffers.pop(key, [])
+        if not rows:
+            return
+        if key not in writers:
+            game_code, month = key
+            directory = os.path.join(ARCHIVE_DIR, f"game={game_code}", f"month={month}")
+            os.makedirs(directory, exist_ok=True)
+            final_path = os.path.join(directory, part_name)
+            tmp_path = final_path + ".tmp"
+            writers[key] = (pq.ParquetWriter(tmp_path, schema, compression="zstd"), tmp_path, final_path)
+        writers[key][0].write_table(pa.Table.from_pylist(rows, schema=schema))
+
+    try:
+        with Session(bind) as db:
+            result = db.execute(query.execution_options(yield_per=ARCHIVE_BATCH_SIZE))
+            for row in result:
+                timestamp = as_utc(row.timestamp)
+                key = (row.code or "UNKNOWN", timestamp.strftime("%Y-%m"))
+                buffers.setdefault(key, []).append({
+                    "id": row.id, "card_id": row.card_id, "source": row.source,
+                    "price_type": row.price_type, "price_jpy": row.price_jpy,
+                    "stock_status": row.stock_status, "timestamp": timestamp,
+                    "data_hash": row.data_hash,
+                })
+                total += 1
+                if len(buffers[key]) >= ARCHIVE_BATCH_SIZE:
+                    flush(key)
+            for key in list(buffers):
+                flush(key)
+    finally:
+        for writer, tmp_path, final_path in writers.values():
+            writer.close()
+
+    # 全部寫完才把暫存檔換成正式檔
+    for writer, tmp_path, final_path in writers.values():
+        os.replace(tmp_path, final_path)
+    print(f"   -> ✅ 已寫入 {total} 筆紀錄 ({len(writers)} 個 遊戲/月份 檔案)。")
+
+    print(">> 步驟 2/3: 更新封存水位線...")
+    set_watermark(cutoff)
+
+    print(">> 步驟 3/3: 從資料庫移除已封存的紀錄...")
+    purge_hot_prices(bind, cutoff)
+    print("🎉 封存完成。")
+    return total
+
+
+def purge_hot_prices(bind, cutoff: datetime):
+    """移除資料庫中早於 cutoff 的價格: 整月份直接卸下分區，剩餘的部分月份再 DELETE"""
+    from partitions import detach_partitions_before
+    detach_partitions_before(bind, cutoff, drop=True)
+
+    with bind.begin() as conn:
+        deleted = conn.execute(
+            MarketPrice.__table__.delete().where(MarketPrice.__table__.c.timestamp < cutoff)
+        ).rowcount
+    print(f"   -> 🧹 DELETE 移除 {deleted} 筆部分月份的紀錄。")
+
+
+# --- [讀取端] ---
+
+def read_archived_prices(card_id=None, since=None, until=None, price_type=None):
+    """讀取封存的價格紀錄 (依時間排序，時間轉為本機時區)"""
+    if not os.path.isdir(ARCHIVE_DIR) or get_watermark() is None:
+        return []
+
+    table = _open_dataset().to_table(
+        columns=list(ArchivedPrice._fields),
+        filter=_archive_filter(since, until, card_id, price_type),
+    )
+    rows = [ArchivedPrice(**row) for row in table.to_pylist()]
+    rows = [row._replace(timestamp=row.timestamp.astimezone()) for row in rows]
+    rows.sort(key=lambda row: row.timestamp)
+    return rows
+
+
+def load_price_history(db: Session, card_id: int, since: datetime):
+    """讀取某卡 since 以後的價格紀錄，跨越資料庫與 Parquet 封存 (依時間排序)"""
+    watermark = get_watermark()
+    hot_since = since
+
+    archived = []
+    if watermark is not None and as_utc(since) < watermark:
+        archived = read_archived_prices(card_id=card_id, since=since, until=watermark)
+        hot_since = watermark
+
+    recent = db.query(MarketPrice).filter(
+        MarketPrice.card_id == card_id,
+        MarketPrice.timestamp >= hot_since
+    ).order_by(MarketPrice.timestamp).all()
+
+    return archived + recent
+
+
+def daily_price_totals(db: Session, since: datetime, price_type: str = "sell"):
+    """每個遊戲每日的價格總和與筆數 {(遊戲代碼, date): [總和, 筆數]}，跨越資料庫與封存"""
+    watermark = get_watermark()
+    if ANALYTICS_ENGINE == "duckdb":
+        return _duckdb_daily_totals(since, watermark, price_type)
+
+    hot_since = since
+    totals = {}
+
+    if watermark is not None and as_utc(since) < watermark:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        table = _open_dataset().to_table(
+            columns=["game", "timestamp", "price_jpy"],
+            filter=_archive_filter(since, watermark, price_type=price_type) & (pc.field("price_jpy") > 0),
+        )
+        table = table.append_column("day", pc.cast(table["timestamp"], pa.date32()))
+        grouped = table.group_by(["game", "day"]).aggregate([("price_jpy", "sum"), ("price_jpy", "count")])
+        for row in grouped.to_pylist():
+            totals[(row["game"], row["day"])] = [row["price_jpy_sum"], row["price_jpy_count"]]
+        hot_since = watermark
+
+    day = func.date(MarketPrice.timestamp)
+    rows = db.query(
+        Game.code, day, func.sum(MarketPrice.price_jpy), func.count(MarketPrice.id)
+    ).join(Card, Card.id == MarketPrice.card_id).join(CardSet).join(Game).filter(
+        MarketPrice.price_type == price_type,
+        MarketPrice.price_jpy > 0,
+        MarketPrice.timestamp >= hot_since
+    ).group_by(Game.code, day).all()
+
+    for game_code, date_value, price_sum, count in rows:
+        if isinstance(date_value, str):
+            date_value = datetime.strptime(date_value, "%Y-%m-%d").date()
+        entry = totals.setdefault((game_code, date_value), [0, 0])
+        entry[0] += int(price_sum or 0)
+        entry[1] += int(count or 0)
+
+    return totals
+
+
+def _duckdb_daily_totals(since: datetime, watermark, price_type: str):
+    """同 daily_price_totals，但由 DuckDB 一次掃描資料庫與 Parquet (ANALYTICS_ENGINE=duckdb)"""
+    since = as_utc(since)
+    code = PRICE_TYPE_CODES[price_type]
+    hot_since = max(since, watermark) if watermark is not None else since
+
+    sql = (
+        "SELECT g.code AS game, CAST(mp.timestamp AS DATE) AS day, SUM(mp.price_jpy), COUNT(*) "
+        "FROM hot.market_prices mp "
+        "JOIN hot.cards c ON c.id = mp.card_id "
+        "JOIN hot.card_sets cs ON cs.id = c.card_set_id "
+        "JOIN hot.games g ON g.id = cs.game_id "
+        "WHERE mp.price_type = ? AND mp.price_jpy > 0 AND mp.timestamp >= ? "
+        "GROUP BY 1, 2"
+    )
+    params = [code, hot_since]
+    if watermark is not None and since < watermark:
+        pattern = os.path.join(ARCHIVE_DIR, "**", "*.parquet").replace("'", "''")
+        sql += (
+            " UNION ALL "
+            "SELECT game, CAST(timestamp AS DATE) AS day, SUM(price_jpy), COUNT(*) "
+            f"FROM read_parquet('{pattern}', hive_partitioning = true, hive_types_autocast = false) "
+            "WHERE price_type = ? AND price_jpy > 0 AND timestamp >= ? AND timestamp < ? "
+            "GROUP BY 1, 2"
+        )
+        params += [price_type, since, watermark]
+
+    totals = {}
+    con = get_analytics_connection()
+    try:
+        for game_code, day, price_sum, count in con.execute(sql, params).fetchall():
+            entry = totals.setdefault((game_code, day), [0, 0])
+            entry[0] += int(price_sum or 0)
+            entry[1] += int(count or 0)
+    finally:
+        con.close()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將舊價格封存到 Parquet")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="封存超過 N 天的價格")
+    args = parser.parse_args()
+    archive_old_prices(max_age_days=args.days)
+
+
+if __name__ == "__main__":
+    main()
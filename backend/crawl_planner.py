@@ -0,0 +1,181 @@
+"""
+依變動率調整的爬取排程 (Crawl Planner)
+
+每次執行都重爬所有系列，但多年前的舊系列價格幾乎不動。本模組依每個系列
+(crawl_stats 表中的一個網址) 最近觀察到的變動率決定下次何時重訪:
+
+- 新出現的系列: 立即爬取，初始間隔為 CRAWL_MIN_INTERVAL (預設 1 小時)。
+- 上次有明顯變動 (變動比例 >= CRAWL_HOT_CHANGE_RATIO): 間隔重設為最短間隔。
+- 有少量變動: 間隔減半。
+- 完全沒有變動: 間隔加倍，最長 CRAWL_MAX_INTERVAL (預設 7 天)。
+  因此新彈維持每小時，穩定的舊系列逐步退到每天、每週。
+- 強制全量掃描: 距上次全量掃描超過 CRAWL_FULL_SWEEP_DAYS (預設 14 天)，
+  或設定 CRAWL_FULL_SWEEP=1 時，忽略排程爬取所有系列。
+
+變動率只統計到系列層級，不逐頁記錄: 列表頁必須從第 1 頁依「下一頁」連結依序抓取，無法單獨重訪某一頁；
+而且新商品上架或下架會讓後面的商品跨頁移動，同一頁碼每次對應的商品不同，逐頁的變動率沒有意義。
+
+「變動」的判定與 scraper_base.DBScraper 寫入時相同 (價格指紋與最新一筆不同，或是新卡)，
+由 DBScraper.record(series=...) 逐系列統計後交給 CrawlPlanner.finish()。
+
+用法:
+    python crawl_planner.py                # 列出各爬蟲的排程狀態
+    python crawl_planner.py --reset Uniari # 清除某爬蟲的排程 (下次全量掃描)
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import engine
+from models import CrawlStat
+
+# --- [設定區域] ---
+CRAWL_MIN_INTERVAL = int(os.getenv("CRAWL_MIN_INTERVAL", "60"))             # 分鐘
+CRAWL_MAX_INTERVAL = int(os.getenv("CRAWL_MAX_INTERVAL", str(7 * 24 * 60)))  # 分鐘
+CRAWL_FULL_SWEEP_DAYS = float(os.getenv("CRAWL_FULL_SWEEP_DAYS", "14"))
+CRAWL_HOT_CHANGE_RATIO = float(os.getenv("CRAWL_HOT_CHANGE_RATIO", "0.05"))
+CRAWL_FULL_SWEEP = os.getenv("CRAWL_FULL_SWEEP", "0") == "1"
+
+CHANGE_RATE_ALPHA = 0.3     # 變動率指數移動平均的權重
+FULL_SWEEP_KEY = "*"
+
+
+def next_interval(current: int, rows_seen: int, rows_changed: int) -> int:
+    """依本次爬取結果計算下次重訪間隔 (分鐘)"""
+    if current is None:
+        current = CRAWL_MIN_INTERVAL
+    if rows_changed == 0:
+        return min(current * 2, CRAWL_MAX_INTERVAL)
+    if rows_changed / rows_seen >= CRAWL_HOT_CHANGE_RATIO:
+        return CRAWL_MIN_INTERVAL
+    return max(current // 2, CRAWL_MIN_INTERVAL)
+
+
+def _upsert_statement(bind):
+    """INSERT ... ON CONFLICT (scraper, url) DO UPDATE (依方言選擇語法)"""
+    dialect = postgresql if bind.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(CrawlStat.__table__)
+    columns = ("last_crawled_at", "next_due_at", "interval_minutes", "change_rate", "rows_seen", "rows_changed", "crawls")
+    return stmt.on_conflict_do_update(
+        index_elements=["scraper", "url"],
+        set_={column: stmt.excluded[column] for column in columns},
+    )
+
+
+class CrawlPlanner:
+    def __init__(self, scraper: str, bind=engine, force_full: bool = CRAWL_FULL_SWEEP):
+        self.scraper = scraper
+        self.bind = bind
+        self.force_full = force_full
+        self.stats = {}         # url -> CrawlStat 欄位 dict
+        self.full_sweep = True
+        self.started_at = None
+
+    def load(self):
+        self.started_at = datetime.now(timezone.utc)
+        with self.bind.connect() as conn:
+            rows = conn.execute(select(CrawlStat.__table__).where(CrawlStat.scraper == self.scraper)).mappings()
+            self.stats = {row["url"]: dict(row) for row in rows}
+
+        last_full = self.stats.get(FULL_SWEEP_KEY, {}).get("last_crawled_at")
+        cycle = timedelta(days=CRAWL_FULL_SWEEP_DAYS)
+        self.full_sweep = self.force_full or last_full is None or self.started_at - last_full >= cycle
+        if self.full_sweep:
+            print(f"✅ 排程: 本次為全量掃描 ({self.scraper})。")
+
+    def select(self, urls, resume=None):
+        """從本次發現的系列中挑出到期的 (保留原順序)
+
+        resume(url): 該系列有未完成的斷點時回傳 True；這些系列一律選入，從斷點繼續抓完
+        """
+        if self.full_sweep:
+            return list(urls)
+        due = []
+        for url in urls:
+            stat = self.stats.get(url)
+            if (stat is None or stat["next_due_at"] is None or stat["next_due_at"] <= self.started_at
+                    or (resume is not None and resume(url))):
+                due.append(url)
+        print(f"✅ 排程: {len(due)}/{len(urls)} 個系列到期，略過 {len(urls) - len(due)} 個。")
+        return due
+
+    def finish(self, series_stats: dict, complete: bool = True):
+        """寫回本次爬取的結果 series_stats: {url: (rows_seen, rows_changed)}
+
+        只應傳入已完整爬完的系列 (部分爬取的系列若寫入 next_due_at，重跑時會被視為未到期而略過，斷點永遠補不完)。
+        complete=False: 本次執行未完成 (中途出錯)，不記錄全量掃描時間
+        """
+        now = datetime.now(timezone.utc)
+        rows = []
+        for url, (rows_seen, rows_changed) in series_stats.items():
+            if rows_seen == 0:
+                continue  # 抓取失敗或沒有商品，保持原排程 (下次仍到期)
+            stat = self.stats.get(url, {})
+            interval = next_interval(stat.get("interval_minutes"), rows_seen, rows_changed)
+            ratio = rows_changed / rows_seen
+            previous_rate = stat.get("change_rate")
+            rows.append({
+                "scraper": self.scraper,
+                "url": url,
+                "last_crawled_at": now,
+                "next_due_at": now + timedelta(minutes=interval),
+                "interval_minutes": interval,
+                "change_rate": ratio if previous_rate is None
+                else CHANGE_RATE_ALPHA * ratio + (1 - CHANGE_RATE_ALPHA) * previous_rate,
+                "rows_seen": rows_seen,
+                "rows_changed": rows_changed,
+                "crawls": (stat.get("crawls") or 0) + 1,
+            })
+        if not rows:
+            return
+        series_count = len(rows)
+        changed_count = sum(1 for r in rows if r["rows_changed"])
+        if self.full_sweep and complete:
+            rows.append({
+                "scraper": self.scraper, "url": FULL_SWEEP_KEY, "last_crawled_at": now, "next_due_at": None,
+                "interval_minutes": None, "change_rate": None, "rows_seen": sum(r["rows_seen"] for r in rows),
+                "rows_changed": sum(r["rows_changed"] for r in rows), "crawls": 0,
+            })
+
+        with self.bind.begin() as conn:
+            conn.execute(_upsert_statement(self.bind), rows)
+        print(f"✅ 排程已更新: {series_count} 個系列，其中 {changed_count} 個有變動。")
+
+
+def print_report(bind=engine):
+    now = datetime.now(timezone.utc)
+    query = select(
+        CrawlStat.scraper,
+        func.count().label("series"),
+        func.sum(case((CrawlStat.next_due_at <= now, 1), else_=0)).label("due"),
+        func.avg(CrawlStat.interval_minutes).label("avg_interval"),
+        func.avg(CrawlStat.change_rate).label("avg_rate"),
+    ).where(CrawlStat.url != FULL_SWEEP_KEY).group_by(CrawlStat.scraper)
+    with bind.connect() as conn:
+        rows = conn.execute(query).all()
+    if not rows:
+        print("尚無排程紀錄。")
+    for scraper, series, due, avg_interval, avg_rate in rows:
+        print(f"  {scraper:<12} 系列 {series:>4}  到期 {int(due or 0):>4}  "
+              f"平均間隔 {avg_interval / 60:6.1f} 小時  平均變動率 {avg_rate or 0:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="爬取排程狀態")
+    parser.add_argument("--reset", metavar="SCRAPER", help="清除某爬蟲的排程紀錄")
+    args = parser.parse_args()
+
+    if args.reset:
+        with engine.begin() as conn:
+            deleted = conn.execute(delete(CrawlStat).where(CrawlStat.scraper == args.reset)).rowcount
+        print(f"✅ 已清除 {args.reset} 的 {deleted} 筆排程紀錄。")
+        return
+    print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,36 @@
-from database import engine, Base
-from models import Game, CardSet, Card, MarketPrice, InternalPrice
+from database import engine, Base, IS_SQLITE, SQLITE_PATH
+from models import Game, CardSet, Card, MarketPrice, InternalPrice, CrawlStat, ListingMapping, ScraperRun
+from partitions import ensure_partitions
+from price_codes import seed_code_tables
 
 def init_db():
-    print(">> 正在連接 PostgreSQL 資料庫...")
+    if IS_SQLITE:
+        print(f">> 正在連接 SQLite 資料庫 ({SQLITE_PATH})...")
+    else:
+        print(">> 正在連接 PostgreSQL 資料庫...")
     print(">> 正在建立資料庫表格 (Schema)...")
     
     # 這行指令會根據 models.py 的定義，在資料庫中自動建立所有表格
     # 如果表格已存在，它會跳過 (不會刪除現有資料)
     Base.metadata.create_all(bind=engine)
     
+    # 寫入價格來源 / 庫存狀態查找表的代碼
+    with engine.begin() as conn:
+        seed_code_tables(conn)
+    
+    # market_prices 是按月分區表，預先建立當月與未來月份的分區 (SQLite 模式略過)
+    ensure_partitions()
+    
     print("✅ 資料庫表格建立完成！")
     print("   - games")
     print("   - card_sets")
     print("   - cards")
-    print("   - market_prices")
+    print("   - market_prices" + ("" if IS_SQLITE else " (按月分區)"))
+    print("   - price_sources / stock_statuses")
     print("   - internal_prices")
+    print("   - crawl_stats")
+    print("   - listing_mappings")
+    print("   - scraper_runs")
 
 if __name__ == "__main__":
     try:
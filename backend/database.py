@@ -1,27 +1,190 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.types import TypeDecorator
+from datetime import timezone
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # 載入 .env 設定
 load_dotenv()
 
+# 資料庫後端: "postgres" (預設) 或 "sqlite" (嵌入式，單機/CI 免安裝資料庫伺服器)
+DB_BACKEND = os.getenv("DB_BACKEND", "postgres").lower()
+IS_POSTGRES = DB_BACKEND != "sqlite"
+IS_SQLITE = not IS_POSTGRES
+
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "tcge_db")
 
-# 構建資料庫連接字串
-SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# SQLite 模式的資料庫檔案 (預設為 backend/tcge.db)
+SQLITE_PATH = os.getenv("SQLITE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tcge.db"
+)
+
+# 分析查詢引擎: 設為 "duckdb" 時，每日彙總等分析查詢改由 DuckDB 執行 (需安裝 duckdb)
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "").lower()
 
-# 建立引擎
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# 構建資料庫連接字串並建立引擎
+if IS_SQLITE:
+    SQLALCHEMY_DATABASE_URL = f"sqlite:///{SQLITE_PATH}"
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        # FastAPI 會在不同執行緒使用同一個連線池
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """每條新連線套用 SQLite 調校參數"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")      # 讀寫互不阻塞 (API 讀取時爬蟲仍可寫入)
+        cursor.execute("PRAGMA synchronous=NORMAL")    # WAL 下安全且大幅減少 fsync
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA busy_timeout=30000")    # 其他程序寫入時等待，而非立即報錯
+        cursor.execute("PRAGMA cache_size=-65536")     # 64 MB 頁面快取
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")   # 256 MB 記憶體映射讀取
+        cursor.close()
+else:
+    SQLALCHEMY_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 # 建立 SessionLocal 類別
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- [讀取副本 (Read Replica) 設定 - 可選] ---
+# 設定 REPLICA_DB_HOST 後，儀表板/匯出/搜尋/歷史等唯讀查詢會改走副本，
+# 寫入與「寫後即讀」的後台流程仍然使用主庫 (engine)。
+# 未填寫的帳號/密碼/資料庫名稱沿用主庫設定。
+REPLICA_DB_HOST = os.getenv("REPLICA_DB_HOST", "")
+REPLICA_DB_PORT = os.getenv("REPLICA_DB_PORT", DB_PORT)
+REPLICA_DB_USER = os.getenv("REPLICA_DB_USER", DB_USER)
+REPLICA_DB_PASSWORD = os.getenv("REPLICA_DB_PASSWORD", DB_PASSWORD)
+REPLICA_DB_NAME = os.getenv("REPLICA_DB_NAME", DB_NAME)
+
+# 副本落後超過此秒數時，自動改回主庫查詢
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "30"))
+# 延遲檢查結果的快取秒數 (避免每個請求都查一次副本狀態)
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "10"))
+# 連線副本與單一查詢的逾時 (秒)；副本無回應時很快改回主庫，不讓請求卡在 TCP 連線上
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "3"))
+REPLICA_STATEMENT_TIMEOUT = int(os.getenv("REPLICA_STATEMENT_TIMEOUT", "30"))
+
+replica_engine = None
+ReplicaSessionLocal = None
+
+if REPLICA_DB_HOST and IS_POSTGRES:
+    SQLALCHEMY_REPLICA_URL = (
+        f"postgresql://{REPLICA_DB_USER}:{REPLICA_DB_PASSWORD}"
+        f"@{REPLICA_DB_HOST}:{REPLICA_DB_PORT}/{REPLICA_DB_NAME}"
+    )
+    replica_engine = create_engine(
+        SQLALCHEMY_REPLICA_URL,
+        pool_pre_ping=True,
+        connect_args={
+            "connect_timeout": REPLICA_CONNECT_TIMEOUT,
+            "options": f"-c statement_timeout={REPLICA_STATEMENT_TIMEOUT * 1000}",
+        },
+    )
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+# 副本延遲狀態快取: {"checked_at": 上次檢查時間, "healthy": 是否可用, "lag": 延遲秒數, "checking": 是否有執行緒正在檢查}
+_replica_state = {"checked_at": 0.0, "healthy": False, "lag": None, "checking": False}
+_replica_state_lock = threading.Lock()
+
+
+def get_replica_lag():
+    """查詢副本的重播延遲 (秒)。副本已追上或不是備庫時回傳 0。"""
+    with replica_engine.connect() as conn:
+        lag = conn.execute(text(
+            "SELECT CASE "
+            "  WHEN NOT pg_is_in_recovery() THEN 0 "
+            "  WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "  ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+            "END"
+        )).scalar()
+    return float(lag or 0)
+
+
+def replica_is_healthy():
+    """判斷副本是否可用 (已設定、連得上、且延遲在容許範圍內)"""
+    if replica_engine is None:
+        return False
+
+    now = time.monotonic()
+    # 鎖只用來讀取 / 發佈快取結果: 過期時由一個執行緒負責檢查，其他請求沿用上次的結果，不等待副本
+    with _replica_state_lock:
+        if now - _replica_state["checked_at"] < REPLICA_LAG_CHECK_INTERVAL or _replica_state["checking"]:
+            return _replica_state["healthy"]
+        _replica_state["checking"] = True
+
+    try:
+        lag = get_replica_lag()
+        healthy = lag <= REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            print(f"⚠️ 讀取副本延遲 {lag:.1f} 秒 (上限 {REPLICA_MAX_LAG_SECONDS:.0f} 秒)，暫時改用主庫。")
+    except Exception as e:
+        lag = None
+        healthy = False
+        print(f"⚠️ 讀取副本無法連線，暫時改用主庫: {e}")
+
+    with _replica_state_lock:
+        _replica_state.update(checked_at=time.monotonic(), healthy=healthy, lag=lag, checking=False)
+    return healthy
+
+
+# --- [跨資料庫的時間欄位] ---
+class TZDateTime(TypeDecorator):
+    """帶時區的時間欄位
+
+    PostgreSQL 原生支援 timestamptz，直接透傳。
+    SQLite 沒有時區型別: 一律以 UTC (無時區字串) 儲存，與 CURRENT_TIMESTAMP 預設值一致，
+    讀出時再標記為 UTC，讓兩種後端的比較與排序結果相同。
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        if value.tzinfo is None:
+            value = value.astimezone()  # naive 時間視為本機時間 (與 PostgreSQL 行為一致)
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return value.replace(tzinfo=timezone.utc)
+
+
+# --- [DuckDB 分析連線 - 可選] ---
+def get_analytics_connection():
+    """建立 DuckDB 連線，並以唯讀方式掛載主資料庫為 hot schema
+
+    SQLite 模式透過 DuckDB 的 sqlite 擴充直接讀取資料庫檔，
+    PostgreSQL 模式透過 postgres 擴充讀取；時區固定為 UTC。
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute("SET TimeZone = 'UTC'")
+    if IS_SQLITE:
+        con.execute("INSTALL sqlite; LOAD sqlite;")
+        con.execute(f"ATTACH '{SQLITE_PATH}' AS hot (TYPE sqlite, READ_ONLY)")
+    else:
+        con.execute("INSTALL postgres; LOAD postgres;")
+        dsn = f"host={DB_HOST} port={DB_PORT} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}"
+        con.execute(f"ATTACH '{dsn}' AS hot (TYPE postgres, READ_ONLY)")
+    return con
+
+
 # 建立 Base 類別，供 models.py 繼承
 Base = declarative_base()
 
@@ -32,3 +195,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 依賴項：獲取唯讀查詢用的 Session (副本可用時走副本，否則回退主庫)
+def get_read_db():
+    db = ReplicaSessionLocal() if replica_is_healthy() else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,254 @@
+"""
+跨來源卡片實體解析 (Entity Resolution)
+
+同一張卡在 Mercadop / Akiba / Uniari / Card Rush 的商品名稱與寫法各不相同，
+而卡片身分只是 (卡號, 版本)，版本又由各爬蟲各自猜測 (只有 Mercadop 看名稱中的「パラレル」)，
+因此同一張平行卡在其他來源被併進一般版 (collide)，版本字串寫法不同時又各建一張 (fragment)。
+
+本模組在寫入前把每筆商品 (listing) 解析到 cards 的一列:
+
+1. 正規化商品名稱: 全形轉半形、轉大寫、去掉卡號，取出括號中的稀有度與版本標記
+   (【P-SR】、(パラレル)、未開封 ...)，其餘文字切成詞彙。
+2. 阻斷索引 (blocking index): 開始時一次載入 cards，依卡號分組、組內依標準版本分桶。
+   每筆商品只和同卡號、同標準版本的少數候選比對，不必掃描全表。
+   既有卡片的版本字串 (Parallel / パラレル ...) 套用同一套標準化，因此不會再分裂出新卡。
+3. 同桶有多張候選時 (過去已分裂的資料)，依稀有度、系列代碼與名稱詞彙的重疊度評分，
+   同分取最早建立的一張；沒有候選時才建立新卡 (以標準版本為版本)。
+4. 解析結果寫入 listing_mappings: (來源, 商品指紋) -> card_id。
+   之後的執行直接查表 (O(1))，不再重新比對；規則修改後可用 --reset 清除某來源重新解析。
+
+由 scraper_base.IdentityCache 在每批寫入前呼叫，爬蟲本身不需修改。
+
+用法:
+    python entity_resolution.py                  # 各來源的對應數量
+    python entity_resolution.py --reset MercadoP # 清除某來源的對應 (下次重新解析)
+"""
+
+import argparse
+import hashlib
+import re
+from collections import Counter, namedtuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from card_numbers import normalize, version_hint
+from database import engine
+from models import Card, CardSet, ListingMapping
+
+# 版本字串的標準寫法 (既有卡片與爬蟲傳入的版本都先經過此表)
+VERSION_ALIASES = {
+    "NORMAL": "Normal",
+    "PARALLEL": "Parallel",
+    "パラレル": "Parallel",
+    "SEALED": "Sealed",
+    "未開封": "Sealed",
+}
+
+# 稀有度前綴 "P-" 表示平行卡 (【P-SR】 -> 稀有度 SR、版本 Parallel)
+PARALLEL_RARITY_PREFIX = "P-"
+
+# 正規化後的括號 (NFKC 已把全形括號轉為半形，【】 不受影響)
+BRACKET_RE = re.compile(r'[【\[(〔{<]([^】\])〕}>]*)[】\])〕}>]')
+RARITY_RE = re.compile(r'^(?:P-)?[A-Z]{1,4}\+?$')
+TOKEN_RE = re.compile(r'[0-9A-Z]+|[\u3040-\u30ff\u3400-\u9fff]+')   # 英數 / 假名 / 漢字
+
+# 候選評分的權重: 稀有度 > 系列代碼 > 名稱詞彙重疊度 (0 ~ 1)
+RARITY_WEIGHT = 2.0
+SET_WEIGHT = 1.0
+
+ListingSignals = namedtuple("ListingSignals", ["key", "version", "rarity", "tokens"])
+Candidate = namedtuple("Candidate", ["card_id", "version", "rarity", "set_code", "name"])
+
+
+def canonical_version(version: str) -> str:
+    """版本字串的標準寫法 (未登記的版本照原樣保留)"""
+    if not version:
+        return "Normal"
+    return VERSION_ALIASES.get(normalize(version).strip(), version)
+
+
+def canonical_rarity(rarity: str) -> str:
+    rarity = normalize(rarity or "").strip()
+    if rarity.startswith(PARALLEL_RARITY_PREFIX):
+        rarity = rarity[len(PARALLEL_RARITY_PREFIX):]
+    return "" if rarity == "UNKNOWN" else rarity
+
+
+def name_tokens(text: str) -> frozenset:
+    return frozenset(TOKEN_RE.findall(BRACKET_RE.sub(" ", normalize(text or ""))))
+
+
+def listing_key(card_number: str, rarity: str, version: str, title: str) -> int:
+    """商品指紋 (有號 64 位元整數): 卡號 + 稀有度 + 傳入版本 + 正規化名稱"""
+    data_string = f"{card_number}|{rarity}|{version}|{title}"
+    return int.from_bytes(hashlib.md5(data_string.encode()).digest()[:8], "big", signed=True)
+
+
+def listing_signals(card_number: str, name: str, rarity: str = "", version: str = "Normal") -> ListingSignals:
+    """從商品名稱取出指紋、標準版本、稀有度與名稱詞彙"""
+    text = normalize(name or "").replace(card_number.upper(), " ")
+
+    # 稀有度: 爬蟲已解析出的優先，否則取名稱中第一個像稀有度的括號內容
+    raw_rarity = normalize(rarity or "").strip()
+    if not raw_rarity or raw_rarity == "UNKNOWN":
+        raw_rarity = next((b.strip() for b in BRACKET_RE.findall(text) if RARITY_RE.match(b.strip())), "")
+
+    # 版本: 爬蟲明確指定的 (非 Normal) 優先，否則看名稱關鍵字與稀有度前綴
+    resolved = canonical_version(version)
+    if resolved == "Normal":
+        resolved = version_hint(text)
+        if resolved == "Normal" and raw_rarity.startswith(PARALLEL_RARITY_PREFIX):
+            resolved = "Parallel"
+
+    tokens = frozenset(TOKEN_RE.findall(BRACKET_RE.sub(" ", text)))
+    title = " ".join(sorted(tokens))
+    return ListingSignals(listing_key(card_number, raw_rarity, version, title), resolved,
+                          canonical_rarity(raw_rarity), tokens)
+
+
+class BlockingIndex:
+    """卡號 -> 標準版本 -> 候選卡片"""
+
+    def __init__(self):
+        self.blocks = {}
+        self._tokens = {}   # card_id -> 名稱詞彙 (只在需要評分時計算)
+
+    def __len__(self):
+        return sum(len(bucket) for block in self.blocks.values() for bucket in block.values())
+
+    def add(self, card_id: int, card_number: str, version: str, rarity: str, set_code: str, name: str):
+        bucket = self.blocks.setdefault(card_number, {}).setdefault(canonical_version(version), [])
+        bucket.append(Candidate(card_id, version, canonical_rarity(rarity), set_code or "", name or ""))
+
+    def candidates(self, card_number: str, version: str):
+        block = self.blocks.get(card_number)
+        return block.get(version, ()) if block else ()
+
+    def _score(self, candidate: Candidate, signals: ListingSignals, set_code: str) -> float:
+        score = 0.0
+        if signals.rarity and candidate.rarity == signals.rarity:
+            score += RARITY_WEIGHT
+        if set_code and candidate.set_code == set_code:
+            score += SET_WEIGHT
+        tokens = self._tokens.get(candidate.card_id)
+        if tokens is None:
+            tokens = self._tokens[candidate.card_id] = name_tokens(candidate.name)
+        if tokens and signals.tokens:
+            score += len(tokens & signals.tokens) / len(tokens | signals.tokens)
+        return score
+
+    def best(self, card_number: str, signals: ListingSignals, set_code: str = ""):
+        """回傳 (候選, 方法)；沒有候選時回傳 (None, None)"""
+        bucket = self.candidates(card_number, signals.version)
+        if not bucket:
+            return None, None
+        if len(bucket) == 1:
+            return bucket[0], "exact"
+        best = max(bucket, key=lambda c: (self._score(c, signals, set_code), -c.card_id))
+        return best, "scored"
+
+
+def _insert_ignore(bind):
+    if bind.dialect.name == "postgresql":
+        return postgresql.insert(ListingMapping.__table__).on_conflict_do_nothing()
+    if bind.dialect.name == "sqlite":
+        return sqlite.insert(ListingMapping.__table__).on_conflict_do_nothing()
+    return insert(ListingMapping.__table__)
+
+
+class EntityResolver:
+    """把商品解析到卡片，並記住 (來源, 商品指紋) -> card_id"""
+
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self.index = BlockingIndex()
+        self.mappings = {}          # (來源, 商品指紋) -> card_id
+        self.loaded_sources = set()
+        self.pending = []           # 尚未寫入 listing_mappings 的新對應
+        self.stats = Counter()      # 解析方法 -> 筆數
+        self._signals = {}          # (卡號, 名稱, 稀有度, 版本) -> ListingSignals (本次執行內快取)
+
+    def preload(self, conn):
+        """以一條查詢載入所有卡片建立阻斷索引，回傳 (卡號, 版本) -> card_id"""
+        query = select(Card.id, Card.card_number, Card.version, Card.rarity, Card.name, CardSet.code) \
+            .outerjoin(CardSet, CardSet.id == Card.card_set_id)
+        cards = {}
+        for id_, card_number, version, rarity, name, set_code in conn.execute(query):
+            cards[(card_number, version)] = id_
+            self.index.add(id_, card_number, version, rarity, set_code, name)
+        return cards
+
+    def _load_source(self, source: str):
+        with self.bind.connect() as conn:
+            rows = conn.execute(
+                select(ListingMapping.listing_key, ListingMapping.card_id).where(ListingMapping.source == source)
+            )
+            mapped = {(source, key): card_id for key, card_id in rows}
+        self.mappings.update(mapped)
+        self.loaded_sources.add(source)
+        print(f"✅ 已載入 {source} 的商品對應: {len(mapped)} 筆。")
+
+    def signals(self, card_number: str, name: str, rarity: str, version: str) -> ListingSignals:
+        raw = (card_number, name, rarity, version)
+        signals = self._signals.get(raw)
+        if signals is None:
+            signals = self._signals[raw] = listing_signals(card_number, name, rarity, version)
+        return signals
+
+    def match(self, row):
+        """解析一筆 StagedPrice，回傳 (ListingSignals, card_id 或 None, 方法)"""
+        if row.source not in self.loaded_sources:
+            self._load_source(row.source)
+        signals = self.signals(row.card_number, row.name, row.rarity, row.version)
+        card_id = self.mappings.get((row.source, signals.key))
+        if card_id is not None:
+            return signals, card_id, "mapped"
+        candidate, method = self.index.best(row.card_number, signals, row.set_code)
+        if candidate is None:
+            return signals, None, None
+        return signals, candidate.card_id, method
+
+    def remember(self, source: str, signals: ListingSignals, card_id: int, method: str):
+        self.stats[method] += 1
+        if (source, signals.key) in self.mappings:
+            return   # 已有對應 (查表命中，或本批稍早的同一商品)
+        self.mappings[(source, signals.key)] = card_id
+        self.pending.append({
+            "source_id": source, "listing_key": signals.key, "card_id": card_id, "method": method,
+        })
+
+    def save(self, conn):
+        """寫入本批新增的對應 (其他爬蟲同時寫入同一商品時略過)"""
+        if self.pending:
+            conn.execute(_insert_ignore(self.bind), self.pending)
+            self.pending = []
+
+
+def print_report(bind=engine):
+    query = select(ListingMapping.source, ListingMapping.method, func.count()) \
+        .group_by(ListingMapping.source, ListingMapping.method) \
+        .order_by(ListingMapping.source, ListingMapping.method)
+    with bind.connect() as conn:
+        rows = conn.execute(query).all()
+    if not rows:
+        print("尚無商品對應紀錄。")
+    for source, method, count in rows:
+        print(f"  {source:<22} {method or '-':<8} {count:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="商品 -> 卡片對應狀態")
+    parser.add_argument("--reset", metavar="SOURCE", help="清除某來源的商品對應")
+    args = parser.parse_args()
+
+    if args.reset:
+        with engine.begin() as conn:
+            deleted = conn.execute(delete(ListingMapping).where(ListingMapping.source == args.reset)).rowcount
+        print(f"✅ 已清除 {args.reset} 的 {deleted} 筆商品對應。")
+        return
+    print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+宣告式欄位擷取 (瀏覽器內 page.evaluate / 伺服器端解析 共用同一份規格)
+
+瀏覽器爬蟲原本以 page.content() 序列化整個 DOM，再用 BeautifulSoup 重新解析；
+100 筆的列表頁光是這一步就很慢。改為每頁一次 page.evaluate，在瀏覽器內
+直接取出需要的欄位，只回傳精簡的 JSON。
+
+規格 (spec) 是一個 dict:
+    item:    每筆資料的選擇器
+    require: (可選) 每筆資料內必須存在的選擇器，缺少時略過該筆
+    fields:  欄位名稱 -> 路徑
+             "span.figure"               元素的文字
+             "div.global_photo@data-src" 元素的屬性
+             "@class"                    資料本身 (item) 的屬性
+             找不到元素/屬性時為 None
+
+HTTP 抓取的頁面沒有瀏覽器，改在伺服器端以相同規格解析，
+兩者回傳的資料格式完全相同，爬蟲的解析邏輯不必區分來源:
+- parse_listing(): lxml (C 實作) + 預先編譯的 CSS 選擇器，供大量 HTTP 列表頁使用；
+  為頂層函數，可交給 ProcessPoolExecutor 並行 (見 fetcher.ListingParser)。
+- extract_from_soup(): BeautifulSoup 版本，未安裝 lxml 時的備援。
+
+用法:
+    records = await extract_in_page(page, SHOP_LIST_SPEC)     # Playwright
+    records, item_count = await extract_new_in_page(page, AKIBA_BUY_SPEC, start)   # 逐批處理新載入的列
+    records, item_count, has_next = parse_listing(html, SHOP_LIST_SPEC, "a.to_next_page")
+"""
+
+import re
+from functools import lru_cache
+
+# 價格文字 ("¥1,200", "1,200円") 中的數字
+PRICE_DIGITS_RE = re.compile(r"\d+")
+
+
+def parse_price(text: str) -> int:
+    """'¥1,200円' -> 1200 (沒有數字時拋出 ValueError，與舊版 int(re.sub(...)) 相同)"""
+    return int("".join(PRICE_DIGITS_RE.findall(text)))
+
+
+# --- [各來源規格] ---
+
+# Mercadop / Uniari (同一套商店系統，欄位都在 div.item_data 內)
+SHOP_LIST_SPEC = {
+    "item": "li.list_item_cell",
+    "require": ["div.item_data"],
+    "fields": {
+        "name": "div.item_data span.goods_name",
+        "price": "div.item_data span.figure",
+        "stock_class": "div.item_data p.stock@class",
+        "stock_text": "div.item_data p.stock",
+        "model": "div.item_data span.model_number_value",
+        "image": "div.item_data div.global_photo@data-src",
+        "item_class": "@class",
+    },
+}
+
+# Card Rush (商品名稱/價格不一定在 div.item_data 內，圖片取 img 的 src)
+CARDRUSH_LIST_SPEC = {
+    "item": "li.list_item_cell",
+    "require": ["div.item_data"],
+    "fields": {
+        "name": "span.goods_name",
+        "price": "span.figure",
+        "stock_class": "p.stock@class",
+        "stock_text": "p.stock",
+        "image": "div.global_photo img@src",
+        "item_class": "@class",
+    },
+}
+
+# Akiba 買取表
+AKIBA_BUY_SPEC = {
+    "item": "div.tbody > div.tr",
+    "require": ["div.td.td2", "div.td.td3", "div.td.td5 span.price"],
+    "fields": {
+        "name": "div.td.td2",
+        "model": "div.td.td3",
+        "price": "div.td.td5 span.price",
+        "image": "div.td.td1 img@src",
+    },
+}
+
+
+# --- [瀏覽器內擷取] ---
+
+_EXTRACT_JS = """
+(spec) => {
+    const require = spec.require || [];
+    const fields = Object.entries(spec.fields).map(([key, path]) => {
+        const at = path.lastIndexOf('@');
+        return at >= 0 ? [key, path.slice(0, at), path.slice(at + 1)] : [key, path, null];
+    });
+    return Array.from(document.querySelectorAll(spec.item))
+        .filter(el => require.every(sel => el.querySelector(sel)))
+        .map(el => {
+            const out = {};
+            for (const [key, sel, attr] of fields) {
+                const node = sel ? el.querySelector(sel) : el;
+                out[key] = !node ? null : attr ? node.getAttribute(attr) : node.textContent;
+            }
+            return out;
+        });
+}
+"""
+
+
+async def extract_in_page(page, spec: dict) -> list:
+    """在瀏覽器內依規格擷取所有資料 (一次 page.evaluate)"""
+    return await page.evaluate(_EXTRACT_JS, spec)
+
+
+# 只擷取第 start 筆之後的資料，並清空已擷取資料的內容 (元素本身保留，列數不變)
+_EXTRACT_NEW_JS = """
+([spec, start]) => {
+    const require = spec.require || [];
+    const fields = Object.entries(spec.fields).map(([key, path]) => {
+        const at = path.lastIndexOf('@');
+        return at >= 0 ? [key, path.slice(0, at), path.slice(at + 1)] : [key, path, null];
+    });
+    const items = Array.from(document.querySelectorAll(spec.item));
+    const records = [];
+    for (const el of items.slice(start)) {
+        if (require.every(sel => el.querySelector(sel))) {
+            const out = {};
+            for (const [key, sel, attr] of fields) {
+                const node = sel ? el.querySelector(sel) : el;
+                out[key] = !node ? null : attr ? node.getAttribute(attr) : node.textContent;
+            }
+            records.push(out);
+        }
+        el.textContent = '';
+    }
+    return [records, items.length];
+}
+"""
+
+
+async def extract_new_in_page(page, spec: dict, start: int):
+    """擷取第 start 筆之後新載入的資料，回傳 (records, 目前的項目總數)
+
+    已擷取的項目會被清空，逐批點擊「更多」時瀏覽器內的 DOM 不會隨列表變大
+    """
+    records, item_count = await page.evaluate(_EXTRACT_NEW_JS, [spec, start])
+    return records, item_count
+
+
+# --- [伺服器端擷取 (HTTP 頁面 / 備援)] ---
+
+@lru_cache(maxsize=None)
+def _split_path(path: str):
+    selector, _, attr = path.rpartition("@") if "@" in path else (path, "", "")
+    return selector, attr or None
+
+
+def _attr_value(node, attr: str):
+    value = node.get(attr)
+    # BeautifulSoup 把 class 等多值屬性拆成 list，與瀏覽器的 getAttribute 對齊為字串
+    return " ".join(value) if isinstance(value, list) else value
+
+
+def extract_items(items, spec: dict) -> list:
+    """對已選取的 BeautifulSoup 元素依規格擷取欄位"""
+    require = spec.get("require", ())
+    fields = [(key, *_split_path(path)) for key, path in spec["fields"].items()]
+    records = []
+    for item in items:
+        if any(item.select_one(selector) is None for selector in require):
+            continue
+        record = {}
+        for key, selector, attr in fields:
+            node = item.select_one(selector) if selector else item
+            if node is None:
+                record[key] = None
+            else:
+                record[key] = _attr_value(node, attr) if attr else node.get_text()
+        records.append(record)
+    return records
+
+
+def extract_from_soup(soup, spec: dict) -> list:
+    """以 BeautifulSoup 依規格擷取，結果格式與 extract_in_page 相同"""
+    return extract_items(soup.select(spec["item"]), spec)
+
+
+# --- [lxml 快速解析] ---
+
+@lru_cache(maxsize=None)
+def _css(selector: str):
+    """CSS 選擇器 -> 預先編譯的 XPath (只搜尋子孫元素，與 BeautifulSoup 的 select 相同)"""
+    from cssselect import HTMLTranslator
+    from lxml import etree
+    return etree.XPath(HTMLTranslator().css_to_xpath(selector, prefix="descendant::"))
+
+
+@lru_cache(maxsize=None)
+def _compile_spec(item: str, require: tuple, fields: tuple):
+    """把規格編譯為 CSSSelector (每個行程只編譯一次)"""
+    return (
+        _css(item),
+        [_css(selector) for selector in require],
+        [(key, _css(selector) if selector else None, attr)
+         for key, (selector, attr) in ((key, _split_path(path)) for key, path in fields)],
+    )
+
+
+def _first(selector, node):
+    found = selector(node)
+    return found[0] if found else None
+
+
+def parse_listing(html: str, spec: dict, next_selector: str = None):
+    """以 lxml 解析一個列表頁，回傳 (records, 項目數, 是否有下一頁)
+
+    項目數包含因 require 被略過的項目，用於判斷是否已到最後一頁。
+    未安裝 lxml 時改用 BeautifulSoup (結果相同，速度較慢)。
+    """
+    try:
+        from lxml import html as lxml_html
+    except ImportError:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        items = soup.select(spec["item"])
+        has_next = bool(next_selector) and soup.select_one(next_selector) is not None
+        return extract_items(items, spec), len(items), has_next
+
+    item_selector, require, fields = _compile_spec(
+        spec["item"], tuple(spec.get("require", ())), tuple(spec["fields"].items())
+    )
+    root = lxml_html.fromstring(html)
+    items = item_selector(root)
+    records = []
+    for item in items:
+        if any(not selector(item) for selector in require):
+            continue
+        record = {}
+        for key, selector, attr in fields:
+            node = _first(selector, item) if selector is not None else item
+            if node is None:
+                record[key] = None
+            else:
+                record[key] = node.get(attr) if attr else node.text_content()
+        records.append(record)
+    has_next = bool(next_selector) and bool(_css(next_selector)(root))
+    return records, len(items), has_next
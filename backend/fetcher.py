@@ -0,0 +1,365 @@
+"""
+HTTP 優先的頁面抓取層
+
+Mercadop / Uniari / Card Rush 的系列頁與商品列表 (li.list_item_cell、a.to_next_page)
+都是伺服器端渲染，不需要瀏覽器。本模組以 httpx.AsyncClient 抓取 HTML:
+
+- 連線池 + HTTP keep-alive: 同一網站的請求共用 TCP/TLS 連線。
+- 壓縮: 送出 Accept-Encoding: gzip, deflate (安裝 brotli 時另加 br)。
+- 每個網站 (host) 的並行上限與請求間隔由 host_throttle.HostThrottle 統一控管。
+- 429 / 5xx / 連線錯誤時以指數退避重試；每個回應的狀態碼回報給 rate_limiter，
+  同一網站的速率 (跨行程共用) 隨之加速或退避。
+- 回應中找不到預期的選擇器 (需要 JavaScript 的頁面) 或來源列於 browser_hosts 時，
+  才改用 browser_pool.BrowserPool 渲染 (延遲啟動，只在需要時開啟，與 HTTP 共用節流)。
+
+設定 FETCH_FIXTURES=record / replay 時，回應會錄製到 (或改由) fixture_store 的錄製檔，
+可以不連網重跑爬蟲與量測效能 (見 fixture_store.py、scraper_benchmark.py)。
+
+另提供 crawl_listing() 處理「系列第 1 頁 -> 下一頁 -> ...」的分頁流程；
+同一系列的頁面依序抓取 (需要上一頁的「下一頁」連結)，不同系列則並行。
+傳入 checkpoint 時每頁寫入斷點，重跑時從中斷處繼續 (見 checkpoint.py)。
+重試後仍失敗的頁面 (或 on_page 拋出例外) 會拋出 ListingFailed: 該系列不會標記完成，
+gather_limited 等其他系列結束後再拋出，爬蟲以失敗結束並保留斷點。
+列表頁以 extraction.parse_listing (lxml) 解析；PARSE_WORKERS > 1 時交給
+ListingParser 的行程池 (spawn 啟動，不 fork 多執行緒的行程)，大量頁面同時抵達時不會卡住事件迴圈。
+抓取的頁面數、位元組、重試、失敗與解析時間累加到目前的執行紀錄 (run_history.add_metrics)。
+
+用法:
+    async def sweep():
+        async with PageFetcher() as fetcher:
+            soup = await fetcher.fetch_soup(SERIES_PAGE_URL, wait_selector="a.cate_aa")
+            parser = ListingParser()
+            await gather_limited([crawl_listing(fetcher, parser, url, on_page, SHOP_LIST_SPEC) for url in series_urls])
+
+    run_async(sweep())
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup
+
+from extraction import parse_listing
+from fixture_store import FETCH_FIXTURES, make_transport, open_store
+from host_throttle import HostThrottle
+from rate_limiter import parse_retry_after
+from run_history import add_metrics
+
+# --- [設定區域] ---
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "30"))         # 單一請求逾時 (秒)
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "32"))
+# 列表頁解析行程數 (0 = 依 CPU 數自動決定，1 = 在事件迴圈內直接解析)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+USER_AGENT = os.getenv(
+    "FETCH_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0",
+)
+
+NEXT_PAGE_SELECTOR = "a.to_next_page"
+
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class ListingFailed(Exception):
+    """系列的某一頁重試後仍抓取失敗，或 on_page 處理失敗 (之前的頁面已處理並寫入斷點)"""
+
+    def __init__(self, series_url: str, page: int, error: Exception):
+        super().__init__(f"{series_url} 第 {page} 頁失敗: {str(error)[:200]}")
+        self.series_url = series_url
+        self.page = page
+        self.error = error
+
+
+def _accept_encoding() -> str:
+    try:
+        import brotli  # noqa: F401  httpx 只有在安裝 brotli 時才能解碼 br
+        return "gzip, deflate, br"
+    except ImportError:
+        return "gzip, deflate"
+
+
+class PageFetcher:
+    """以 HTTP 抓取伺服器端渲染的頁面，必要時退回瀏覽器
+
+    browser_hosts: 已知需要 JavaScript 的網站，一律以瀏覽器抓取
+    throttle: 可與其他抓取器共用，讓同一網站的總請求速率一致
+    fixtures: "record" / "replay" 時錄製或重播回應 (預設依 FETCH_FIXTURES)
+    """
+
+    def __init__(self, throttle: HostThrottle = None, timeout: float = FETCH_TIMEOUT,
+                 retries: int = FETCH_RETRIES, browser_hosts=(), fixtures: str = None):
+        self.fixtures = FETCH_FIXTURES if fixtures is None else fixtures
+        self.fixture_store = open_store() if self.fixtures else None
+        # 重播時沒有網站要保護，不需要請求間隔
+        self.throttle = throttle or (HostThrottle(min_interval=0) if self.fixtures == "replay" else HostThrottle())
+        self.retries = max(1, retries)   # 總嘗試次數 (含第一次)；0 或負數時仍至少送出一次
+        self.browser_hosts = set(browser_hosts)
+        limits = httpx.Limits(
+            max_connections=FETCH_MAX_CONNECTIONS,
+            max_keepalive_connections=FETCH_MAX_CONNECTIONS,
+            keepalive_expiry=30,
+        )
+        self.client = httpx.AsyncClient(
+            headers={
+                "User-Agent": USER_AGENT,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "ja,en-US;q=0.7,en;q=0.3",
+                "Accept-Encoding": _accept_encoding(),
+            },
+            limits=limits,
+            timeout=httpx.Timeout(timeout, connect=10),
+            follow_redirects=True,
+            transport=make_transport(self.fixtures, self.fixture_store, limits),
+        )
+        self._browser_pool = None
+        self._handler_executor = None
+        self.http_pages = 0
+        self.browser_pages = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def close(self):
+        if self._handler_executor is not None:
+            self._handler_executor.shutdown()
+        await self.client.aclose()
+        if self._browser_pool is not None:
+            await self._browser_pool.close()
+        if self.fixtures == "record":
+            self.fixture_store.save()
+
+    async def call_handler(self, func, *args):
+        """在專用的單一執行緒中依序執行頁面處理函數 (on_page)，回傳其結果
+
+        on_page 會送入寫入管線 (StagePipeline.put)，佇列已滿時會阻塞等待；在這裡執行時
+        只有送出該頁的協程等待，事件迴圈中其他頁面的抓取照常進行。單一執行緒保證各頁依序處理。
+        """
+        if self._handler_executor is None:
+            self._handler_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-handler")
+        return await asyncio.get_running_loop().run_in_executor(self._handler_executor, func, *args)
+
+    # --- [HTTP] ---
+
+    async def get_html(self, url: str) -> str:
+        """以 HTTP GET 取得 HTML (受每個網站的並行上限約束，失敗時退避重試)"""
+        return await self.request_text("GET", url)
+
+    async def request_text(self, method: str, url: str, **kwargs) -> str:
+        """送出任意方法的請求並取得回應文字 (例如「更多」按鈕背後的 POST)，節流與重試同 get_html
+
+        kwargs 直接交給 httpx (params / data / json / headers)
+        """
+        last_error = None
+        for attempt in range(self.retries):
+            async with self.throttle.slot(url):
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    response = None
+                    last_error = e
+                # 回報狀態碼，共用速率依此加速或退避 (連線錯誤視同被限流)
+                retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else 0.0
+                await self.throttle.report(url, response.status_code if response is not None else 0, retry_after)
+                if response is not None:
+                    if response.status_code not in _RETRY_STATUS:
+                        response.raise_for_status()
+                        self.http_pages += 1
+                        add_metrics(pages=1, bytes=len(response.content))
+                        return response.text
+                    last_error = httpx.HTTPStatusError(
+                        f"HTTP {response.status_code}", request=response.request, response=response
+                    )
+            # 退避時釋放名額，讓同網站的其他請求繼續
+            wait = retry_after or 2 ** attempt + random.uniform(0, 1)
+            if attempt < self.retries - 1:
+                add_metrics(retries=1)
+                await asyncio.sleep(wait)
+        add_metrics(errors=1)
+        raise last_error
+
+    # --- [瀏覽器 (備援)] ---
+
+    async def render_html(self, url: str, wait_selector: str = None) -> str:
+        """以瀏覽器渲染頁面後取得 HTML"""
+        if self.fixtures == "replay":
+            entry = self.fixture_store.get(url, kind="browser")
+            if entry is None:
+                raise LookupError(f"錄製檔中沒有瀏覽器渲染的頁面: {url}")
+            self.browser_pages += 1
+            add_metrics(pages=1, bytes=len(entry["body"].encode("utf-8")))
+            return entry["body"]
+        if self._browser_pool is None:
+            from browser_pool import BrowserPool
+            self._browser_pool = BrowserPool(throttle=self.throttle)
+
+        async with self._browser_pool.page(url) as page:
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            await self.throttle.report(url, response.status if response is not None else 0)
+            if wait_selector:
+                try:
+                    await page.wait_for_selector(wait_selector, timeout=15000)
+                except Exception:
+                    pass
+            self.browser_pages += 1
+            html = await page.content()
+        add_metrics(pages=1, bytes=len(html.encode("utf-8")))
+        if self.fixtures == "record":
+            self.fixture_store.put(url, html, kind="browser")
+        return html
+
+    # --- [對外介面] ---
+
+    async def fetch_soup(self, url: str, wait_selector: str = None) -> BeautifulSoup:
+        """取得解析後的頁面
+
+        wait_selector: 頁面應該包含的元素；HTTP 回應中沒有時視為需要 JavaScript，改用瀏覽器
+        """
+        if urlsplit(url).netloc in self.browser_hosts:
+            return BeautifulSoup(await self.render_html(url, wait_selector), "html.parser")
+
+        soup = BeautifulSoup(await self.get_html(url), "html.parser")
+        if wait_selector and soup.select_one(wait_selector) is None:
+            print(f"   -> ⚠️ HTTP 回應缺少 {wait_selector}，改用瀏覽器: {url}")
+            soup = BeautifulSoup(await self.render_html(url, wait_selector), "html.parser")
+        return soup
+
+
+def _timed_parse(html: str, spec: dict, next_selector: str):
+    """parse_listing 並回傳 (結果, 解析秒數)；在行程池中計時，不含排隊等待的時間"""
+    started = time.perf_counter()
+    result = parse_listing(html, spec, next_selector)
+    return result, time.perf_counter() - started
+
+
+class ListingParser:
+    """列表頁解析器: PARSE_WORKERS > 1 時在行程池中解析，否則直接在事件迴圈內解析"""
+
+    def __init__(self, workers: int = PARSE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self.pages = 0
+
+    async def parse(self, html: str, spec: dict, next_selector: str = NEXT_PAGE_SELECTOR):
+        """回傳 (records, 項目數, 是否有下一頁)"""
+        self.pages += 1
+        if self.workers <= 1:
+            result, seconds = _timed_parse(html, spec, next_selector)
+        else:
+            if self._executor is None:
+                # 以 spawn 啟動: 總指揮在同一行程內有多個執行緒 (Playwright、資料庫連線池、寫入管線)，
+                # fork 會複製其他執行緒持有中的鎖，子行程可能死結
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            loop = asyncio.get_running_loop()
+            result, seconds = await loop.run_in_executor(self._executor, _timed_parse, html, spec, next_selector)
+        add_metrics(parse_seconds=seconds)
+        return result
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+async def crawl_listing(fetcher: PageFetcher, parser: ListingParser, series_url: str, on_page, spec: dict,
+                        label: str = "", next_selector: str = NEXT_PAGE_SELECTOR, checkpoint=None) -> int:
+    """依序抓取一個系列的所有列表頁，每頁以 on_page(records) 處理，回傳頁數
+
+    records 依 spec 擷取 (與瀏覽器內 extraction.extract_in_page 的格式相同)。
+    HTTP 回應中沒有任何項目時，視為需要 JavaScript，改以瀏覽器渲染後再解析一次。
+    on_page 經 fetcher.call_handler 在專用執行緒中依序呼叫 (與其他系列交錯)；
+    寫入管線已滿而阻塞時，只有這個系列暫停，不會卡住事件迴圈。
+    checkpoint (checkpoint.ScrapeCheckpoint): 先把已保存的頁面交給 on_page，再從下一頁繼續；
+    每頁處理完即寫入斷點
+    某一頁重試後仍失敗或 on_page 拋出例外時拋出 ListingFailed (該系列不標記完成，重跑從該頁繼續)
+    """
+    host = urlsplit(series_url).netloc
+    current_page = 1
+    if checkpoint is not None:
+        for records in checkpoint.replay(series_url):
+            await fetcher.call_handler(on_page, records)
+        if checkpoint.is_done(series_url):
+            print(f"    -> {label} 已於上次完成，略過。")
+            return checkpoint.last_page[series_url]
+        current_page = checkpoint.next_page(series_url)
+        if current_page > 1:
+            print(f"    -> {label} 從斷點第 {current_page} 頁繼續。")
+
+    while True:
+        page_url = f"{series_url}?page={current_page}" if current_page > 1 else series_url
+        try:
+            if host in fetcher.browser_hosts:
+                html = await fetcher.render_html(page_url, spec["item"])
+            else:
+                html = await fetcher.get_html(page_url)
+            records, item_count, has_next = await parser.parse(html, spec, next_selector)
+            if item_count == 0 and host not in fetcher.browser_hosts:
+                print(f"   -> ⚠️ HTTP 回應缺少 {spec['item']}，改用瀏覽器: {page_url}")
+                html = await fetcher.render_html(page_url, spec["item"])
+                records, item_count, has_next = await parser.parse(html, spec, next_selector)
+        except Exception as e:
+            print(f"    ❌ {label} Page {current_page} 抓取失敗: {str(e)[:80]}")
+            raise ListingFailed(series_url, current_page, e) from e
+
+        if item_count == 0:
+            if checkpoint is not None:
+                checkpoint.series_done(series_url)
+            break
+        print(f"    -> {label} Page {current_page}: {item_count} 張卡片")
+        try:
+            await fetcher.call_handler(on_page, records)
+        except Exception as e:
+            print(f"    ❌ {label} Page {current_page} 處理錯誤: {str(e)[:80]}")
+            raise ListingFailed(series_url, current_page, e) from e
+        if checkpoint is not None:
+            checkpoint.page_done(series_url, current_page, records, last=not has_next)
+
+        if not has_next:
+            break
+        current_page += 1
+    return current_page
+
+
+async def gather_limited(coroutines, limit: int = FETCH_MAX_CONNECTIONS):
+    """並行執行多個協程，同時最多 limit 個 (實際請求量另受每個網站的上限約束)，回傳各自的結果
+
+    某個協程失敗時其他協程照常跑完 (已抓到的頁面照樣處理並寫入斷點)，全部結束後再拋出第一個錯誤。
+    """
+    slots = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with slots:
+            return await coro
+
+    results = await asyncio.gather(*(run(c) for c in coroutines), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        if len(errors) > 1:
+            print(f"   -> ❌ {len(errors)} 個並行工作失敗，回報第一個錯誤。")
+        raise errors[0]
+    return results
+
+
+def run_async(coro):
+    """在同步程式 (爬蟲的 scrape()) 中執行非同步抓取"""
+    return asyncio.run(coro)
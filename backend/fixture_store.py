@@ -0,0 +1,182 @@
+"""
+HTTP 錄製 / 重播 (Record / Replay)
+
+爬蟲平常只能對正式網站執行，解析器的修改與加速無法離線驗證或量測。
+本模組讓 fetcher.PageFetcher 可以:
+
+- 錄製 (FETCH_FIXTURES=record): 正常抓取，同時把每個回應 (列表頁 HTML、
+  Next.js 的 _next/data JSON、瀏覽器渲染後的 HTML) 存進錄製檔。
+- 重播 (FETCH_FIXTURES=replay): 不連網，所有請求改由錄製檔回應；
+  沒有錄到的網址回傳 404 (與網站上不存在的頁面相同處理)。
+
+錄製檔依網站分檔: FIXTURE_DIR/<host>.jsonl.gz，每行一筆
+    {"kind": "http" | "browser", "url": ..., "status": 200, "content_type": ..., "body": ...}
+(轉址另有 "location")。GET 以外的請求 (例如 POST 的分頁請求) 的 url 另加方法與請求內容，
+同一網址的不同分頁分開保存 (見 request_key())。
+同一網址以最後一次錄到的為準；結束時與既有內容合併後整檔寫入 (先寫暫存檔再取代)。
+
+用法:
+    FETCH_FIXTURES=record python price_scraper_mercadop_db.py   # 錄製一次正式執行
+    FETCH_FIXTURES=replay python price_scraper_mercadop_db.py   # 離線重跑 (可搭配 DB_BACKEND=sqlite)
+    python scraper_benchmark.py                                 # 以錄製檔量測各來源的效能
+"""
+
+import glob
+import gzip
+import json
+import os
+from urllib.parse import urlsplit
+
+import httpx
+
+# --- [設定區域] ---
+FIXTURE_DIR = os.getenv("FIXTURE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "http"
+)
+FETCH_FIXTURES = os.getenv("FETCH_FIXTURES", "").lower()   # "" (正式抓取) / "record" / "replay"
+
+FIXTURE_SUFFIX = ".jsonl.gz"
+
+# 暫時性的錯誤不錄製 (重播時應與成功的抓取相同)
+_TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+def request_key(request: httpx.Request) -> str:
+    """錄製檔中代表此請求的 url: GET 為網址本身，其他方法為「網址#方法:請求內容」"""
+    url = str(request.url)
+    if request.method == "GET":
+        return url
+    return f"{url}#{request.method}:{request.content.decode('utf-8', 'replace')}"
+
+
+class FixtureStore:
+    """依網站分檔的錄製回應 (延遲載入，同一行程內共用，見 open_store())"""
+
+    def __init__(self, directory: str = FIXTURE_DIR):
+        self.directory = directory
+        self._hosts = {}      # host -> {(kind, url): entry}
+        self._dirty = set()
+        self.served = 0       # 重播命中的回應數
+        self.missed = 0
+
+    def path(self, host: str) -> str:
+        return os.path.join(self.directory, host.replace(":", "_") + FIXTURE_SUFFIX)
+
+    def hosts(self):
+        """錄製檔目錄中已有的網站"""
+        return sorted(os.path.basename(p)[:-len(FIXTURE_SUFFIX)]
+                      for p in glob.glob(os.path.join(self.directory, "*" + FIXTURE_SUFFIX)))
+
+    def _entries(self, host: str) -> dict:
+        if host not in self._hosts:
+            entries = {}
+            path = self.path(host)
+            if os.path.exists(path):
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        entries[(entry["kind"], entry["url"])] = entry
+            self._hosts[host] = entries
+        return self._hosts[host]
+
+    def get(self, url: str, kind: str = "http"):
+        entry = self._entries(urlsplit(url).netloc).get((kind, url))
+        if entry is None:
+            self.missed += 1
+        else:
+            self.served += 1
+        return entry
+
+    def put(self, url: str, body: str, status: int = 200, content_type: str = "text/html", kind: str = "http",
+            location: str = None):
+        host = urlsplit(url).netloc
+        entry = {"kind": kind, "url": url, "status": status, "content_type": content_type, "body": body}
+        if location:
+            entry["location"] = location   # 轉址 (重播時由 httpx 照常跟隨)
+        self._entries(host)[(kind, url)] = entry
+        self._dirty.add(host)
+
+    def pages(self, host: str, kind: str = None):
+        """某網站的所有錄製內容 (依錄製順序)"""
+        for (entry_kind, _), entry in self._entries(host).items():
+            if kind is None or entry_kind == kind:
+                yield entry
+
+    def save(self):
+        """把本次錄到的網站寫回錄製檔 (與其他行程同時錄製時，以檔案中已有的內容為基礎合併)"""
+        if not self._dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for host in sorted(self._dirty):
+            recorded = self._hosts.pop(host)
+            entries = self._entries(host)   # 重新讀取檔案中的最新內容
+            entries.update(recorded)
+            path = self.path(host)
+            with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+                for entry in entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(path + ".tmp", path)
+            print(f"✅ 已錄製 {host}: {len(entries)} 筆回應 -> {path}")
+        self._dirty.clear()
+
+
+_stores = {}
+
+
+def open_store(directory: str = FIXTURE_DIR) -> FixtureStore:
+    """取得某目錄的錄製檔 (同一行程內的多個 PageFetcher 共用，重播時只解壓一次)"""
+    if directory not in _stores:
+        _stores[directory] = FixtureStore(directory)
+    return _stores[directory]
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """照常送出請求，並把解壓後的回應存進錄製檔"""
+
+    def __init__(self, store: FixtureStore, transport: httpx.AsyncBaseTransport):
+        self.store = store
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        body = await response.aread()   # 依 Content-Encoding 解壓
+        headers = [(k, v) for k, v in response.headers.items()
+                   if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        replayed = httpx.Response(response.status_code, headers=headers, content=body, request=request)
+        if response.status_code not in _TRANSIENT_STATUS:
+            # 內容以 UTF-8 文字保存，只留下媒體類型 (charset 於重播時改為 utf-8)
+            media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            self.store.put(request_key(request), replayed.text, response.status_code, media_type,
+                           location=response.headers.get("Location"))
+        return replayed
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """不連網，以錄製檔回應；沒有錄到的網址回傳 404"""
+
+    def __init__(self, store: FixtureStore):
+        self.store = store
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry = self.store.get(request_key(request))
+        if entry is None:
+            return httpx.Response(404, text="not recorded", request=request)
+        headers = {"Content-Type": f"{entry['content_type'] or 'text/html'}; charset=utf-8"}
+        if entry.get("location"):
+            headers["Location"] = entry["location"]
+        return httpx.Response(entry["status"], headers=headers,
+                              content=entry["body"].encode("utf-8"), request=request)
+
+
+def make_transport(mode: str, store: FixtureStore, limits: httpx.Limits):
+    """依模式建立 httpx 傳輸層 (正式抓取時回傳 None，使用 httpx 預設)"""
+    if mode == "replay":
+        return ReplayTransport(store)
+    if mode == "record":
+        return RecordingTransport(store, httpx.AsyncHTTPTransport(limits=limits))
+    if mode:
+        raise ValueError(f"FETCH_FIXTURES 只能是 record 或 replay: {mode}")
+    return None
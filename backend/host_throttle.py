@@ -0,0 +1,76 @@
+"""
+每個網站 (host) 的並行上限與禮貌間隔
+
+HTTP 抓取 (fetcher.py) 與瀏覽器 (browser_pool.py) 共用同一個 HostThrottle，
+取代各爬蟲迴圈裡的 time.sleep:
+
+- slot(url):  佔用該網站的一個並行名額 (上限 per_host)，進入前先等到輪次
+- pace(url):  只等待輪次，不佔名額 (例如同一頁內連續點擊「更多」)
+
+「輪次」: 預設由 rate_limiter 的跨行程令牌桶決定 (同時執行的爬蟲共用每個網站的速率，
+依回應自動加速或退避)；抓取端以 report(url, status) 回報每個回應。
+RATE_LIMIT_SHARED=0 時退回舊行為: 同一網站兩次請求的開始時間至少相隔 min_interval 秒
+(另加少量隨機抖動)。兩種方式下，並行數增加時對單一網站的請求速率都不變。
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from rate_limiter import default_limiter
+
+# --- [設定區域] ---
+FETCH_PER_HOST = int(os.getenv("FETCH_PER_HOST", "4"))                 # 每個網站同時請求數
+FETCH_MIN_INTERVAL = float(os.getenv("FETCH_MIN_INTERVAL", "0.25"))    # 同網站請求間隔 (秒)
+FETCH_JITTER = 0.25                                                    # 間隔的隨機抖動比例
+
+
+class HostThrottle:
+    """limiter: rate_limiter.HostRateLimiter；預設使用本行程共用的限制器，min_interval 為 0 (重播) 時不限速"""
+
+    def __init__(self, per_host: int = FETCH_PER_HOST, min_interval: float = FETCH_MIN_INTERVAL, limiter=None):
+        self.per_host = per_host
+        self.min_interval = min_interval
+        self.limiter = limiter if limiter is not None or min_interval <= 0 else default_limiter()
+        self._slots = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self._locks = defaultdict(asyncio.Lock)
+        self._next_start = defaultdict(float)   # host -> 下一個請求最早可開始的 monotonic 時間
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc
+
+    async def pace(self, url: str):
+        """等到該網站的下一個輪次"""
+        host = self.host_of(url)
+        if self.limiter is not None:
+            # SQLite 交易可能要等其他行程，不在事件迴圈中執行
+            wait = await asyncio.to_thread(self.limiter.reserve, host)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return
+        if self.min_interval <= 0:
+            return
+        async with self._locks[host]:
+            now = time.monotonic()
+            start = max(now, self._next_start[host])
+            interval = self.min_interval * (1 + random.uniform(-FETCH_JITTER, FETCH_JITTER))
+            self._next_start[host] = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """佔用該網站的一個並行名額"""
+        async with self._slots[self.host_of(url)]:
+            await self.pace(url)
+            yield
+
+    async def report(self, url: str, status: int, retry_after: float = 0.0):
+        """回報一個回應的狀態碼 (連線錯誤傳 0)，讓共用速率隨網站的承受度調整"""
+        if self.limiter is not None:
+            await asyncio.to_thread(self.limiter.report, self.host_of(url), status, retry_after)
@@ -0,0 +1,306 @@
+"""
+價格批次寫入 (Bulk Ingest)
+
+爬蟲不再逐筆查詢/寫入，而是把解析好的列交給 PriceIngestor 緩衝，
+每滿 INGEST_BATCH_SIZE 筆 (或結束時) 一次寫入:
+
+1. 以 COPY FROM STDIN 把整批列串流到 UNLOGGED 暫存表 price_staging
+   (SQLite 模式改用 TEMP 表 + executemany)。
+2. 以數條集合式 SQL 完成合併:
+   - 建立缺少的 games / card_sets / cards
+   - 與每張卡 (來源、價格類型) 的最新一筆價格比對 data_hash
+   - 只把有變動的觀測值寫入 market_prices
+3. 清空本批暫存列。整個流程在同一個交易內完成，失敗會整批回滾。
+
+若呼叫端已知 card_id (例如 scraper_base.IdentityCache 已在記憶體中解析)，
+該列會跳過建立實體的步驟，直接進入價格比對。
+若呼叫端已在記憶體中與最新指紋比對過 (check_latest=False)，則連價格比對也略過，直接寫入。
+
+background=True 時，滿批的列交給 pipeline.StagePipeline 在背景執行緒中處理
+(resolver -> 寫入)，爬蟲的抓取不必等資料庫；佇列已滿時 add() 才會等待。
+結束時呼叫 close() (或離開 with 區塊) 等待所有批次寫入完成。
+
+用法:
+    with PriceIngestor() as ingestor:
+        ingestor.add(game_code="OP", game_name="One Piece Card Game", set_code="OP01",
+                     card_number="OP01-001", version="Normal", name="...", rarity="SR",
+                     image_url="...", source="MercadoP", price_type="sell",
+                     price_jpy=1200, stock_status="In Stock")
+"""
+
+import io
+import os
+import time
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from database import engine
+from pipeline import StagePipeline
+from price_codes import PRICE_SOURCE_CODES, PRICE_TYPE_CODES, STOCK_STATUS_CODES, price_fingerprint
+
+# --- [設定區域] ---
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+# 設為 0 時在呼叫端的執行緒中同步寫入 (效能量測分開計算解析與寫入時使用)
+INGEST_BACKGROUND = os.getenv("INGEST_BACKGROUND", "1") != "0"
+STAGING_TABLE = "price_staging"
+
+# 同時有多個爬蟲寫入時，以此 advisory lock 序列化「建立新卡/系列」的步驟 (PostgreSQL)
+INGEST_LOCK_KEY = 731001
+
+StagedPrice = namedtuple(
+    "StagedPrice",
+    [
+        "game_code", "game_name", "set_code", "card_number", "version", "name", "rarity", "image_url",
+        "source", "price_type", "price_jpy", "stock_status", "card_id", "series",
+    ],
+    # card_id 可留空，由合併 SQL 依 (卡號, 版本) 解析；series: 所屬的系列網址 (變動率統計用，不寫入資料庫)
+    defaults=[None, None],
+)
+
+# 暫存表欄位 (來源/類型/狀態已轉為代碼，data_hash 已算好)
+STAGING_COLUMNS = [
+    "seq", "game_code", "game_name", "set_code", "card_number", "version", "name", "rarity", "image_url",
+    "source_id", "price_type", "price_jpy", "stock_status_id", "data_hash", "card_id",
+]
+
+_STAGING_DDL = f"""
+    {STAGING_TABLE} (
+        seq INTEGER NOT NULL,
+        game_code VARCHAR(10) NOT NULL,
+        game_name VARCHAR(100),
+        set_code VARCHAR(20) NOT NULL,
+        card_number VARCHAR(50) NOT NULL,
+        version VARCHAR(100) NOT NULL,
+        name VARCHAR(200),
+        rarity VARCHAR(20),
+        image_url TEXT,
+        source_id SMALLINT NOT NULL,
+        price_type SMALLINT NOT NULL,
+        price_jpy INTEGER,
+        stock_status_id SMALLINT,
+        data_hash BIGINT NOT NULL,
+        card_id INTEGER
+    )
+"""
+
+# --- [合併 SQL] (PostgreSQL 與 SQLite 共用) ---
+
+_MERGE_GAMES = f"""
+    INSERT INTO games (code, name)
+    SELECT s.game_code, MIN(s.game_name) FROM {STAGING_TABLE} s
+    WHERE s.card_id IS NULL AND NOT EXISTS (SELECT 1 FROM games g WHERE g.code = s.game_code)
+    GROUP BY s.game_code
+"""
+
+_MERGE_SETS = f"""
+    INSERT INTO card_sets (game_id, code, name)
+    SELECT g.id, s.set_code, 'Series ' || s.set_code
+    FROM (SELECT DISTINCT game_code, set_code FROM {STAGING_TABLE} WHERE card_id IS NULL) s
+    JOIN games g ON g.code = s.game_code
+    WHERE NOT EXISTS (
+        SELECT 1 FROM card_sets cs WHERE cs.game_id = g.id AND cs.code = s.set_code
+    )
+"""
+
+# 同一張卡 (卡號 + 版本) 以本批第一次出現的資料建立
+_MERGE_CARDS = f"""
+    INSERT INTO cards (card_set_id, card_number, name, version, rarity, image_url)
+    SELECT set_id, card_number, name, version, rarity, image_url FROM (
+        SELECT
+            (SELECT MIN(cs.id) FROM card_sets cs JOIN games g ON g.id = cs.game_id
+             WHERE g.code = s.game_code AND cs.code = s.set_code) AS set_id,
+            s.card_number, s.name, s.version, s.rarity, s.image_url,
+            ROW_NUMBER() OVER (PARTITION BY s.card_number, s.version ORDER BY s.seq) AS rn
+        FROM {STAGING_TABLE} s
+        WHERE s.card_id IS NULL
+    ) first_seen
+    WHERE rn = 1 AND NOT EXISTS (
+        SELECT 1 FROM cards c WHERE c.card_number = first_seen.card_number AND c.version = first_seen.version
+    )
+"""
+
+# 同一 (卡, 來源, 類型) 在本批出現多次時取最後一筆
+_MERGE_PRICES_UNCHECKED = f"""
+    INSERT INTO market_prices (card_id, source_id, price_type, price_jpy, stock_status_id, data_hash)
+    SELECT card_id, source_id, price_type, price_jpy, stock_status_id, data_hash FROM (
+        SELECT
+            COALESCE(s.card_id, c.id) AS card_id, s.source_id, s.price_type, s.price_jpy, s.stock_status_id, s.data_hash,
+            ROW_NUMBER() OVER (
+                PARTITION BY COALESCE(s.card_id, c.id), s.source_id, s.price_type ORDER BY s.seq DESC
+            ) AS rn
+        FROM {STAGING_TABLE} s
+        LEFT JOIN cards c ON s.card_id IS NULL AND c.card_number = s.card_number AND c.version = s.version
+    ) latest_seen
+    WHERE rn = 1 AND card_id IS NOT NULL
+"""
+
+# 另外與最新價格指紋比對，不同才寫入 (同一秒的多筆以 id 較大者為最新；SQLite 的 timestamp 只到秒)
+_MERGE_PRICES = _MERGE_PRICES_UNCHECKED + """
+    AND NOT COALESCE((
+        SELECT m.data_hash FROM market_prices m
+        WHERE m.card_id = latest_seen.card_id
+          AND m.source_id = latest_seen.source_id
+          AND m.price_type = latest_seen.price_type
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT 1
+    ) = latest_seen.data_hash, FALSE)
+"""
+
+
+def _encode(row: StagedPrice, seq: int):
+    """把一列轉為暫存表的值 (代碼化 + 計算指紋)"""
+    try:
+        source_id = PRICE_SOURCE_CODES[row.source]
+        price_type = PRICE_TYPE_CODES[row.price_type]
+        stock_status_id = STOCK_STATUS_CODES[row.stock_status] if row.stock_status is not None else None
+    except KeyError as e:
+        raise ValueError(f"未登記的代碼值: {e.args[0]!r} (請在 price_codes.py 的對照表中新增)")
+
+    data_hash = price_fingerprint(row.source, row.price_type, row.price_jpy, row.stock_status)
+    return (
+        seq, row.game_code, row.game_name, row.set_code, row.card_number, row.version, row.name,
+        row.rarity, row.image_url, source_id, price_type, row.price_jpy, stock_status_id, data_hash,
+        row.card_id,
+    )
+
+
+def _copy_value(value) -> str:
+    """COPY text 格式的欄位值 (NULL 為 \\N，跳脫反斜線/定位/換行)"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _stage_postgres(conn, values):
+    conn.execute(text(f"CREATE UNLOGGED TABLE IF NOT EXISTS {_STAGING_DDL}"))
+    buffer = io.StringIO()
+    for row in values:
+        buffer.write("\t".join(_copy_value(v) for v in row))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def _stage_sqlite(conn, values):
+    conn.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {_STAGING_DDL}"))
+    placeholders = ", ".join("?" for _ in STAGING_COLUMNS)
+    conn.exec_driver_sql(
+        f"INSERT INTO {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) VALUES ({placeholders})",
+        list(values),
+    )
+
+
+def ingest_prices(rows, bind=engine, check_latest: bool = True) -> int:
+    """把一批 StagedPrice 寫入資料庫，回傳新增的價格筆數
+
+    check_latest=False 表示呼叫端已確認這些列都有變動，略過與最新價格的比對
+    """
+    values = [_encode(row, seq) for seq, row in enumerate(rows)]
+    if not values:
+        return 0
+
+    is_postgres = bind.dialect.name == "postgresql"
+    with bind.begin() as conn:
+        if is_postgres:
+            _stage_postgres(conn, values)
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": INGEST_LOCK_KEY})
+        else:
+            _stage_sqlite(conn, values)
+
+        conn.execute(text(_MERGE_GAMES))
+        conn.execute(text(_MERGE_SETS))
+        conn.execute(text(_MERGE_CARDS))
+        inserted = conn.execute(text(_MERGE_PRICES if check_latest else _MERGE_PRICES_UNCHECKED)).rowcount
+
+        # 同一交易內只看得到本批的暫存列，DELETE 不會影響其他爬蟲
+        conn.execute(text(f"DELETE FROM {STAGING_TABLE}"))
+    return inserted
+
+
+class PriceIngestor:
+    """緩衝爬蟲解析出的價格列，每滿 batch_size 筆自動批次寫入
+
+    resolver: 可選，寫入前對整批列呼叫 (rows -> rows)，用於在記憶體中填好 card_id 或過濾未變動的列
+    check_latest: resolver 已在記憶體中完成變動比對時設為 False
+    on_flushed: 可選，整批成功寫入 (交易已提交) 後以實際送出的列呼叫
+    background: 在背景執行緒中執行 resolver 與寫入 (兩個階段，以有界佇列串接)
+    """
+
+    def __init__(self, bind=engine, batch_size: int = INGEST_BATCH_SIZE, resolver=None,
+                 check_latest: bool = True, on_flushed=None, background: bool = False):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.resolver = resolver
+        self.check_latest = check_latest
+        self.on_flushed = on_flushed
+        self.pending = []
+        self.total_staged = 0
+        self.total_inserted = 0
+        self.flush_seconds = 0.0   # 累計寫入耗時 (含 resolver)，供效能量測
+        self.pipeline = None
+        if background:
+            self.pipeline = StagePipeline([("resolve", self._resolve), ("write", self._write)])
+
+    def add(self, **fields):
+        self.add_row(StagedPrice(**fields))
+
+    def add_row(self, row: StagedPrice):
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _resolve(self, batch):
+        staged, rows = batch
+        if self.resolver is not None:
+            rows = self.resolver(rows)
+        return staged, rows
+
+    def _write(self, batch) -> int:
+        staged, rows = batch
+        inserted = ingest_prices(rows, self.bind, self.check_latest)
+        if self.on_flushed is not None:
+            self.on_flushed(rows)
+        self.total_inserted += inserted
+        print(f"      [DB] 💾 批次寫入 {staged} 筆，價格變動 {inserted} 筆。")
+        return inserted
+
+    def flush(self) -> int:
+        """寫入目前緩衝的列，回傳新增的價格筆數 (背景模式下只送入管線，回傳 0)"""
+        if not self.pending:
+            return 0
+        rows, self.pending = self.pending, []
+        self.total_staged += len(rows)
+        if self.pipeline is not None:
+            self.pipeline.put((len(rows), rows))
+            return 0
+        started = time.perf_counter()
+        inserted = self._write(self._resolve((len(rows), rows)))
+        self.flush_seconds += time.perf_counter() - started
+        return inserted
+
+    def close(self):
+        """寫入剩餘的列，並等待背景管線處理完所有批次 (有批次失敗時拋出)"""
+        self.flush()
+        if self.pipeline is not None:
+            self.pipeline.close()
+            self.flush_seconds = sum(self.pipeline.seconds.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 中途出錯時仍寫入已解析的部分
+        self.close()
+        return False
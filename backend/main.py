@@ -20,8 +20,15 @@ import base64
 import hashlib
 import httpx
 
-from database import SessionLocal, engine
+from database import SessionLocal, engine, get_read_db
 from models import Game, CardSet, Card, MarketPrice, InternalPrice
+from cold_archive import load_price_history, daily_price_totals
+from card_numbers import find_card_numbers, identify_game
+from run_history import load_runs, run_trends
+
+# ====== 價格查詢時間窗口 ======
+# market_prices 按月分區，查詢帶上時間下限才能讓 PostgreSQL 跳過舊月份的分區
+TREND_LOOKBACK_DAYS = 90  # 漲跌風向標 / 高價卡列表只看最近 90 天的價格紀錄 (更久沒有價格的卡牌不會列出)
 
 # ====== 雲端 AI 服務配置 ======
 CLOUD_AI_URL = "http://34.83.26.136:8080"
@@ -43,6 +50,8 @@ app.add_middleware(
 )
 
 # --- [資料庫依賴] ---
+# 寫入與後台「寫後即讀」流程使用 get_db (主庫)；
+# 儀表板、匯出、搜尋、價格歷史等唯讀查詢使用 get_read_db (可用時走讀取副本)。
 def get_db():
     db = SessionLocal()
     try:
@@ -386,7 +395,7 @@ async def root():
     return html_content
 
 @app.get("/api/stats")
-def get_stats(db: Session = Depends(get_db)):
+def get_stats(db: Session = Depends(get_read_db)):
     """獲取系統統計"""
     total_cards = db.query(func.count(Card.id)).scalar()
     total_prices = db.query(func.count(MarketPrice.id)).scalar()
@@ -398,11 +407,26 @@ def get_stats(db: Session = Depends(get_db)):
         "total_games": total_games or 0
     }
 
+@app.get("/api/runs")
+def get_runs(
+    name: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_read_db)
+):
+    """爬蟲執行紀錄 (新的在前，見 run_history.py)"""
+    return load_runs(db.connection(), name=name, kind=kind, limit=limit)
+
+@app.get("/api/runs/trends")
+def get_run_trends(db: Session = Depends(get_read_db)):
+    """各爬蟲最近與過去執行的比較、退化標記與超時預算"""
+    return run_trends(db.connection())
+
 @app.get("/api/cards/search", response_model=List[CardSearchResult])
 def search_cards(
     q: str = Query(..., min_length=1, description="搜尋關鍵字 (卡號或名稱)"),
     limit: int = Query(50, le=200),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """搜尋卡牌"""
     # 搜尋卡號或名稱
@@ -448,7 +472,7 @@ def search_cards(
     return results
 
 @app.get("/api/cards/{card_id}", response_model=CardDetailResult)
-def get_card_detail(card_id: int, db: Session = Depends(get_db)):
+def get_card_detail(card_id: int, db: Session = Depends(get_read_db)):
     """獲取卡牌詳細資訊與價格歷史"""
     card = db.query(Card).filter(Card.id == card_id).first()
     if not card:
@@ -485,7 +509,7 @@ def get_card_detail(card_id: int, db: Session = Depends(get_db)):
     )
 
 @app.get("/api/games")
-def get_games(db: Session = Depends(get_db)):
+def get_games(db: Session = Depends(get_read_db)):
     """獲取所有遊戲列表"""
     games = db.query(Game).all()
     return [{"id": g.id, "code": g.code, "name": g.name} for g in games]
@@ -1132,7 +1156,7 @@ def auto_calculate_prices(data: AutoCalculateRequest, db: Session = Depends(get_
 @app.get("/api/admin/export")
 def export_internal_prices(
     game: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """匯出內部定價為 CSV 格式"""
     query = db.query(Card, InternalPrice).outerjoin(InternalPrice, Card.id == InternalPrice.card_id)
@@ -1157,8 +1181,8 @@ def export_internal_prices(
 @app.get("/api/cards/{card_id}/price-history")
 def get_price_history(
     card_id: int,
-    days: int = Query(30, ge=1, le=365),
-    db: Session = Depends(get_db)
+    days: int = Query(30, ge=1, le=1095),
+    db: Session = Depends(get_read_db)
 ):
     """獲取卡牌價格歷史 (用於圖表)"""
     card = db.query(Card).filter(Card.id == card_id).first()
@@ -1167,11 +1191,8 @@ def get_price_history(
     
     since = datetime.now() - timedelta(days=days)
     
-    # 獲取價格歷史
-    prices = db.query(MarketPrice).filter(
-        MarketPrice.card_id == card_id,
-        MarketPrice.timestamp >= since
-    ).order_by(MarketPrice.timestamp).all()
+    # 獲取價格歷史 (較舊的部分來自 Parquet 封存，見 cold_archive.py)
+    prices = load_price_history(db, card_id, since)
     
     # 按日期和類型分組
     sell_data = []
@@ -1278,6 +1299,7 @@ async def chart_page(card_id: int):
                 <button onclick="loadChart(30)" id="btn30" class="active">30 天</button>
                 <button onclick="loadChart(90)" id="btn90">90 天</button>
                 <button onclick="loadChart(180)" id="btn180">180 天</button>
+                <button onclick="loadChart(365)" id="btn365">1 年</button>
             </div>
             
             <div class="stats-grid">
@@ -3366,44 +3388,10 @@ def perform_advanced_ocr(image, img_array):
         combined = ' '.join(all_text).upper()
         results['raw_text'] = combined
         
-        # 提取卡號
-        card_patterns = [
-            # OP 格式
-            (r'OP\s*(\d{1,2})[-_\s]*(\d{2,3})', 'OP'),
-            (r'0P\s*(\d{1,2})[-_\s]*(\d{2,3})', 'OP'),
-            (r'[O0]P(\d{1,2})[-_\s]*(\d{2,3})', 'OP'),
-            (r'ST\s*(\d{2})[-_\s]*(\d{2,3})', 'ST'),
-            (r'EB\s*(\d{2})[-_\s]*(\d{2,3})', 'EB'),
-            # UA 格式
-            (r'UA\s*(\d{2})\s*BT', 'UA'),
-            (r'EX\s*(\d{2})\s*BT', 'UA'),
-            # VG 格式
-            (r'D[-\s]*([A-Z]{2,3})\s*(\d{2})', 'VG'),
-            (r'DZ[-\s]*([A-Z]{3})\s*(\d{2})', 'VG'),
-            # DM 格式
-            (r'DM\s*(\d{2})[-\s]*(\d{1,3})', 'DM'),
-            (r'RP\s*(\d{2})', 'DM'),
-        ]
-        
-        for pattern, game_type in card_patterns:
-            matches = re.findall(pattern, combined)
-            for match in matches:
-                if game_type == 'OP':
-                    card_num = f"OP{str(match[0]).zfill(2)}-{str(match[1]).zfill(3)}"
-                elif game_type == 'ST':
-                    card_num = f"ST{match[0]}-{str(match[1]).zfill(3)}"
-                elif game_type == 'EB':
-                    card_num = f"EB{match[0]}-{str(match[1]).zfill(3)}"
-                elif game_type == 'VG':
-                    if isinstance(match, tuple) and len(match) >= 2:
-                        card_num = f"D-{match[0]}{match[1]}"
-                    else:
-                        continue
-                else:
-                    continue
-                    
-                if card_num not in results['card_numbers']:
-                    results['card_numbers'].append(card_num)
+        # 提取卡號 (共用辨識引擎的寬鬆模式: 容許 O/0 混淆、分隔符號缺漏或多餘空白)
+        for found in find_card_numbers(combined, loose=True):
+            if found.card_number not in results['card_numbers']:
+                results['card_numbers'].append(found.card_number)
         
         # 偵測角色名
         character_keywords = {
@@ -3535,15 +3523,9 @@ def detect_game_type(features, ocr_results):
     
     # 優先使用卡號判斷
     for card_number in ocr_results.get('card_numbers', []):
-        card_number = card_number.upper()
-        if card_number.startswith(('OP', 'ST', 'EB', 'POP')):
-            return 'OP'
-        elif 'BT/' in card_number or card_number.startswith(('UA', 'EX')):
-            return 'UA'
-        elif card_number.startswith(('D-', 'DZ-', 'V-', 'G-')):
-            return 'VG'
-        elif card_number.startswith(('DM', 'RP', 'BD')):
-            return 'DM'
+        game = identify_game(card_number)
+        if game:
+            return game
     
     # 使用 OCR 文字判斷
     raw_text = ocr_results.get('raw_text', '').upper()
@@ -4492,7 +4474,7 @@ async def dashboard_page():
 
 
 @app.get("/api/dashboard/stats")
-def get_dashboard_stats(db: Session = Depends(get_db)):
+def get_dashboard_stats(db: Session = Depends(get_read_db)):
     """獲取儀表板統計數據"""
     from datetime import datetime, timedelta
     
@@ -4532,12 +4514,16 @@ def get_price_trends(
     hours: int = Query(24, ge=1, le=720),
     game: Optional[str] = None,
     limit: int = Query(50, le=200),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     獲取價格變動趨勢 (漲跌風向標)
     
     尋找同一張卡有多個價格記錄的情況，計算最新與次新價格的差異
+
+    只比較最近 TREND_LOOKBACK_DAYS 天 (hours 更長時取 hours) 內的售價紀錄:
+    這段期間內少於 2 筆售價的卡牌 (例如 90 天沒有更新價格) 不會出現在結果中，
+    期間內只有 1 筆時也不會拿更早的價格來比較。
     """
     from datetime import datetime, timedelta
     
@@ -4545,13 +4531,16 @@ def get_price_trends(
     
     # 策略：找有多個價格記錄的卡牌，比較最新和次新價格
     # 這樣不依賴於"24小時內"的數據，而是基於歷史記錄
+    # 只看最近 TREND_LOOKBACK_DAYS 天 (或更長的 hours)，讓分區裁剪生效
+    since = datetime.now() - timedelta(days=max(TREND_LOOKBACK_DAYS, hours / 24))
     
     # 1. 找出有2筆以上價格記錄的卡牌
     cards_with_history = db.query(
         MarketPrice.card_id
     ).filter(
         MarketPrice.price_type == "sell",
-        MarketPrice.price_jpy > 0
+        MarketPrice.price_jpy > 0,
+        MarketPrice.timestamp >= since
     ).group_by(MarketPrice.card_id).having(
         func.count(MarketPrice.id) >= 2
     ).limit(500).all()
@@ -4567,7 +4556,8 @@ def get_price_trends(
             MarketPrice, Card.id == MarketPrice.card_id
         ).filter(
             MarketPrice.price_type == "sell",
-            MarketPrice.price_jpy > 0
+            MarketPrice.price_jpy > 0,
+            MarketPrice.timestamp >= since
         ).order_by(desc(MarketPrice.price_jpy)).limit(limit).all()
         
         for card, price in top_cards:
@@ -4595,7 +4585,8 @@ def get_price_trends(
         prices = db.query(MarketPrice).filter(
             MarketPrice.card_id == card_id,
             MarketPrice.price_type == "sell",
-            MarketPrice.price_jpy > 0
+            MarketPrice.price_jpy > 0,
+            MarketPrice.timestamp >= since
         ).order_by(desc(MarketPrice.timestamp)).limit(2).all()
         
         if len(prices) < 2:
@@ -4650,7 +4641,7 @@ def get_arbitrage_alerts(
     exchange_rate: float = Query(0.052, ge=0.01, le=0.1),
     game: Optional[str] = None,
     limit: int = Query(50, le=200),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     獲取套利警示
@@ -4660,6 +4651,9 @@ def get_arbitrage_alerts(
     - 倒掛警示 (Inverted): 日本售價 * 匯率 < TCGE 買取價
     
     如果沒有內部定價，顯示買賣價差大的卡牌作為潛在套利機會
+
+    沒有任何警示時改列出待定價的高價卡，只採用最近 TREND_LOOKBACK_DAYS 天內的售價:
+    超過 90 天沒有售價紀錄的卡牌 (價格已過時) 不會列出。
     """
     results = []
     
@@ -4740,7 +4734,8 @@ def get_arbitrage_alerts(
             MarketPrice, Card.id == MarketPrice.card_id
         ).filter(
             MarketPrice.price_type == "sell",
-            MarketPrice.price_jpy >= 1000  # 至少 1000 日圓
+            MarketPrice.price_jpy >= 1000,  # 至少 1000 日圓
+            MarketPrice.timestamp >= datetime.now() - timedelta(days=TREND_LOOKBACK_DAYS)
         )
         
         if game:
@@ -4794,44 +4789,40 @@ def get_arbitrage_alerts(
 @app.get("/api/dashboard/market-summary")
 def get_market_summary(
     days: int = Query(30, ge=7, le=90),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     獲取市場趨勢摘要 (用於圖表)
     
-    返回每個遊戲的每日平均價格
+    返回每個遊戲的每日平均售價 (跨越資料庫與 Parquet 封存)，沒有數據的日子為 null
     """
     from datetime import datetime, timedelta
     
     now = datetime.now()
-    start_date = now - timedelta(days=days)
+    start_date = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    # {(遊戲代碼, 日期): [價格總和, 筆數]}
+    totals = daily_price_totals(db, start_date, price_type="sell")
     
     # 生成日期列表
-    dates = []
+    days_list = []
     current = start_date
     while current <= now:
-        dates.append(current.strftime("%m/%d"))
+        days_list.append(current.date())
         current += timedelta(days=1)
     
-    # 為了效能，返回模擬數據
-    # 實際實作需要按日期分組計算平均價格
-    
-    import random
-    
-    # 模擬各遊戲的價格趨勢
-    base_op = 2000
-    base_ua = 1500
-    base_vg = 1200
-    
-    op_prices = [base_op + random.randint(-200, 300) for _ in dates]
-    ua_prices = [base_ua + random.randint(-150, 200) for _ in dates]
-    vg_prices = [base_vg + random.randint(-100, 150) for _ in dates]
+    def daily_average(game_code):
+        values = []
+        for day in days_list:
+            price_sum, count = totals.get((game_code, day), (0, 0))
+            values.append(round(price_sum / count) if count else None)
+        return values
     
     return {
-        "dates": dates,
-        "op_prices": op_prices,
-        "ua_prices": ua_prices,
-        "vg_prices": vg_prices
+        "dates": [day.strftime("%m/%d") for day in days_list],
+        "op_prices": daily_average("OP"),
+        "ua_prices": daily_average("UA"),
+        "vg_prices": daily_average("VG")
     }
 
 
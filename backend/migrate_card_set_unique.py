@@ -0,0 +1,54 @@
+"""
+card_sets 唯一索引遷移 (一次性)
+
+card_sets 原本沒有 (game_id, code) 的唯一限制；多個資料庫版爬蟲同時執行時 (run_all_scrapers 並行排程)，
+可能各自為同一個系列新增一列。本腳本:
+- 把指向重複系列的卡片改指向最早建立的那一列 (與 IdentityCache.preload 的選擇一致)，
+- 刪除其餘重複列，
+- 建立 idx_card_set_unique，之後 IdentityCache._create_sets 以 ON CONFLICT DO NOTHING 寫入。
+
+新建立的資料庫由 create_tables.py 直接建立索引，無需執行。
+
+用法:
+    python migrate_card_set_unique.py
+"""
+
+import sys
+
+from sqlalchemy import text
+
+from database import engine
+
+# 同一 (game_id, code) 中 id 較大的列視為重複
+_DUPLICATE = (
+    "EXISTS (SELECT 1 FROM card_sets k "
+    "WHERE k.game_id = card_sets.game_id AND k.code = card_sets.code AND k.id < card_sets.id)"
+)
+
+
+def migrate():
+    with engine.begin() as conn:
+        print(">> 步驟 1/3: 將卡片改指向最早建立的系列...")
+        moved = conn.execute(text(
+            "UPDATE cards SET card_set_id = ("
+            "  SELECT MIN(k.id) FROM card_sets k JOIN card_sets s ON k.game_id = s.game_id AND k.code = s.code"
+            "  WHERE s.id = cards.card_set_id"
+            f") WHERE card_set_id IN (SELECT id FROM card_sets WHERE {_DUPLICATE})"
+        )).rowcount
+
+        print(">> 步驟 2/3: 刪除重複的系列...")
+        deleted = conn.execute(text(f"DELETE FROM card_sets WHERE {_DUPLICATE}")).rowcount
+
+        print(">> 步驟 3/3: 建立唯一索引 idx_card_set_unique...")
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_card_set_unique ON card_sets (game_id, code)"))
+    print(f"✅ 遷移完成: 合併 {deleted} 個重複系列，改寫 {moved} 張卡片的系列。")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        if not migrate():
+            sys.exit(1)
+    except Exception as e:
+        print(f"❌ 遷移失敗 (已回滾): {e}")
+        sys.exit(1)
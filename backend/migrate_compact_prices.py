@@ -0,0 +1,118 @@
+"""
+market_prices 緊湊編碼遷移 (一次性)
+
+將既有資料改寫為 price_codes.py 定義的緊湊格式:
+- source        VARCHAR(50) -> source_id        SMALLINT (FK price_sources)
+- price_type    VARCHAR(20) -> price_type       SMALLINT (1 = sell, 2 = buy)
+- stock_status  VARCHAR(50) -> stock_status_id  SMALLINT (FK stock_statuses)
+- data_hash     VARCHAR(64) -> data_hash        BIGINT   (舊 md5 hex 的前 16 字元)
+並移除 data_hash 與 id 上的多餘索引。
+
+所有欄位在同一條 ALTER TABLE 中轉換，整張表 (各分區) 只重寫一次。
+若表格尚未分區，請先執行 python partitions.py --migrate。
+
+用法:
+    python migrate_compact_prices.py
+"""
+
+import sys
+
+from sqlalchemy import text
+
+from database import engine
+from models import PriceSource, StockStatus
+from price_codes import PRICE_SOURCE_CODES, PRICE_TYPE_CODES, STOCK_STATUS_CODES, seed_code_tables
+
+
+def case_expression(column: str, codes: dict) -> str:
+    """產生 CASE column WHEN '名稱' THEN 代碼 ... END (ALTER ... USING 不允許子查詢)"""
+    whens = " ".join(
+        f"WHEN '{name.replace(chr(39), chr(39) * 2)}' THEN {code}" for name, code in codes.items()
+    )
+    return f"CASE {column} {whens} END"
+
+
+def find_unknown_values(conn):
+    """找出對照表中未登記的值，避免遷移時被轉成 NULL"""
+    unknown = {}
+    for column, codes in (("source", PRICE_SOURCE_CODES), ("price_type", PRICE_TYPE_CODES), ("stock_status", STOCK_STATUS_CODES)):
+        values = conn.execute(text(
+            f"SELECT DISTINCT {column} FROM market_prices WHERE {column} IS NOT NULL"
+        )).scalars().all()
+        missing = [v for v in values if v not in codes]
+        if missing:
+            unknown[column] = missing
+    return unknown
+
+
+def is_migrated(conn) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'market_prices' AND column_name = 'source_id'"
+    )).first() is not None
+
+
+def migrate():
+    if engine.dialect.name != "postgresql":
+        print("✅ SQLite 模式由 create_tables.py 直接建立緊湊格式，無需遷移。")
+        return True
+
+    with engine.begin() as conn:
+        if is_migrated(conn):
+            print("✅ market_prices 已經是緊湊格式，無需遷移。")
+            return True
+
+        print(">> 步驟 1/4: 檢查未登記的來源/狀態值...")
+        unknown = find_unknown_values(conn)
+        if unknown:
+            print("❌ 發現未登記的值，請先在 price_codes.py 中新增代碼:")
+            for column, values in unknown.items():
+                print(f"   - {column}: {values}")
+            return False
+
+        print(">> 步驟 2/4: 建立並填入查找表...")
+        PriceSource.__table__.create(conn, checkfirst=True)
+        StockStatus.__table__.create(conn, checkfirst=True)
+        seed_code_tables(conn)
+
+        print(">> 步驟 3/4: 改寫 market_prices 欄位 (整表重寫一次)...")
+        conn.execute(text("DROP INDEX IF EXISTS ix_market_prices_data_hash"))
+        conn.execute(text("DROP INDEX IF EXISTS ix_market_prices_id"))
+        conn.execute(text(
+            "ALTER TABLE market_prices "
+            f"ALTER COLUMN source TYPE SMALLINT USING {case_expression('source', PRICE_SOURCE_CODES)}, "
+            f"ALTER COLUMN price_type TYPE SMALLINT USING {case_expression('price_type', PRICE_TYPE_CODES)}, "
+            f"ALTER COLUMN stock_status TYPE SMALLINT USING {case_expression('stock_status', STOCK_STATUS_CODES)}, "
+            "ALTER COLUMN data_hash TYPE BIGINT USING ('x' || substr(data_hash, 1, 16))::bit(64)::bigint"
+        ))
+
+        print(">> 步驟 4/4: 重新命名欄位並建立外鍵...")
+        conn.execute(text("ALTER TABLE market_prices RENAME COLUMN source TO source_id"))
+        conn.execute(text("ALTER TABLE market_prices RENAME COLUMN stock_status TO stock_status_id"))
+        conn.execute(text(
+            "ALTER TABLE market_prices ADD CONSTRAINT market_prices_source_id_fkey "
+            "FOREIGN KEY (source_id) REFERENCES price_sources (id)"
+        ))
+        conn.execute(text(
+            "ALTER TABLE market_prices ADD CONSTRAINT market_prices_stock_status_id_fkey "
+            "FOREIGN KEY (stock_status_id) REFERENCES stock_statuses (id)"
+        ))
+
+    # 更新統計資訊，讓查詢計畫使用新的欄位分佈
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE market_prices"))
+        size = conn.execute(text(
+            "SELECT pg_size_pretty(SUM(pg_total_relation_size(inhrelid))) "
+            "FROM pg_inherits WHERE inhparent = 'market_prices'::regclass"
+        )).scalar()
+    print(f"✅ 遷移完成。market_prices (含索引) 目前佔用: {size}")
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        if not migrate():
+            sys.exit(1)
+    except Exception as e:
+        print(f"❌ 遷移失敗 (已回滾): {e}")
+        sys.exit(1)
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Text, Index
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, String, Float, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, IS_POSTGRES, TZDateTime
+from price_codes import CodedString, PRICE_SOURCE_CODES, PRICE_TYPE_CODES, STOCK_STATUS_CODES
 
 # 1. 遊戲分類表 (例如: OP, UA, DM, VG)
 class Game(Base):
@@ -16,6 +17,10 @@ class Game(Base):
 # 2. 系列/彈數表 (例如: OP01, OP02)
 class CardSet(Base):
     __tablename__ = "card_sets"
+    __table_args__ = (
+        # 並行的爬蟲同時新增同一系列時只保留一列 (既有資料庫見 migrate_card_set_unique.py)
+        Index('idx_card_set_unique', 'game_id', 'code', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     game_id = Column(Integer, ForeignKey("games.id"))
@@ -53,25 +58,47 @@ class Card(Base):
 
 # 4. 市場價格表 (動態資料 - 爬蟲寫入這裡)
 # 這是系統的核心，記錄所有歷史價格
+# 以 timestamp 按月分區 (RANGE)，子表由 partitions.py 自動建立/退役
+# PostgreSQL 分區表的主鍵必須包含分區鍵，因此主鍵為 (id, timestamp)
+# SQLite 模式不分區，主鍵只有 id (INTEGER PRIMARY KEY 才能自動遞增)
 class MarketPrice(Base):
     __tablename__ = "market_prices"
+    __table_args__ = (
+        # 「某卡最新價格」查詢: 依 card_id 定位後按時間倒序，配合分區可由最新月份開始掃描
+        Index('idx_price_card_time', 'card_id', 'timestamp'),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    card_id = Column(Integer, ForeignKey("cards.id"), index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    card_id = Column(Integer, ForeignKey("cards.id"))
     
-    source = Column(String(50)) # e.g., "Mercadop", "CardRush", "Akiba"
-    price_type = Column(String(20)) # "sell" (售價) or "buy" (買取)
+    # 以下三欄在資料庫中存小整數 (見 price_codes.py)，Python 端仍以字串讀寫
+    source = Column("source_id", CodedString(PRICE_SOURCE_CODES), ForeignKey("price_sources.id")) # e.g., "Mercadop", "CardRush", "Akiba"
+    price_type = Column(CodedString(PRICE_TYPE_CODES)) # "sell" (售價) or "buy" (買取)
     price_jpy = Column(Integer) # 日幣價格
-    stock_status = Column(String(50)) # "In Stock", "Out of Stock", "買取中"
+    stock_status = Column("stock_status_id", CodedString(STOCK_STATUS_CODES), ForeignKey("stock_statuses.id")) # "In Stock", "Out of Stock", "買取中"
     
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    timestamp = Column(TZDateTime, server_default=func.now(), primary_key=IS_POSTGRES, index=True)
     
-    # 數據指紋 (Hash)，用於增量更新比對
-    # 內容通常是 hash(source + price_type + price_jpy + stock_status)
-    data_hash = Column(String(64), index=True) 
+    # 數據指紋 (64 位元整數)，用於增量更新比對
+    # 內容為 price_codes.price_fingerprint(source, price_type, price_jpy, stock_status)
+    data_hash = Column(BigInteger) 
 
     card = relationship("Card", back_populates="market_prices")
 
+# 4-1. 價格來源 / 庫存狀態查找表 (代碼定義於 price_codes.py)
+class PriceSource(Base):
+    __tablename__ = "price_sources"
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    name = Column(String(50), unique=True) # e.g., "MercadoP"
+
+class StockStatus(Base):
+    __tablename__ = "stock_statuses"
+
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    name = Column(String(50), unique=True) # e.g., "In Stock"
+
 # 5. TCGE 內部定價表 (店內價格)
 class InternalPrice(Base):
     __tablename__ = "internal_prices"
@@ -85,6 +112,75 @@ class InternalPrice(Base):
     # 自動計算的參考匯率 (可選)
     ref_exchange_rate = Column(Float, default=0.05) 
     
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(TZDateTime, onupdate=func.now())
 
     card = relationship("Card", back_populates="internal_price")
+
+# 6. 爬取排程統計表 (crawl_planner.py)
+# 每個爬蟲的每個系列網址一列，記錄最近的變動率與下次應爬取的時間
+# url = "*" 的列記錄該爬蟲上次「強制全量掃描」的時間
+class CrawlStat(Base):
+    __tablename__ = "crawl_stats"
+    __table_args__ = (
+        Index('idx_crawl_stat_unique', 'scraper', 'url', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scraper = Column(String(50), nullable=False) # e.g., "Mercadop"
+    url = Column(String(500), nullable=False)    # 系列 (或頁面) 網址
+
+    last_crawled_at = Column(TZDateTime)
+    next_due_at = Column(TZDateTime)
+    interval_minutes = Column(Integer)           # 目前的重訪間隔
+    change_rate = Column(Float, default=0.0)     # 變動比例的指數移動平均 (0 ~ 1)
+    rows_seen = Column(Integer, default=0)       # 上次爬取的卡片數
+    rows_changed = Column(Integer, default=0)    # 上次爬取中價格/庫存有變動的卡片數
+    crawls = Column(Integer, default=0)
+
+# 7. 商品 -> 卡片對應表 (entity_resolution.py)
+# 每個來源的每個商品 (卡號 + 稀有度 + 正規化名稱的指紋) 一列，記錄解析到的卡片
+# 之後的執行直接查表，不再重新比對
+class ListingMapping(Base):
+    __tablename__ = "listing_mappings"
+    __table_args__ = (
+        Index('idx_listing_mapping_unique', 'source_id', 'listing_key', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column("source_id", CodedString(PRICE_SOURCE_CODES), ForeignKey("price_sources.id"), nullable=False)
+    listing_key = Column(BigInteger, nullable=False)    # entity_resolution.listing_key()
+    card_id = Column(Integer, ForeignKey("cards.id"), nullable=False)
+    method = Column(String(10))                         # "exact" / "scored" / "created"
+    created_at = Column(TZDateTime, server_default=func.now())
+
+# 8. 執行紀錄表 (run_history.py)
+# 每次爬蟲執行一列: 資料庫版爬蟲 (kind="scraper")、單獨執行的 Sheets 腳本 (kind="script")、
+# 總指揮 (kind="orchestrator") 與總指揮排程的每次任務執行 (kind="task"，重試各一列，parent_id 指向總指揮那一列)
+class ScraperRun(Base):
+    __tablename__ = "scraper_runs"
+    __table_args__ = (
+        Index('idx_scraper_run_name_started', 'name', 'started_at'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), nullable=False)          # 任務 / 爬蟲名稱，例如 "mercadop"
+    kind = Column(String(20), nullable=False)          # "scraper" / "script" / "task" / "orchestrator"
+    parent_id = Column(Integer, ForeignKey("scraper_runs.id"))
+    attempt = Column(Integer, default=1)               # 總指揮排程的第幾次執行
+    status = Column(String(10), nullable=False)        # "running" / "done" / "failed"
+    error = Column(String(500))
+
+    started_at = Column(TZDateTime, nullable=False)
+    finished_at = Column(TZDateTime)
+    duration_seconds = Column(Float)
+    max_silence_seconds = Column(Float)                # 最長的無輸出時間 (總指揮監看)
+
+    pages = Column(Integer, default=0)                 # 成功抓取的頁面數
+    bytes = Column(BigInteger, default=0)              # 回應內容的總位元組
+    parse_seconds = Column(Float, default=0.0)         # 列表頁解析的累計時間
+    write_seconds = Column(Float, default=0.0)         # 寫入 (含對應卡片) 的累計時間
+    rows_seen = Column(Integer, default=0)             # 解析出的價格列
+    rows_written = Column(Integer, default=0)          # 實際寫入的列
+    rows_skipped = Column(Integer, default=0)          # 指紋與最新一筆相同而略過的列
+    retries = Column(Integer, default=0)               # 請求重試 / 任務重新排程次數
+    errors = Column(Integer, default=0)                # 最終失敗或被限流的請求數
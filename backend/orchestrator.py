@@ -0,0 +1,604 @@
+"""
+依賴圖 (DAG) 排程的並行爬蟲總指揮
+
+run_all_scrapers.py 原本依序執行 10 個爬蟲，任何一個失敗就把 all_success 設為 False，
+之後所有腳本 (即使是不同網站) 全部中止；總耗時是所有來源的總和。本模組改為:
+
+- 每個任務 (ScraperTask) 宣告依賴 (needs)、目標網站 (host) 與是否使用瀏覽器 (browser)。
+  依賴全部成功、同網站沒有其他任務在跑、瀏覽器名額足夠時即可開始，
+  因此不同網站的爬蟲同時執行，總耗時趨近最長的一條依賴鏈。
+- 同時使用瀏覽器的任務數以 ORCHESTRATOR_MAX_BROWSERS 為上限 (0 = 依 CPU 核心數與可用記憶體估算)，
+  總並行數以 ORCHESTRATOR_MAX_WORKERS 為上限。
+- 失敗只影響該任務: 重試放回佇列 (RETRY_DELAY_SECONDS 後再排程，期間其他任務照常進行)，
+  重試用盡才算失敗，只有依賴它的任務會被略過。
+- 每個任務在工作執行緒中執行 run(ctx)，工作執行緒保留自己的長駐瀏覽器 (scraper_context)。
+  主執行緒負責監看: 總時間、無輸出時間與 socket 錯誤數超過限制時，
+  以非同步例外 (TaskInterrupted) 中斷該工作執行緒；INTERRUPT_GRACE_SECONDS 內仍未停止則放棄該執行緒。
+  放棄的執行緒結束前仍佔用其網站、瀏覽器與執行緒名額，任務的重試等它結束後才開始；
+  只剩這類執行緒擋住所有待執行任務超過 STUCK_WAIT_SECONDS 時，這些任務以失敗結束。
+- 輸出經 ActivityStream 依執行緒加上 [任務名稱] 前綴，並用來判斷各任務是否仍有輸出。
+- 每次執行 (含重試) 寫入 scraper_runs 一列 (run_history.RunRecorder，kind="task")，
+  記錄耗時、最長無輸出時間與腳本回報的指標；整次排程另記一列 (kind="orchestrator")。
+
+用法:
+    tasks = [
+        ScraperTask("archive", run_archive),
+        ScraperTask("mercadop", run_mercadop, needs=["archive"], host="www.mercardop.jp", browser=True),
+    ]
+    streams = install_activity_streams()
+    with ScraperContext() as ctx:
+        ok = Orchestrator(tasks, ctx, streams).run()
+
+    python orchestrator.py --check   # 確認拋出例外的任務會重試、依賴它的任務會被略過
+"""
+
+import argparse
+import ctypes
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+from run_history import RunRecorder
+
+# --- [設定區域] ---
+ORCHESTRATOR_MAX_WORKERS = int(os.getenv("ORCHESTRATOR_MAX_WORKERS", "4"))
+ORCHESTRATOR_MAX_BROWSERS = int(os.getenv("ORCHESTRATOR_MAX_BROWSERS", "0"))   # 0 = 依 CPU / 記憶體自動決定
+BROWSER_MEMORY_MB = int(os.getenv("BROWSER_MEMORY_MB", "1024"))                # 每個瀏覽器預估佔用的記憶體
+ORCHESTRATOR_MAX_RETRIES = int(os.getenv("ORCHESTRATOR_MAX_RETRIES", "2"))     # 每個任務最多重試次數
+
+RETRY_DELAY_SECONDS = 10
+SOCKET_RETRY_DELAY_SECONDS = 15
+SOCKET_ERROR_TEXT = "socket.send() raised exception"
+SOCKET_ERROR_LIMIT = 10          # 超過此數的 socket 錯誤訊息即中止任務並重試
+INTERRUPT_GRACE_SECONDS = 60     # 中斷後仍未停止的任務，放棄其執行緒
+STUCK_WAIT_SECONDS = int(os.getenv("ORCHESTRATOR_STUCK_WAIT_SECONDS", "600"))   # 等待放棄的執行緒結束的上限
+POLL_SECONDS = 0.5
+
+
+class TaskInterrupted(BaseException):
+    """監看者中斷任務 (繼承 BaseException: 腳本中的 except Exception 不會把它吞掉)"""
+
+
+def available_memory_mb():
+    """可用記憶體 (MB)；無法取得時回傳 None"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_browser_limit() -> int:
+    """同時執行的瀏覽器數上限: 每個瀏覽器約半個 CPU 核心與 BROWSER_MEMORY_MB 記憶體"""
+    limit = max(1, (os.cpu_count() or 1) // 2)
+    memory = available_memory_mb()
+    if memory:
+        limit = min(limit, max(1, memory // BROWSER_MEMORY_MB))
+    return limit
+
+
+def raise_in_thread(thread_id: int, exc_type=TaskInterrupted):
+    """在另一個執行緒引發例外 (exc_type=None 時取消尚未送達的例外)"""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc_type) if exc_type else None
+    )
+
+
+class ScraperTask:
+    def __init__(self, name: str, run, needs=(), host: str = None, browser: bool = False,
+                 timeout_minutes: float = 40, no_output_timeout: float = 600):
+        self.name = name
+        self.run = run                  # run(ctx)；None 表示腳本無法載入
+        self.needs = list(needs)
+        self.host = host
+        self.browser = browser
+        self.timeout_minutes = timeout_minutes
+        self.no_output_timeout = no_output_timeout
+        self.status = "pending"         # pending / running / done / failed / skipped
+        self.attempts = 0
+        self.ready_at = 0.0             # 重試排程的最早開始時間
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+
+class TaskMonitor:
+    """一次執行 (attempt) 的監看狀態: 最後輸出時間與 socket 錯誤數"""
+
+    def __init__(self, task: ScraperTask, thread_id: int):
+        self.task = task
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.last_output = time.time()
+        self.max_silence = 0.0          # 最長的無輸出時間 (秒)
+        self.socket_errors = 0
+        self.reason = None              # 中斷原因 (None 表示沒有中斷)
+        self.interrupted_at = None
+        self.running = True
+        self.lock = threading.Lock()
+
+    def touch(self, text: str):
+        now = time.time()
+        self.max_silence = max(self.max_silence, now - self.last_output)
+        self.last_output = now
+        if SOCKET_ERROR_TEXT in text:
+            self.socket_errors += text.count(SOCKET_ERROR_TEXT)
+
+    def check(self, now: float):
+        """超過限制時回傳 (原因, [訊息...])，否則 None"""
+        task = self.task
+        if self.socket_errors > SOCKET_ERROR_LIMIT:
+            return "socket", [f"\n⚠️ 檢測到過多 socket 錯誤 ({self.socket_errors})，終止任務..."]
+        elapsed = now - self.started_at
+        if elapsed > task.timeout_minutes * 60:
+            return f"腳本運行超過 {task.timeout_minutes:.0f} 分鐘", [
+                "\n\n⚠️⚠️⚠️ 超時警告 ⚠️⚠️⚠️",
+                f"任務 {task.name} 已運行 {elapsed/60:.1f} 分鐘，超過限制 {task.timeout_minutes:.0f} 分鐘",
+            ]
+        time_since_output = now - self.last_output
+        if time_since_output > task.no_output_timeout:
+            return f"腳本超過 {task.no_output_timeout/60:.0f} 分鐘沒有輸出", [
+                "\n\n⚠️⚠️⚠️ 無輸出超時警告 ⚠️⚠️⚠️",
+                f"任務 {task.name} 已 {time_since_output/60:.1f} 分鐘沒有輸出，可能卡住",
+            ]
+        return None
+
+    def interrupt(self, reason: str) -> bool:
+        with self.lock:
+            if not self.running or self.reason is not None:
+                return False
+            self.reason = reason
+            self.interrupted_at = time.time()
+            raise_in_thread(self.thread_id)
+            return True
+
+    def finish(self):
+        """任務已返回: 之後不再中斷；中斷已送出但尚未送達時取消"""
+        with self.lock:
+            self.running = False
+            self.max_silence = max(self.max_silence, time.time() - self.last_output)
+            if self.reason is not None:
+                raise_in_thread(self.thread_id, None)
+
+
+class ActivityStream:
+    """包住 stdout/stderr: 依執行緒找到執行中的任務，記錄其輸出並加上 [任務名稱] 前綴"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._monitors = {}     # 執行緒 id -> TaskMonitor
+        self._partial = {}      # 執行緒 id -> 尚未換行的文字
+        self._lock = threading.Lock()
+
+    def attach(self, monitor: TaskMonitor):
+        self._monitors[threading.get_ident()] = monitor
+
+    def detach(self):
+        ident = threading.get_ident()
+        monitor = self._monitors.pop(ident, None)
+        rest = self._partial.pop(ident, "")
+        if monitor is not None and rest:
+            with self._lock:
+                self.stream.write(f"[{monitor.task.name}] {rest}\n")
+
+    def write(self, text):
+        ident = threading.get_ident()
+        monitor = self._monitors.get(ident)
+        if monitor is None:
+            with self._lock:
+                return self.stream.write(text)
+        monitor.touch(text)
+        lines = (self._partial.pop(ident, "") + text).split("\n")
+        if lines[-1]:
+            self._partial[ident] = lines[-1]
+        if len(lines) > 1:
+            with self._lock:
+                self.stream.write("".join(f"[{monitor.task.name}] {line}\n" for line in lines[:-1]))
+        return len(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def install_activity_streams():
+    """以 ActivityStream 取代 sys.stdout / sys.stderr (輸出一律以 UTF-8 寫出)"""
+    sys.stdout = ActivityStream(io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace',
+                                                 line_buffering=True))
+    sys.stderr = ActivityStream(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+class Worker:
+    """工作執行緒: 依序執行收到的任務，保留自己的長駐瀏覽器直到結束"""
+
+    def __init__(self, index: int, orchestrator):
+        self.index = index
+        self.orchestrator = orchestrator
+        self.inbox = queue.Queue()
+        self.task = None
+        self.monitor = None
+        self.record = None              # 目前任務的執行紀錄 (run_history.RunRecorder)
+        self.has_browser = False
+        self.abandoned = False
+        self.stuck_task = None          # 放棄時仍在執行的任務 (執行緒結束前仍佔用其網站與瀏覽器)
+        self.thread = threading.Thread(target=self._loop, name=f"scraper-worker-{index}", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        ctx = self.orchestrator.ctx
+        while True:
+            task = self.inbox.get()
+            if task is None:
+                ctx.close_browsers()
+                return
+            error = None
+            try:
+                error = self._execute(ctx, task)
+            except TaskInterrupted:
+                # 中斷在任務返回之後、finish() 之前送達
+                error = TimeoutError(self.monitor.reason)
+            self.has_browser = ctx.has_browser()
+            self.orchestrator.results.put((self, task, error))
+            if self.abandoned:
+                ctx.close_browsers()
+                return
+
+    def _execute(self, ctx, task):
+        ctx.fresh = task.attempts == 1   # 第一次從頭開始，重試沿用斷點
+        for stream in self.orchestrator.streams:
+            stream.attach(self.monitor)
+        record = self.record = RunRecorder(
+            task.name, kind="task", parent_id=self.orchestrator.record.id, attempt=task.attempts,
+            bind=self.orchestrator.record.bind,
+        )
+        try:
+            try:
+                record.start()
+                task.run(ctx)
+            finally:
+                self.monitor.finish()
+        except TaskInterrupted:
+            error = TimeoutError(self.monitor.reason)
+        except Exception as e:
+            error = e
+        else:
+            error = None
+        finally:
+            for stream in self.orchestrator.streams:
+                stream.detach()
+        record.max_silence_seconds = self.monitor.max_silence
+        record.finish(error)
+        if error is not None:
+            try:
+                ctx.reset()   # 丟棄可能已損壞的瀏覽器與卡號快取
+            except Exception:
+                pass
+        return error
+
+    def start(self, task: ScraperTask):
+        self.task = task
+        self.monitor = TaskMonitor(task, self.thread.ident)
+        self.record = None
+        self.inbox.put(task)
+
+
+class Orchestrator:
+    def __init__(self, tasks, ctx, streams=(), max_workers: int = ORCHESTRATOR_MAX_WORKERS,
+                 max_browsers: int = ORCHESTRATOR_MAX_BROWSERS, max_retries: int = ORCHESTRATOR_MAX_RETRIES, name: str = "run_all_scrapers",
+                 retry_delay: float = RETRY_DELAY_SECONDS, bind=None):
+        self.tasks = list(tasks)
+        self.by_name = {task.name: task for task in self.tasks}
+        for task in self.tasks:
+            missing = [name for name in task.needs if name not in self.by_name]
+            if missing:
+                raise ValueError(f"任務 {task.name} 依賴未定義的任務: {missing}")
+        self.ctx = ctx
+        self.streams = [stream for stream in streams if isinstance(stream, ActivityStream)]
+        self.max_workers = max(1, max_workers)
+        self.max_browsers = max_browsers or default_browser_limit()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.results = queue.Queue()
+        self.workers = []
+        self.record = RunRecorder(name, kind="orchestrator", bind=bind)   # bind: 執行紀錄的資料庫 (預設為 backend 資料庫)
+        self._stalled_since = None      # 只剩放棄的執行緒擋住待執行任務的開始時間
+
+    # --- 排程 ---
+
+    def _running(self):
+        return [worker for worker in self.workers if worker.task is not None and not worker.abandoned]
+
+    def _idle(self):
+        return [worker for worker in self.workers if worker.task is None and not worker.abandoned]
+
+    def _stuck(self):
+        """已放棄但仍未結束的執行緒: 任務仍在其中執行，照樣佔用網站、瀏覽器與執行緒名額"""
+        return [worker for worker in self.workers if worker.abandoned and worker.thread.is_alive()]
+
+    def _busy_tasks(self):
+        """正在執行的任務 (含放棄的執行緒中仍在跑的任務)"""
+        return [worker.task for worker in self._running()] + [worker.stuck_task for worker in self._stuck()]
+
+    def _skip_blocked(self):
+        """依賴已失敗或被略過的任務一併略過"""
+        changed = True
+        while changed:
+            changed = False
+            for task in self.tasks:
+                if task.status != "pending":
+                    continue
+                blocked = [name for name in task.needs if self.by_name[name].status in ("failed", "skipped")]
+                if blocked:
+                    task.status = "skipped"
+                    task.error = f"依賴的任務未完成: {', '.join(blocked)}"
+                    print(f"\n>> ⏭️ 略過任務 {task.name}: {task.error}")
+                    changed = True
+
+    def _pick_worker(self, task: ScraperTask):
+        idle = self._idle()
+        running = self._running()
+        stuck = self._stuck()
+        if task.browser:
+            browsers_busy = sum(1 for busy in self._busy_tasks() if busy.browser)
+            if browsers_busy >= self.max_browsers:
+                return None
+            # 優先交給已開著瀏覽器的執行緒；不然要確認長駐瀏覽器總數不超過上限
+            with_browser = [worker for worker in idle if worker.has_browser]
+            if with_browser:
+                return with_browser[0]
+            holding = sum(1 for worker in self.workers
+                          if worker.has_browser and (not worker.abandoned or worker in stuck))
+            if holding >= self.max_browsers:
+                return None
+        else:
+            without_browser = [worker for worker in idle if not worker.has_browser]
+            if without_browser:
+                return without_browser[0]
+        if idle:
+            return idle[0]
+        if len(running) + len(idle) + len(stuck) < self.max_workers:
+            worker = Worker(len(self.workers) + 1, self)
+            self.workers.append(worker)
+            return worker
+        return None
+
+    def _dispatch(self, now: float):
+        busy = self._busy_tasks()
+        busy_hosts = {task.host for task in busy if task.host}
+        for task in self.tasks:
+            if task.status != "pending" or task.ready_at > now:
+                continue
+            if any(self.by_name[name].status != "done" for name in task.needs):
+                continue
+            if task in busy or (task.host and task.host in busy_hosts):
+                continue
+            if task.run is None:
+                task.status = "failed"
+                task.error = "找不到腳本或無法載入"
+                print(f"\n❌ 任務 {task.name}: {task.error}")
+                continue
+            if len(self._running()) + len(self._stuck()) >= self.max_workers:
+                return
+            worker = self._pick_worker(task)
+            if worker is None:
+                continue
+            task.status = "running"
+            task.attempts += 1
+            if task.started_at is None:
+                task.started_at = now
+            if task.host:
+                busy_hosts.add(task.host)
+            print(f"\n{'='*50}")
+            print(f">> 啟動任務 {task.name} (第 {task.attempts} 次，執行緒 {worker.index})")
+            print(f">> ⏱️ 超時限制: {task.timeout_minutes:.0f} 分鐘")
+            print(f"{'='*50}")
+            worker.start(task)
+
+    def _complete(self, worker: Worker, task: ScraperTask, error):
+        if worker.abandoned:
+            return   # 已放棄的執行緒 (結果已在放棄時記錄)
+        reason = worker.monitor.reason
+        worker.task = None
+        self._record(task, error, reason)
+
+    def _record(self, task: ScraperTask, error, reason=None):
+        if error is None:
+            task.status = "done"
+            task.finished_at = time.time()
+            print(f"\n>> ✅ 任務 {task.name} 執行完畢 ({(task.finished_at - task.started_at)/60:.1f} 分鐘)。")
+            return
+        task.error = error
+        if task.attempts <= self.max_retries:
+            delay = SOCKET_RETRY_DELAY_SECONDS if reason == "socket" else self.retry_delay
+            task.status = "pending"
+            task.ready_at = time.time() + delay
+            print(f"\n⚠️ 任務 {task.name} 失敗: {error}")
+            print(f"   {delay} 秒後放回佇列 (第 {task.attempts + 1}/{self.max_retries + 1} 次，從斷點繼續)。")
+        else:
+            task.status = "failed"
+            task.finished_at = time.time()
+            print(f"\n❌ 任務 {task.name} 重試 {self.max_retries + 1} 次後仍失敗: {error}")
+
+    def _watch(self, now: float):
+        for worker in self._running():
+            monitor = worker.monitor
+            if monitor.reason is None:
+                found = monitor.check(now)
+                if found and monitor.interrupt(found[0]):
+                    for message in found[1]:
+                        print(message)
+                    print(f"正在中斷任務 {worker.task.name}...")
+            elif now - monitor.interrupted_at > INTERRUPT_GRACE_SECONDS:
+                # 中斷後仍未停止 (卡在 C 層的阻塞呼叫): 放棄此執行緒，任務等執行緒結束後重試
+                task = worker.task
+                print(f"\n❌ 任務 {task.name} 在中斷後 {INTERRUPT_GRACE_SECONDS} 秒仍未停止，放棄其執行緒"
+                      f" (結束前仍佔用 {task.host or '執行緒'} 的名額)。")
+                worker.abandoned = True
+                worker.task = None
+                worker.stuck_task = task
+                worker.has_browser = worker.has_browser or task.browser
+                if worker.record is not None:
+                    worker.record.max_silence_seconds = max(monitor.max_silence, now - monitor.last_output)
+                    worker.record.finish(TimeoutError(monitor.reason))
+                self._record(task, TimeoutError(monitor.reason), monitor.reason)
+
+    def _check_stalled(self, now: float):
+        """沒有任務在執行、只剩放棄的執行緒擋住待執行任務: 等待 STUCK_WAIT_SECONDS 後讓這些任務失敗"""
+        pending = [task for task in self.tasks if task.status == "pending"]
+        if self._running() or not pending or not self._stuck():
+            self._stalled_since = None
+            return
+        if self._stalled_since is None:
+            self._stalled_since = now
+            return
+        if now - self._stalled_since < STUCK_WAIT_SECONDS:
+            return
+        stuck = ", ".join(worker.stuck_task.name for worker in self._stuck())
+        for task in pending:
+            task.status = "failed"
+            task.error = f"放棄的執行緒 ({stuck}) {STUCK_WAIT_SECONDS} 秒內仍未結束"
+            task.finished_at = now
+            print(f"\n❌ 任務 {task.name}: {task.error}")
+        self._stalled_since = None
+
+    def run(self) -> bool:
+        """執行所有任務，全部成功時回傳 True"""
+        print(f">> 排程 {len(self.tasks)} 個任務: 最多 {self.max_workers} 個同時執行，"
+              f"其中最多 {self.max_browsers} 個使用瀏覽器。")
+        self.record.start()
+        try:
+            while True:
+                now = time.time()
+                self._skip_blocked()
+                self._dispatch(now)
+                if not self._running() and not any(task.status == "pending" for task in self.tasks):
+                    break
+                try:
+                    worker, task, error = self.results.get(timeout=POLL_SECONDS)
+                    self._complete(worker, task, error)
+                except queue.Empty:
+                    pass
+                self._watch(time.time())
+                self._check_stalled(time.time())
+        except KeyboardInterrupt as e:
+            # 使用者按下 Ctrl+C: 中斷所有執行中的任務後結束
+            for worker in self._running():
+                worker.monitor.interrupt("使用者中斷")
+            self._finish_record(e)
+            raise
+        finally:
+            for worker in self.workers:
+                if not worker.abandoned:
+                    worker.inbox.put(None)
+            for worker in self.workers:
+                if not worker.abandoned:
+                    worker.thread.join(timeout=30)
+        self.print_summary()
+        unfinished = [task.name for task in self.tasks if task.status != "done"]
+        self._finish_record(f"未完成的任務: {', '.join(unfinished)}" if unfinished else None)
+        return not unfinished
+
+    def _finish_record(self, error):
+        self.record.set(
+            retries=sum(max(0, task.attempts - 1) for task in self.tasks),
+            errors=sum(task.status == "failed" for task in self.tasks),
+        )
+        self.record.finish(error)
+
+    def print_summary(self):
+        print(f"\n{'='*50}")
+        print(">> 任務總結:")
+        for task in self.tasks:
+            seconds = (task.finished_at or time.time()) - task.started_at if task.started_at else 0
+            error = f"  {task.error}" if task.status != "done" and task.error else ""
+            print(f"  {task.name:<24} {task.status:<8} 執行 {task.attempts} 次  {seconds/60:>6.1f} 分鐘{error}")
+        print(f"{'='*50}")
+
+
+# --- [自我檢查] ---
+
+class _CheckContext:
+    """自我檢查用的 ScraperContext 替身 (不開瀏覽器、不連 Sheets)"""
+    fresh = True
+
+    def has_browser(self):
+        return False
+
+    def close_browsers(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+def self_check() -> bool:
+    """以假任務確認: 拋出例外的任務會放回佇列重試，重試用盡後依賴它的任務被略過，其他任務不受影響"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+
+    calls = {}
+
+    def flaky(ctx):
+        calls["flaky"] = calls.get("flaky", 0) + 1
+        if calls["flaky"] == 1:
+            raise RuntimeError("第一次執行失敗")
+
+    def broken(ctx):
+        raise RuntimeError("每次都失敗")
+
+    def ok(ctx):
+        pass
+
+    tasks = [
+        ScraperTask("flaky", flaky),
+        ScraperTask("after_flaky", ok, needs=["flaky"]),
+        ScraperTask("broken", broken),
+        ScraperTask("after_broken", ok, needs=["broken"]),
+        ScraperTask("other", ok),
+    ]
+    # 執行紀錄寫入記憶體中的 SQLite，不影響正式的 scraper_runs
+    bind = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Orchestrator(tasks, _CheckContext(), max_workers=2, max_retries=1, name="orchestrator_check",
+                 retry_delay=0, bind=bind).run()
+
+    by_name = {task.name: task for task in tasks}
+    expected = {
+        "flaky": ("done", 2),
+        "after_flaky": ("done", 1),
+        "broken": ("failed", 2),
+        "after_broken": ("skipped", 0),
+        "other": ("done", 1),
+    }
+    passed = True
+    print(">> 自我檢查:")
+    for name, (status, attempts) in expected.items():
+        task = by_name[name]
+        agree = (task.status, task.attempts) == (status, attempts)
+        passed = passed and agree
+        print(f"  {'✅' if agree else '❌'} {name:<14} 預期 {status} / {attempts} 次  實際 {task.status} / {task.attempts} 次")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依賴圖排程的並行爬蟲總指揮 (由 run_all_scrapers.py 使用)")
+    parser.add_argument("--check", action="store_true", help="以假任務確認失敗重試與依賴略過")
+    args = parser.parse_args()
+    if args.check:
+        if not self_check():
+            raise SystemExit("❌ 排程行為與預期不符")
+        print("✅ 排程行為符合預期")
+        return
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+列表頁解析效能基準 (pages/sec)
+
+對已存檔的 HTML 列表頁比較三種解析方式:
+1. bs4      BeautifulSoup(html, 'html.parser') + 規格擷取 (舊做法)
+2. lxml     extraction.parse_listing，在同一行程內
+3. lxml+N   extraction.parse_listing，交給 N 個行程的 ProcessPoolExecutor
+
+用法:
+    python parse_benchmark.py --save https://www.mercardop.jp/product-group/146 ...  # 先存檔頁面
+    python parse_benchmark.py                                  # 以 fixtures/pages/*.html 測試
+    python parse_benchmark.py my_pages/ --spec cardrush --workers 8 --repeat 5
+    python parse_benchmark.py --host www.mercardop.jp             # 以錄製檔 (fixture_store) 中的頁面測試
+"""
+
+import argparse
+import asyncio
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+from extraction import AKIBA_BUY_SPEC, CARDRUSH_LIST_SPEC, SHOP_LIST_SPEC, extract_from_soup, parse_listing
+from fetcher import NEXT_PAGE_SELECTOR, PARSE_WORKERS, PageFetcher
+from fixture_store import open_store
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+
+SPECS = {"shop": SHOP_LIST_SPEC, "cardrush": CARDRUSH_LIST_SPEC, "akiba": AKIBA_BUY_SPEC}
+
+
+def load_recorded_pages(host):
+    """錄製檔中某網站的 HTML 頁面 (不含 JSON 與錯誤回應)"""
+    return [entry["body"] for entry in open_store().pages(host, kind="http")
+            if entry["status"] == 200 and "json" not in entry["content_type"]]
+
+
+def load_pages(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.html"))))
+        else:
+            files.append(path)
+    pages = []
+    for file in files:
+        with open(file, encoding="utf-8") as f:
+            pages.append(f.read())
+    return pages
+
+
+async def save_pages(urls, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    async with PageFetcher() as fetcher:
+        for url in urls:
+            html = await fetcher.get_html(url)
+            name = re.sub(r"[^\w.-]+", "_", url.split("://", 1)[-1]).strip("_") + ".html"
+            with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+                f.write(html)
+            print(f"✅ 已存檔: {name} ({len(html) // 1024} KB)")
+
+
+def bench(label, pages, repeat, parse_all):
+    parse_all(pages[:1])  # 暖機 (選擇器編譯、行程池啟動)
+    start = time.perf_counter()
+    items = 0
+    for _ in range(repeat):
+        items += parse_all(pages)
+    elapsed = time.perf_counter() - start
+    total = len(pages) * repeat
+    print(f"  {label:<10} {total / elapsed:8.1f} pages/s  ({items // repeat} 筆/輪, {elapsed:.2f}s)")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表頁解析效能基準")
+    parser.add_argument("paths", nargs="*", default=[FIXTURE_DIR], help="HTML 檔案或目錄")
+    parser.add_argument("--spec", choices=sorted(SPECS), default="shop")
+    parser.add_argument("--workers", type=int, default=max(PARSE_WORKERS, 2))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--host", help="改用錄製檔中此網站的頁面 (見 fixture_store.py)")
+    parser.add_argument("--save", nargs="+", metavar="URL", help="抓取並存檔到 fixtures/pages 後結束")
+    args = parser.parse_args()
+
+    if args.save:
+        asyncio.run(save_pages(args.save, FIXTURE_DIR))
+        return
+
+    pages = load_recorded_pages(args.host) if args.host else load_pages(args.paths)
+    if not pages:
+        print(f"❌ 找不到 HTML 檔案，請先執行: python parse_benchmark.py --save <列表頁網址> ...")
+        return
+    spec = SPECS[args.spec]
+    print(f">> {len(pages)} 頁 x {args.repeat} 輪 (規格: {args.spec})")
+
+    def with_bs4(batch):
+        return sum(len(extract_from_soup(BeautifulSoup(html, "html.parser"), spec)) for html in batch)
+
+    def with_lxml(batch):
+        return sum(len(parse_listing(html, spec, NEXT_PAGE_SELECTOR)[0]) for html in batch)
+
+    baseline = bench("bs4", pages, args.repeat, with_bs4)
+    fast = bench("lxml", pages, args.repeat, with_lxml)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        def with_pool(batch):
+            results = pool.map(parse_listing, batch, [spec] * len(batch), [NEXT_PAGE_SELECTOR] * len(batch))
+            return sum(len(records) for records, _, _ in results)
+
+        pooled = bench(f"lxml+{args.workers}", pages, args.repeat, with_pool)
+
+    print(f"✅ lxml 為 bs4 的 {fast / baseline:.1f} 倍，行程池為 {pooled / baseline:.1f} 倍。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+market_prices 月分區維護工具
+
+market_prices 以 timestamp 按月 RANGE 分區 (見 models.py)，每個月份一張子表:
+    market_prices_202601  ->  [2026-01-01, 2026-02-01)
+
+職責:
+1. 自動建立當月及未來數個月的分區 (爬蟲啟動、create_tables.py 都會呼叫)。
+2. 退役舊月份: DETACH PARTITION 後 DROP TABLE，取代整表的大量 DELETE。
+3. 將舊版的非分區 market_prices 一次性轉換為分區表。
+
+用法:
+    python partitions.py                       # 建立未來分區
+    python partitions.py --migrate             # 舊表轉換為分區表
+    python partitions.py --retire 12           # 退役 12 個月以前的分區
+    python partitions.py --retire 12 --keep-detached   # 只 DETACH，不刪除
+
+注意: 沒有 DEFAULT 分區，超出已建立月份的寫入會失敗，
+      因此爬蟲啟動時都會先呼叫 ensure_partitions() 預建未來月份。
+      SQLite 模式 (DB_BACKEND=sqlite) 不分區，以下函數皆直接略過。
+"""
+
+import argparse
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from database import engine
+from models import MarketPrice
+
+PARENT_TABLE = MarketPrice.__tablename__
+
+# 預先建立的未來月份數量
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+_PARTITION_NAME_RE = re.compile(rf"^{PARENT_TABLE}_(\d{{4}})(\d{{2}})$")
+
+
+# --- [月份工具] ---
+
+def month_start(dt: datetime) -> datetime:
+    """取得該月 1 日 00:00 (UTC)"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(timezone.utc)
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + (month.month - 1) + n
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_{month:%Y%m}"
+
+
+# --- [分區查詢] ---
+
+def supports_partitions(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def get_relkind(conn, table_name: str = PARENT_TABLE):
+    """'p' = 分區表, 'r' = 普通表, None = 不存在"""
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": table_name},
+    ).scalar()
+
+
+def list_month_partitions(conn):
+    """列出所有月份子表 [(名稱, 月初時間)]，由舊到新"""
+    rows = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = :parent"
+    ), {"parent": PARENT_TABLE}).scalars().all()
+
+    partitions = []
+    for name in rows:
+        match = _PARTITION_NAME_RE.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions.append((name, month))
+    partitions.sort(key=lambda p: p[1])
+    return partitions
+
+
+# --- [分區建立] ---
+
+def create_month_partition(conn, month: datetime) -> str:
+    name = partition_name(month)
+    start = month.strftime("%Y-%m-%d 00:00:00+00")
+    end = add_months(month, 1).strftime("%Y-%m-%d 00:00:00+00")
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    return name
+
+
+def create_partitions_between(conn, first: datetime, last: datetime):
+    """建立 first ~ last (含) 之間所有月份的分區"""
+    created = []
+    month = month_start(first)
+    last = month_start(last)
+    while month <= last:
+        created.append(create_month_partition(conn, month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_partitions(bind=engine, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """確保當月到未來 months_ahead 個月的分區都已存在
+
+    不建立 DEFAULT 分區: 有 DEFAULT 分區時 PostgreSQL 無法使用「依月份順序」的 Append，
+    `ORDER BY timestamp DESC LIMIT 1` 會退化為掃描每個分區。
+    因此每次爬蟲啟動都會呼叫本函數，預先建好未來月份。
+    """
+    if not supports_partitions(bind):
+        return []
+
+    with bind.begin() as conn:
+        if get_relkind(conn) != "p":
+            print(f"⚠️ {PARENT_TABLE} 不是分區表，請先執行: python partitions.py --migrate")
+            return []
+
+        this_month = month_start(datetime.now(timezone.utc))
+        return create_partitions_between(conn, this_month, add_months(this_month, months_ahead))
+
+
+# --- [分區退役] ---
+
+def detach_partitions_before(bind, cutoff: datetime, drop: bool = True):
+    """DETACH (預設隨後 DROP) 所有整個月份都早於 cutoff 的分區"""
+    retired = []
+    if not supports_partitions(bind):
+        return retired
+
+    with bind.begin() as conn:
+        if get_relkind(conn) != "p":
+            print(f"⚠️ {PARENT_TABLE} 不是分區表，無法退役分區。")
+            return retired
+
+        for name, month in list_month_partitions(conn):
+            if add_months(month, 1) > cutoff:
+                break
+            conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            if drop:
+                conn.execute(text(f"DROP TABLE {name}"))
+            retired.append(name)
+            print(f"   -> 🗄️ 已{'刪除' if drop else '分離'}分區: {name}")
+
+    return retired
+
+
+def retire_partitions(bind=engine, keep_months: int = 12, drop: bool = True):
+    """退役 keep_months 個月以前的整月分區 (DETACH，預設隨後 DROP)"""
+    cutoff = add_months(month_start(datetime.now(timezone.utc)), -keep_months)
+    return detach_partitions_before(bind, cutoff, drop=drop)
+
+
+# --- [舊表遷移] ---
+
+def migrate_to_partitioned(bind=engine, months_ahead: int = PARTITION_MONTHS_AHEAD):
+    """將舊的非分區 market_prices 轉換為按月分區表 (單一交易內完成，失敗會整體回滾)"""
+    legacy = f"{PARENT_TABLE}_legacy"
+    this_month = month_start(datetime.now(timezone.utc))
+    if not supports_partitions(bind):
+        print(f"⚠️ {bind.dialect.name} 不支援分區表，無需遷移。")
+        return False
+
+    with bind.begin() as conn:
+        relkind = get_relkind(conn)
+        if relkind == "p":
+            print(f"✅ {PARENT_TABLE} 已經是分區表，無需遷移。")
+            return False
+
+        if relkind is None:
+            MarketPrice.__table__.create(conn)
+            create_partitions_between(conn, this_month, add_months(this_month, months_ahead))
+            print(f"✅ 已建立分區表 {PARENT_TABLE}。")
+            return True
+
+        print(f">> 正在將 {PARENT_TABLE} 重新命名為 {legacy}...")
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {legacy}"))
+        # 舊表的索引、主鍵與序列名稱會和新表衝突，一併改名
+        index_names = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :t"
+        ), {"t": legacy}).scalars().all()
+        for index_name in index_names:
+            conn.execute(text(f"ALTER INDEX {index_name} RENAME TO {index_name}_legacy"))
+        conn.execute(text(f"ALTER SEQUENCE IF EXISTS {PARENT_TABLE}_id_seq RENAME TO {legacy}_id_seq"))
+
+        MarketPrice.__table__.create(conn)
+
+        oldest, newest = conn.execute(text(f"SELECT MIN(timestamp), MAX(timestamp) FROM {legacy}")).one()
+        first = month_start(oldest) if oldest else this_month
+        last = add_months(this_month, months_ahead)
+        if newest and month_start(newest) > last:
+            last = month_start(newest)
+        create_partitions_between(conn, min(first, this_month), last)
+
+        columns = [c.name for c in MarketPrice.__table__.columns]
+        column_list = ", ".join(columns)
+        select_list = ", ".join("COALESCE(timestamp, now())" if c == "timestamp" else c for c in columns)
+
+        print(">> 正在複製舊資料到分區表...")
+        result = conn.execute(text(
+            f"INSERT INTO {PARENT_TABLE} ({column_list}) SELECT {select_list} FROM {legacy}"
+        ))
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{PARENT_TABLE}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {PARENT_TABLE}), 1))"
+        ))
+        conn.execute(text(f"DROP TABLE {legacy}"))
+        print(f"✅ 遷移完成，共複製 {result.rowcount} 筆價格紀錄。")
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="market_prices 月分區維護工具")
+    parser.add_argument("--migrate", action="store_true", help="將舊的非分區表轉換為分區表")
+    parser.add_argument("--retire", type=int, metavar="MONTHS", help="退役 N 個月以前的分區")
+    parser.add_argument("--keep-detached", action="store_true", help="退役時只 DETACH，不 DROP")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD, help="預先建立的未來月份數")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_to_partitioned(months_ahead=args.months_ahead)
+
+    created = ensure_partitions(months_ahead=args.months_ahead)
+    if created:
+        print(f"✅ 分區已就緒: {created[0]} ~ {created[-1]}")
+
+    if args.retire is not None:
+        retired = retire_partitions(keep_months=args.retire, drop=not args.keep_detached)
+        print(f"✅ 共退役 {len(retired)} 個分區。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+有界佇列的串流管線 (Producer / Consumer)
+
+資料庫版爬蟲原本在事件迴圈中同步寫入: 每滿一批就停下所有抓取，
+等 entity resolution、變動比對與 COPY/合併 SQL 做完才繼續，網路與資料庫 I/O 從不重疊。
+本模組把寫入端拆成數個背景執行緒 (stage)，以有界佇列串接:
+
+    抓取 (事件迴圈) -> 解析 (ListingParser 行程池) -> record(): 組成 StagedPrice
+        -> [佇列] -> 正規化 + 去重 (對應卡片、與最新指紋比對)
+        -> [佇列] -> 寫入 (ingest_prices)
+
+- 每個佇列最多 PIPELINE_QUEUE_BATCHES 批；下游跟不上時 put() 會阻塞上游 (backpressure)，
+  記憶體用量固定在「批次大小 x 佇列長度 x 階段數」以內，不隨商品總數成長。
+- put() 是阻塞呼叫，不可在事件迴圈的執行緒上呼叫: 非同步抓取的頁面處理 (on_page -> record())
+  經 fetcher.PageFetcher.call_handler 在專用執行緒中執行，阻塞時只暫停送出該頁的協程。
+- 每個階段只有一個執行緒，批次依送入順序處理 (同一張卡後到的價格不會先寫入)。
+- 任一階段出錯時，之後的批次直接丟棄 (不再寫入)，錯誤在下一次 put() 或 close() 時於呼叫端重新拋出。
+
+用法:
+    pipeline = StagePipeline([("resolve", prepare_batch), ("write", write_batch)])
+    pipeline.put(rows)      # 佇列已滿時等待
+    pipeline.close()        # 等待所有批次處理完畢 (有錯誤時拋出)
+"""
+
+import os
+import queue
+import threading
+import time
+
+# --- [設定區域] ---
+PIPELINE_QUEUE_BATCHES = int(os.getenv("PIPELINE_QUEUE_BATCHES", "2"))   # 每個階段前的佇列長度 (批)
+
+_DONE = object()   # 佇列結束標記
+
+
+class StagePipeline:
+    """依序串接的處理階段: 每個階段一個執行緒，階段之間以有界佇列傳遞批次
+
+    stages: [(名稱, handler), ...]；handler(batch) 的回傳值交給下一階段，
+    回傳 None 或空批次時不再往下傳 (最後一個階段的回傳值忽略)
+    """
+
+    def __init__(self, stages, maxsize: int = PIPELINE_QUEUE_BATCHES):
+        self.queues = [queue.Queue(maxsize=max(1, maxsize)) for _ in stages]
+        self.seconds = {name: 0.0 for name, _ in stages}   # 各階段累計處理時間
+        self.stall_seconds = 0.0   # 上游因佇列已滿而等待的累計時間
+        self.error = None
+        self._threads = []
+        for index, (name, handler) in enumerate(stages):
+            thread = threading.Thread(target=self._work, args=(index, name, handler),
+                                      name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._closed = False
+
+    def _work(self, index: int, name: str, handler):
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        while True:
+            batch = inbox.get()
+            if batch is _DONE:
+                if outbox is not None:
+                    outbox.put(_DONE)
+                return
+            if self.error is not None:
+                continue   # 已有階段失敗: 丟棄剩餘批次，只把結束標記傳下去
+            started = time.perf_counter()
+            try:
+                result = handler(batch)
+            except BaseException as e:
+                self.error = e
+                print(f"      [管線] ❌ {name} 階段失敗: {e}")
+                continue
+            finally:
+                self.seconds[name] += time.perf_counter() - started
+            if outbox is not None and result:
+                outbox.put(result)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"寫入管線已中止: {self.error}") from self.error
+
+    def put(self, batch):
+        """送入一批 (第一個階段的佇列已滿時等待)"""
+        self._raise_error()
+        started = time.perf_counter()
+        self.queues[0].put(batch)
+        self.stall_seconds += time.perf_counter() - started
+
+    def close(self):
+        """送出結束標記並等待所有階段處理完畢；有階段失敗時拋出其錯誤"""
+        if not self._closed:
+            self._closed = True
+            self.queues[0].put(_DONE)
+            for thread in self._threads:
+                thread.join()
+        self._raise_error()
@@ -0,0 +1,86 @@
+"""
+market_prices 的緊湊編碼
+
+market_prices 是全系統最大的表，每列原本存放三個自由文字欄位
+(source / price_type / stock_status) 和 64 字元的 hex 指紋。
+這裡把它們改為:
+- source / stock_status: 小整數，對應查找表 price_sources / stock_statuses
+- price_type: 小整數 (1 = sell, 2 = buy)
+- data_hash: 64 位元整數指紋 (BIGINT)
+
+Python 端仍然以字串讀寫 (MarketPrice.source == "MercadoP" 照常可用)，
+轉換由 CodedString 型別自動處理。新增來源時，請在下方對照表登記新代碼。
+"""
+
+import hashlib
+
+from sqlalchemy import SmallInteger, text
+from sqlalchemy.types import TypeDecorator
+
+# --- [代碼對照表] (只可新增，不可修改既有代碼) ---
+PRICE_SOURCE_CODES = {
+    "MercadoP": 1,
+    "Akiba-Cardshop": 2,
+    "Merucard-Uniari": 3,
+    "Cardrush-DM": 4,
+    "Cardrush-VG": 5,
+    "Cardrush-Media-Buy": 6,
+    "Cardrush-DM-Kaitori": 7,
+}
+
+PRICE_TYPE_CODES = {
+    "sell": 1,  # 售價
+    "buy": 2,   # 買取價
+}
+
+STOCK_STATUS_CODES = {
+    "In Stock": 1,
+    "Out of Stock": 2,
+    "買取中": 3,
+}
+
+
+class CodedString(TypeDecorator):
+    """資料庫存小整數、Python 端呈現字串的欄位型別"""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, codes):
+        super().__init__()
+        # 以 tuple 保存，讓 SQLAlchemy 的語句快取可以雜湊此型別
+        self.codes = tuple(sorted(codes.items()))
+        self._by_name = dict(self.codes)
+        self._by_code = {code: name for name, code in self.codes}
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return self._by_name[value]
+        except KeyError:
+            raise ValueError(f"未登記的代碼值: {value!r} (請在 price_codes.py 的對照表中新增)")
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self._by_code.get(value, str(value))
+
+
+def price_fingerprint(source: str, price_type: str, price, status) -> int:
+    """生成數據指紋 (有號 64 位元整數)，用於比對價格是否變動
+
+    取 md5(source|price_type|price|status) 的前 8 bytes，
+    與舊版 hex 指紋的前 16 個字元一一對應，遷移時可直接由舊值換算。
+    """
+    data_string = f"{source}|{price_type}|{price}|{status}"
+    return int.from_bytes(hashlib.md5(data_string.encode()).digest()[:8], "big", signed=True)
+
+
+def seed_code_tables(conn):
+    """將對照表寫入查找表 price_sources / stock_statuses (已存在的代碼會略過)"""
+    for table, codes in (("price_sources", PRICE_SOURCE_CODES), ("stock_statuses", STOCK_STATUS_CODES)):
+        existing = set(conn.execute(text(f"SELECT id FROM {table}")).scalars().all())
+        rows = [{"id": code, "name": name} for name, code in codes.items() if code not in existing]
+        if rows:
+            conn.execute(text(f"INSERT INTO {table} (id, name) VALUES (:id, :name)"), rows)
@@ -2,217 +2,144 @@
 # TCGE-CIS 2.0: Akiba 爬蟲 (資料庫版)
 # Author: 電王 & Copilot
 # 
-# 職責: 抓取 Akiba Cardshop 的 OP 買取價格
+# 職責: 抓取 Akiba Cardshop 的 OP / UA 買取價格
 # 升級重點:
 # 1. 寫入 PostgreSQL 資料庫。
 # 2. price_type = 'buy' (買取價)。
-# 3. 增量更新。
+# 3. 增量更新 (繼承 scraper_base.DBScraper，批次寫入)。
+# 4. 不再反覆點擊「もっと見る」: 以 HTTP 直接呼叫按鈕背後的分頁請求 (akiba_loader)，各買取表並行。
+# 5. 逐批處理: 每批解析後立即送進批次寫入，記憶體用量與列表長度無關。
+# 6. 探測不到分頁請求時才使用瀏覽器 (browser_pool.BrowserPool)，逐批擷取新列並清空已處理的列。
+# 7. 斷點續傳: 每批寫入 checkpoint，中斷後重跑從中斷處繼續 (--fresh 從頭開始)。
+# 8. 卡號與系列代碼由共用的辨識引擎 (card_numbers) 解析。
 # =========================================================
 
-import sys
-import os
-import time
+import asyncio
 import re
-import random
-import hashlib
-from datetime import datetime
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
-from sqlalchemy.orm import Session
 
 # 引入資料庫模組
-from database import SessionLocal
-from models import Game, CardSet, Card, MarketPrice
+from scraper_base import DBScraper
+from akiba_loader import crawl_buy_list
+from browser_pool import BrowserPool
+from extraction import parse_price
+from fetcher import PageFetcher, run_async
+from card_numbers import parse_card_number
 
 # --- [設定區域] ---
 WEBSITE_NAME = "Akiba-Cardshop"
-TARGET_URL = "https://akihabara-cardshop.com/op-kaitori-shindan/" # 新彈買取
-# 注意: 這裡只示範新彈頁面，若要包含主列表需擴充 URL 列表
 BASE_URL_AKIBA = "https://akihabara-cardshop.com"
-GAME_CODE = "OP"
-GAME_NAME = "One Piece Card Game"
-LOAD_MORE_BUTTON_SELECTOR = "button#loadMoreButton"
-FIRST_CARD_SELECTOR = "div.tr"
-
-# --- [資料庫工具函數 (重用)] ---
-# 為了保持代碼獨立性，這裡再次定義，實際專案中應提取到 crud.py
-
-def get_or_create_game(db: Session, code: str, name: str):
-    game = db.query(Game).filter(Game.code == code).first()
-    if not game:
-        game = Game(code=code, name=name)
-        db.add(game)
-        db.commit()
-        db.refresh(game)
-    return game
-
-def get_or_create_set(db: Session, game_id: int, set_code: str):
-    card_set = db.query(CardSet).filter(CardSet.code == set_code, CardSet.game_id == game_id).first()
-    if not card_set:
-        card_set = CardSet(game_id=game_id, code=set_code, name=f"Series {set_code}")
-        db.add(card_set)
-        db.commit()
-        db.refresh(card_set)
-    return card_set
-
-def get_or_create_card(db: Session, set_id: int, card_number: str, name: str, image_url: str, version: str = "Normal"):
-    card = db.query(Card).filter(Card.card_number == card_number, Card.version == version).first()
-    if not card:
-        rarity = "Unknown" # Akiba 頁面較難直接解析稀有度，暫設 Unknown
-        card = Card(
-            card_set_id=set_id,
-            card_number=card_number,
-            name=name,
-            version=version,
-            rarity=rarity,
-            image_url=image_url
-        )
-        db.add(card)
-        db.commit()
-        db.refresh(card)
-        print(f"      [DB] ✨ 新增卡片資料: {card_number} ({version})")
-    return card
-
-def generate_price_hash(source, price_type, price, status):
-    data_string = f"{source}|{price_type}|{price}|{status}"
-    return hashlib.md5(data_string.encode()).hexdigest()
-
-def save_price(db: Session, card_id: int, price_jpy: int, status: str):
-    current_hash = generate_price_hash(WEBSITE_NAME, "buy", price_jpy, status)
-    
-    last_price = db.query(MarketPrice).filter(
-        MarketPrice.card_id == card_id,
-        MarketPrice.source == WEBSITE_NAME,
-        MarketPrice.price_type == "buy" # 注意: 這裡是 buy
-    ).order_by(MarketPrice.timestamp.desc()).first()
-    
-    if last_price and last_price.data_hash == current_hash:
-        return False
-    
-    new_price = MarketPrice(
-        card_id=card_id,
-        source=WEBSITE_NAME,
-        price_type="buy", # 注意: 這裡是 buy
-        price_jpy=price_jpy,
-        stock_status=status,
-        data_hash=current_hash
-    )
-    db.add(new_price)
-    db.commit()
-    return True
+WHITESPACE_RE = re.compile(r'\s+')
+
+# 買取頁面 (「もっと見る」的分頁請求由 akiba_loader 處理，各頁並行)
+TARGETS_CONFIG = [
+    {
+        "url": f"{BASE_URL_AKIBA}/op-kaitori-shindan/",   # 新彈買取
+        "code": "OP",
+        "name": "One Piece Card Game",
+    },
+    {
+        "url": f"{BASE_URL_AKIBA}/onepice-kaitori/",
+        "code": "OP",
+        "name": "One Piece Card Game",
+    },
+    {
+        "url": f"{BASE_URL_AKIBA}/uniari-kaitori-shindan/",
+        "code": "UA",
+        "name": "Union Arena",
+    },
+    {
+        "url": f"{BASE_URL_AKIBA}/uniari-kaitori/",
+        "code": "UA",
+        "name": "Union Arena",
+    },
+]
 
 # --- [爬蟲主程式] ---
 
-def main():
-    print(f"\n>> TCGE-CIS 2.0: Akiba 爬蟲 (資料庫版) 啟動...")
-    
-    db = SessionLocal()
-    game_obj = get_or_create_game(db, GAME_CODE, GAME_NAME)
-    print(f"✅ 資料庫連線成功。目標遊戲: {game_obj.name}")
-
-    with sync_playwright() as p:
-        print("\n>> 啟動瀏覽器...")
-        browser = p.firefox.launch(headless=True)
-        page = browser.new_page()
-
-        print(f" -> 正在訪問: {TARGET_URL}")
-        try:
-            page.goto(TARGET_URL, wait_until='domcontentloaded', timeout=120000)
-            
-            # 檢查頁面是否為空
+class AkibaScraper(DBScraper):
+    SCRAPER_NAME = "Akiba"
+    WEBSITE_NAME = WEBSITE_NAME
+    PRICE_TYPE = "buy"  # 注意: 這裡是 buy (買取價)
+
+    def parse_page(self, records, target: dict):
+        """處理一批擷取結果 (extraction.AKIBA_BUY_SPEC)"""
+        for rec in records:
             try:
-                page.wait_for_selector(FIRST_CARD_SELECTOR, timeout=15000)
-            except PlaywrightTimeoutError:
-                print(" ⚠️ 警告: 頁面可能為空或未加載。")
-                browser.close()
-                return
-
-            # 循環點擊 "Load More"
-            print(" -> 正在加載所有卡片...")
-            click_count = 0
-            while True:
-                try:
-                    button = page.locator(LOAD_MORE_BUTTON_SELECTOR + ":not([style*='display: none'])")
-                    if button.is_visible():
-                        button.click()
-                        click_count += 1
-                        print(f"    -> 點擊「更多」 ({click_count})...")
-                        page.wait_for_load_state('networkidle', timeout=5000)
-                        time.sleep(1)
-                    else:
-                        break
-                except Exception:
-                    break
+                price_jpy = parse_price(rec["price"])
+                model_text = rec["model"].strip()
             
-            print(" -> 開始解析頁面...")
-            html = page.content()
-            soup = BeautifulSoup(html, 'html.parser')
-            card_units = soup.select("div.tbody > div.tr")
-            print(f"✅ 發現 {len(card_units)} 條買取情報。")
-
-            total_processed = 0
-            total_updated = 0
-
-            for unit in card_units:
-                try:
-                    name_div = unit.select_one("div.td.td2")
-                    model_div = unit.select_one("div.td.td3")
-                    price_span = unit.select_one("div.td.td5 span.price")
-                    img_tag = unit.select_one("div.td.td1 img")
-                    
-                    if not name_div or not model_div or not price_span: continue
-                    
-                    price_jpy = int(re.sub(r'[^\d]', '', price_span.text))
-                    model_text = model_div.text.strip()
-                    
-                    # 卡號解析
-                    match_num = re.search(r'([A-Z]{1,3}\d{2,3}-?[A-Z]?\d{1,3})', model_text) 
-                    if not match_num: continue
-                    item_card_number = match_num.group(1).strip()
-                    
-                    item_name = name_div.text.strip()
-                    
-                    # 圖片 URL
-                    image_url = ""
-                    if img_tag and img_tag.has_attr('src'):
-                        image_url = img_tag['src'].strip()
-                        image_url = re.sub(r'\s+', '', image_url)
-                        if image_url.startswith('/'): image_url = BASE_URL_AKIBA + image_url
-
-                    # 版本判斷
-                    version = "Normal" # Akiba 較難判斷版本，暫設 Normal，可根據名稱優化
-
-                    # --- [資料庫操作] ---
-                    set_code = item_card_number.split('-')[0] if '-' in item_card_number else "Unknown"
-                    card_set = get_or_create_set(db, game_obj.id, set_code)
-                    card = get_or_create_card(db, card_set.id, item_card_number, item_name, image_url, version)
-                    
-                    # 狀態: Akiba 爬蟲抓的是「買取表」，所以狀態通常是「買取中」
-                    status = "買取中"
-                    
-                    is_updated = save_price(db, card.id, price_jpy, status)
-                    
-                    if is_updated:
-                        print(f"      [UP] 💰 買取變動: {item_card_number} -> {price_jpy} JPY")
-                        total_updated += 1
-                    
-                    total_processed += 1
-
-                except Exception as e:
-                    print(f"      ❌ 解析錯誤: {e}")
-                    continue
-
-            print(f"\n{'='*50}")
-            print(f"🎉 Akiba 任務完成！")
-            print(f"📊 總掃描: {total_processed}")
-            print(f"💾 更新紀錄: {total_updated}")
-            print(f"{'='*50}")
-
+                # 卡號解析
+                found = parse_card_number(model_text, target["code"])
+                if not found: continue
+            
+                item_name = rec["name"].strip()
+            
+                # 圖片 URL
+                image_url = ""
+                if rec["image"]:
+                    image_url = rec["image"].strip()
+                    image_url = WHITESPACE_RE.sub('', image_url)
+                    if image_url.startswith('/'): image_url = BASE_URL_AKIBA + image_url
+
+                # 版本判斷
+                version = "Normal" # Akiba 較難判斷版本，暫設 Normal，可根據名稱優化
+
+                # --- [資料庫操作] ---
+                # 狀態: Akiba 爬蟲抓的是「買取表」，所以狀態通常是「買取中」
+                status = "買取中"
+            
+                self.record(
+                    game_code=target["code"], game_name=target["name"],
+                    set_code=found.set_code, card_number=found.card_number, version=version,
+                    name=item_name,
+                    rarity="Unknown",  # Akiba 頁面較難直接解析稀有度，暫設 Unknown
+                    image_url=image_url,
+                    price_jpy=price_jpy, stock_status=status, series=target["url"],
+                )
+
+            except Exception as e:
+                print(f"      ❌ 解析錯誤: {e}")
+                continue
+
+    async def crawl_target(self, fetcher, pool, target: dict):
+        url = target["url"]
+        # 上次已抓到的批次直接還原，從下一批繼續
+        for records in self.checkpoint.replay(url):
+            self.parse_page(records, target)
+        if self.checkpoint.is_done(url):
+            print(f" -> {url}: 已於上次完成，略過。")
+            return
+
+        def on_batch(records, batch):
+            self.parse_page(records, target)
+            self.checkpoint.page_done(url, batch, records)
+
+        print(f" -> 正在訪問: {url}")
+        try:
+            batches = await crawl_buy_list(fetcher, url, on_batch, pool, start_batch=self.checkpoint.next_page(url))
         except Exception as e:
-            print(f"❌ 發生錯誤: {e}")
-        
-        browser.close()
-    db.close()
+            print(f"    ❌ {url} 處理失敗: {str(e)[:80]}")
+            return
+        self.checkpoint.series_done(url)
+        print(f"✅ {url}: 共 {batches} 批。")
+
+    async def crawl(self):
+        targets = {target["url"]: target for target in TARGETS_CONFIG}
+        async with PageFetcher() as fetcher:
+            # 瀏覽器只在需要探測分頁請求時才啟動
+            pool = BrowserPool(throttle=fetcher.throttle)
+            try:
+                await asyncio.gather(*(self.crawl_target(fetcher, pool, targets[url])
+                                       for url in self.plan(list(targets))))
+            finally:
+                await pool.close()
+            print(f"✅ HTTP 抓取 {fetcher.http_pages} 次，瀏覽器開啟 {pool.pages_loaded} 頁。")
+
+    def scrape(self):
+        run_async(self.crawl())
+
+def main():
+    AkibaScraper().run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,107 @@
+# =========================================================
+# TCGE-CIS 2.0: CardRush 買取爬蟲 (資料庫版) - VG & DM
+# Author: 電王 & Copilot
+#
+# 職責: 抓取 cardrush.media 的 VG 買取價 (Cardrush-Media-Buy) 與 DM 買取價 (Cardrush-DM-Kaitori)
+# 升級重點:
+# 1. 寫入 PostgreSQL 資料庫，price_type = 'buy' (買取價)。
+# 2. 不開瀏覽器: 直接以 HTTP 抓取 Next.js 資料路徑 (cardrush_media.crawl_buying_prices)。
+# 3. 各頁並行抓取 (受 host_throttle 的每網站上限約束)，每頁的 buyingPrices 直接送進批次寫入。
+# 4. 增量更新 (繼承 scraper_base.DBScraper)。
+# 5. 沒有型番時的卡號 ({...}) 與系列代碼由共用的辨識引擎 (card_numbers) 解析。
+# =========================================================
+
+import re
+
+from scraper_base import DBScraper
+from cardrush_media import crawl_buying_prices
+from fetcher import PageFetcher, gather_limited, run_async
+from card_numbers import braced_card_number, set_code_of
+
+# --- [設定區域] ---
+BUY_SITES_CONFIG = [
+    {
+        "code": "VG",
+        "name": "Cardfight!! Vanguard",
+        "source": "Cardrush-Media-Buy",
+        "url": "https://cardrush.media/vanguard/buying_prices",
+    },
+    {
+        "code": "DM",
+        "name": "Duel Masters",
+        "source": "Cardrush-DM-Kaitori",
+        "url": "https://cardrush.media/duel_masters/buying_prices",
+    },
+]
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class CardrushBuyScraper(DBScraper):
+    SCRAPER_NAME = "CardRush-Buy"
+    WEBSITE_NAME = "Cardrush-Media-Buy"
+    PRICE_TYPE = "buy"
+
+    def parse_page(self, records, site: dict):
+        """處理一頁的 buyingPrices"""
+        for card in records:
+            try:
+                item_name = (card.get("name") or "").strip()
+                item_card_number = (card.get("model_number") or "").strip()
+                price_jpy = card.get("amount")
+                if not item_name or price_jpy is None:
+                    continue
+
+                if not item_card_number:
+                    # 沒有型番時，從商品名稱的 {...} 取卡號
+                    found = braced_card_number(item_name, site["code"])
+                    if not found:
+                        continue  # 沒有卡號 (デッキ/サプライ等)
+                    item_card_number = found.card_number
+
+                image_url = ""
+                ocha_product = card.get("ocha_product") or {}
+                if ocha_product.get("image_source"):
+                    image_url = WHITESPACE_RE.sub("%20", ocha_product["image_source"].strip())
+
+                self.record(
+                    game_code=site["code"], game_name=site["name"], source=site["source"],
+                    set_code=set_code_of(item_card_number), card_number=item_card_number, name=item_name,
+                    rarity=card.get("rarity") or "Unknown", image_url=image_url,
+                    price_jpy=int(price_jpy), stock_status="買取中", series=site["url"],
+                )
+            except Exception as e:
+                print(f"      ❌ 解析錯誤: {e} - {card.get('name')}")
+                continue
+
+    async def crawl_site(self, fetcher, site: dict):
+        print(f"\n>> 開始處理: {site['name']} 買取 ({site['source']})")
+        records_seen = 0
+
+        def on_page(records, page):
+            nonlocal records_seen
+            records_seen += len(records)
+            self.parse_page(records, site)
+
+        try:
+            pages = await crawl_buying_prices(fetcher, site["url"], on_page)
+        except Exception as e:
+            # 已抓到的頁面照常寫入；拋出讓這次執行記為失敗並保留斷點 (該買取表不算完整爬完)
+            print(f"❌ {site['source']} 抓取失敗: {e}")
+            raise
+        print(f"✅ {site['source']}: {pages} 頁，{records_seen} 條買取情報。")
+
+    async def crawl(self):
+        sites = {site["url"]: site for site in BUY_SITES_CONFIG}
+        async with PageFetcher() as fetcher:
+            # 兩個買取表在同一網站，總並行數由 HostThrottle 的每網站上限控管
+            await gather_limited([self.crawl_site(fetcher, sites[url]) for url in self.plan(list(sites))])
+            print(f"✅ HTTP 抓取 {fetcher.http_pages} 頁，未使用瀏覽器。")
+
+    def scrape(self):
+        run_async(self.crawl())
+
+def main():
+    CardrushBuyScraper().run()
+
+if __name__ == "__main__":
+    main()
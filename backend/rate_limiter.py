@@ -0,0 +1,247 @@
+"""
+跨行程的每網站自適應速率限制 (Token Bucket + AIMD)
+
+host_throttle 原本以固定的 FETCH_MIN_INTERVAL 控制同一行程內的請求間隔，
+根目錄的 Sheets 腳本則各自 time.sleep(random.uniform(1, 3))；run_all_scrapers 同時啟動
+多個爬蟲時，各行程互不知道對方，429 也只有 Sheets 寫入會處理。
+
+本模組把每個網站 (host) 的速率狀態放在一個本機 SQLite 檔 (RATE_LIMIT_DB)，
+所有行程共用同一個令牌桶:
+
+- 令牌桶: 每秒補充 rate 個令牌，最多累積 RATE_LIMIT_BURST 個。每個請求先 reserve() 一個令牌，
+  不足時預約下一個令牌 (令牌數可為負)，回傳需要等待的秒數。
+  預約在同一個 BEGIN IMMEDIATE 交易內完成，多個行程同時預約也不會超發。
+- 自適應 (AIMD): 每個正常回應 rate 加 RATE_LIMIT_STEP (加法增加，最高 RATE_LIMIT_MAX_RPS)；
+  429 / 5xx / 連線錯誤時 rate 乘以 RATE_LIMIT_BACKOFF (乘法減少，最低 RATE_LIMIT_MIN_RPS)，
+  有 Retry-After 時該網站暫停到指定時間為止。
+  因此每個網站會穩定在「它能承受的最快速度」附近，而不是固定的保守間隔。
+
+HostThrottle.pace() 與 fetcher 的回應處理已改用本模組；同步的 Sheets 腳本以
+wait_turn_sync(url) / report_status(url, status) 取代隨機 sleep。
+
+用法:
+    python rate_limiter.py                          # 各網站目前的速率
+    python rate_limiter.py --reset www.cardrush.jp  # 重設某網站 (回到初始速率)
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from run_history import add_metrics
+
+# --- [設定區域] ---
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "rate_limits.db"
+)
+RATE_LIMIT_START_RPS = float(os.getenv("RATE_LIMIT_START_RPS", "4"))     # 新網站的初始速率 (每秒請求數，同舊版 0.25 秒間隔)
+RATE_LIMIT_MIN_RPS = float(os.getenv("RATE_LIMIT_MIN_RPS", "0.2"))
+RATE_LIMIT_MAX_RPS = float(os.getenv("RATE_LIMIT_MAX_RPS", "8"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "2"))             # 令牌桶容量
+RATE_LIMIT_STEP = float(os.getenv("RATE_LIMIT_STEP", "0.05"))            # 每個正常回應增加的速率
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "0.5"))       # 被限流時速率的倍數
+# 設為 0 時不使用共用速率 (host_throttle 退回固定間隔)
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "1") != "0"
+
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 600   # Retry-After 的上限 (秒)，避免異常的標頭讓爬蟲停擺
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS host_limits (
+        host TEXT PRIMARY KEY,
+        rate REAL NOT NULL,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        blocked_until REAL NOT NULL DEFAULT 0,
+        healthy INTEGER NOT NULL DEFAULT 0,
+        throttled INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc or url
+
+
+def parse_retry_after(value) -> float:
+    """Retry-After 標頭 (秒數) -> 秒；日期格式或空值回傳 0"""
+    value = str(value or "").strip()
+    return min(float(value), MAX_RETRY_AFTER) if value.isdigit() else 0.0
+
+
+class HostRateLimiter:
+    """以 SQLite 檔在行程之間共用的每網站令牌桶"""
+
+    def __init__(self, path: str = RATE_LIMIT_DB, start_rps: float = RATE_LIMIT_START_RPS,
+                 min_rps: float = RATE_LIMIT_MIN_RPS, max_rps: float = RATE_LIMIT_MAX_RPS,
+                 burst: float = RATE_LIMIT_BURST, step: float = RATE_LIMIT_STEP,
+                 backoff: float = RATE_LIMIT_BACKOFF):
+        self.path = path
+        self.start_rps = min(max(start_rps, min_rps), max_rps)
+        self.min_rps = min_rps
+        self.max_rps = max_rps
+        self.burst = max(burst, 1.0)
+        self.step = step
+        self.backoff = backoff
+        self._lock = threading.Lock()   # 同一行程內的執行緒共用一條連線
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _update(self, host: str, change):
+        """在一個寫入交易內讀出、修改並寫回某網站的狀態；change(state, now) 回傳值原樣交回"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT rate, tokens, updated_at, blocked_until, healthy, throttled FROM host_limits WHERE host = ?",
+                    (host,),
+                ).fetchone()
+                if row is None:
+                    state = {"rate": self.start_rps, "tokens": self.burst, "updated_at": now,
+                             "blocked_until": 0.0, "healthy": 0, "throttled": 0}
+                else:
+                    state = dict(zip(("rate", "tokens", "updated_at", "blocked_until", "healthy", "throttled"), row))
+                # 補充自上次更新以來的令牌
+                elapsed = max(0.0, now - state["updated_at"])
+                state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+                state["updated_at"] = now
+                result = change(state, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO host_limits (host, rate, tokens, updated_at, blocked_until, healthy, throttled)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (host, state["rate"], state["tokens"], state["updated_at"], state["blocked_until"],
+                     state["healthy"], state["throttled"]),
+                )
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def reserve(self, host: str) -> float:
+        """預約該網站的下一個令牌，回傳開始請求前需要等待的秒數"""
+        def take(state, now):
+            wait = max(0.0, state["blocked_until"] - now)
+            if state["tokens"] < 1:
+                wait = max(wait, (1 - state["tokens"]) / state["rate"])
+            state["tokens"] -= 1
+            return wait
+
+        return self._update(host, take)
+
+    def report(self, host: str, status: int, retry_after: float = 0.0) -> float:
+        """回報一個回應的狀態碼 (連線錯誤傳 0)，調整該網站的速率並回傳新的速率"""
+        throttled = status == 0 or status in THROTTLE_STATUS
+
+        def adjust(state, now):
+            if throttled:
+                state["rate"] = max(self.min_rps, state["rate"] * self.backoff)
+                state["tokens"] = min(state["tokens"], 0.0)   # 取消累積的額度，不再連發
+                state["throttled"] += 1
+                if retry_after > 0:
+                    state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+            else:
+                state["rate"] = min(self.max_rps, state["rate"] + self.step)
+                state["healthy"] += 1
+            return state["rate"]
+
+        rate = self._update(host, adjust)
+        if throttled:
+            reason = f"HTTP {status}" if status else "連線錯誤"
+            print(f"   -> ⏳ {host} 回應 {reason}，速率降為每秒 {rate:.2f} 次"
+                  + (f"，暫停 {retry_after:.0f} 秒" if retry_after > 0 else "") + "。")
+        return rate
+
+    def snapshot(self):
+        """所有網站的狀態 [(host, rate, healthy, throttled, blocked_until), ...]"""
+        with self._lock:
+            return self._connect().execute(
+                "SELECT host, rate, healthy, throttled, blocked_until FROM host_limits ORDER BY host"
+            ).fetchall()
+
+    def reset(self, host: str) -> int:
+        with self._lock:
+            return self._connect().execute("DELETE FROM host_limits WHERE host = ?", (host,)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default = None
+
+
+def default_limiter() -> HostRateLimiter:
+    """本行程共用的速率限制器 (RATE_LIMIT_SHARED=0 時回傳 None)"""
+    global _default
+    if not RATE_LIMIT_SHARED:
+        return None
+    if _default is None:
+        _default = HostRateLimiter()
+    return _default
+
+
+# --- [同步腳本用] ---
+
+def wait_turn_sync(url: str):
+    """等到該網站的下一個令牌 (取代固定的 time.sleep)"""
+    limiter = default_limiter()
+    if limiter is None:
+        return
+    wait = limiter.reserve(host_of(url))
+    if wait > 0:
+        time.sleep(wait)
+
+
+def report_status(url: str, status: int, retry_after=None):
+    """回報回應狀態碼 (Playwright 的 page.goto 回傳 None 時傳 0)；同時計入目前的執行紀錄"""
+    status = status or 0
+    if status == 0 or status in THROTTLE_STATUS:
+        add_metrics(errors=1)
+    else:
+        add_metrics(pages=1)
+    limiter = default_limiter()
+    if limiter is not None:
+        limiter.report(host_of(url), status, parse_retry_after(retry_after))
+
+
+def print_report(limiter: HostRateLimiter = None):
+    limiter = limiter or HostRateLimiter()
+    rows = limiter.snapshot()
+    if not rows:
+        print("尚無網站速率紀錄。")
+    now = time.time()
+    for host, rate, healthy, throttled, blocked_until in rows:
+        blocked = f"  暫停中 (剩 {blocked_until - now:.0f} 秒)" if blocked_until > now else ""
+        print(f"  {host:<32} {rate:>6.2f}/s  正常 {healthy:>7}  限流 {throttled:>5}{blocked}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各網站的自適應請求速率")
+    parser.add_argument("--reset", metavar="HOST", help="重設某網站的速率")
+    args = parser.parse_args()
+
+    if args.reset:
+        deleted = HostRateLimiter().reset(args.reset)
+        print(f"✅ 已重設 {args.reset} 的速率紀錄 ({deleted} 筆)。")
+        return
+    print_report()
+
+
+if __name__ == "__main__":
+    main()
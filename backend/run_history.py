@@ -0,0 +1,345 @@
+"""
+爬蟲執行紀錄與效能趨勢 (Run Telemetry)
+
+執行結果原本只存在主控台文字中: 看不出 Mercadop 這週是否變慢、每次寫入了多少列，
+run_all_scrapers.py 的超時限制也只能手動寫死。本模組把每次執行的指標寫入 scraper_runs 表:
+
+- RunRecorder: 一次執行 (資料庫版爬蟲、單獨執行的 Sheets 腳本、總指揮、總指揮排程的每次任務執行)。
+  開始時寫入一列 (running)，結束時更新狀態、耗時與指標。
+  執行期間綁定在目前的執行緒上，fetcher / rate_limiter / Sheets 腳本以 add_metrics()
+  累加頁面數、位元組、解析時間、寫入列數、重試與錯誤數，不必層層傳遞。
+- 趨勢: 每個任務最近 RUN_TREND_RECENT 次與之前 RUN_HISTORY_WINDOW 次的中位數比較，
+  耗時增加、頁面數或解析列數減少、失敗變多時標記為退化 (網站改版或被限流的早期訊號)。
+- 超時預算: timeout_budget() 以最近執行的 p95 耗時 (與 p95 最長無輸出時間) 乘上
+  RUN_TIMEOUT_MARGIN 作為超時限制；樣本不足 RUN_HISTORY_MIN_SAMPLES 次時沿用呼叫端的預設值。
+  只採用第一次執行 (attempt = 1): 重試從斷點繼續，耗時較短，會把預算拉低。
+  超時中斷的執行視為設限樣本 (censored): 實際耗時至少是中斷時的耗時，以該值列入 p95，
+  經常超時的任務預算會隨之放寬；其他失敗不列入。推算值可以比預設值更短或更長。
+
+寫入紀錄失敗 (例如資料庫未啟動) 只印出一次警告並停用紀錄，不影響爬蟲本身。
+
+用法:
+    python run_history.py                   # 各任務的趨勢、退化標記與超時預算
+    python run_history.py --name mercadop   # 某任務最近的執行紀錄
+    python run_history.py --prune 90        # 刪除 90 天前的紀錄
+"""
+
+import argparse
+import os
+import statistics
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select, update
+
+# --- [設定區域] ---
+RUN_HISTORY = os.getenv("RUN_HISTORY", "1") != "0"                            # 設為 0 時不記錄
+RUN_HISTORY_WINDOW = int(os.getenv("RUN_HISTORY_WINDOW", "20"))              # 作為基準的歷史執行次數
+RUN_HISTORY_MIN_SAMPLES = int(os.getenv("RUN_HISTORY_MIN_SAMPLES", "5"))     # 推算超時 / 判斷退化所需的最少次數
+RUN_TREND_RECENT = int(os.getenv("RUN_TREND_RECENT", "3"))                   # 與基準比較的最近執行次數
+RUN_REGRESSION_RATIO = float(os.getenv("RUN_REGRESSION_RATIO", "1.5"))       # 超過此倍數視為退化
+RUN_TIMEOUT_MARGIN = float(os.getenv("RUN_TIMEOUT_MARGIN", "1.5"))           # 超時 = p95 x 此倍數
+RUN_TIMEOUT_MIN_MINUTES = float(os.getenv("RUN_TIMEOUT_MIN_MINUTES", "10"))
+RUN_SILENCE_MIN_SECONDS = float(os.getenv("RUN_SILENCE_MIN_SECONDS", "300"))
+
+METRIC_FIELDS = ("pages", "bytes", "parse_seconds", "write_seconds", "rows_seen", "rows_written",
+                 "rows_skipped", "retries", "errors")
+
+_local = threading.local()      # 目前執行緒上的 RunRecorder
+_state = {"enabled": RUN_HISTORY, "ready_urls": set()}   # ready_urls: 已確認有 scraper_runs 表的資料庫
+_state_lock = threading.Lock()
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def add_metrics(**amounts):
+    """累加到目前執行緒的執行紀錄 (沒有進行中的紀錄時忽略)"""
+    run = current_run()
+    if run is not None:
+        run.add(**amounts)
+
+
+def _default_bind():
+    from database import engine
+    return engine
+
+
+def _write(bind, statement):
+    """執行一條寫入；失敗時停用紀錄 (只警告一次)，回傳結果或 None"""
+    if not _state["enabled"]:
+        return None
+    try:
+        from models import ScraperRun
+        with _state_lock:
+            if str(bind.url) not in _state["ready_urls"]:
+                # 既有資料庫可能還沒有 scraper_runs 表 (create_tables.py 之前建立的)
+                ScraperRun.__table__.create(bind, checkfirst=True)
+                _state["ready_urls"].add(str(bind.url))
+        with bind.begin() as conn:
+            return conn.execute(statement)
+    except Exception as e:
+        _state["enabled"] = False
+        print(f"⚠️ 無法寫入執行紀錄，本次不再記錄: {e}")
+        return None
+
+
+class RunRecorder:
+    """一次執行的指標: start() 寫入一列並綁定到目前執行緒，finish() 寫回結果"""
+
+    def __init__(self, name: str, kind: str = "scraper", parent_id: int = None, attempt: int = 1, bind=None):
+        self.name = name
+        self.kind = kind
+        self.parent_id = parent_id
+        self.attempt = attempt
+        self.bind = bind
+        self.id = None
+        self.started_at = None
+        self.finished_at = None
+        self.metrics = dict.fromkeys(METRIC_FIELDS, 0)
+        self.max_silence_seconds = None
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self._lock:
+            for field, amount in amounts.items():
+                self.metrics[field] += amount
+
+    def set(self, **values):
+        with self._lock:
+            self.metrics.update(values)
+
+    def start(self):
+        from models import ScraperRun
+        self.started_at = datetime.now(timezone.utc)
+        self._previous = current_run()
+        if self.parent_id is None and self._previous is not None:
+            self.parent_id = self._previous.id   # 巢狀執行 (例如任務中的資料庫版爬蟲)
+        _local.run = self
+        if self.bind is None and _state["enabled"]:
+            try:
+                self.bind = _default_bind()
+            except Exception as e:
+                _state["enabled"] = False
+                print(f"⚠️ 無法連接資料庫，本次不記錄執行紀錄: {e}")
+                return self
+        result = _write(self.bind, insert(ScraperRun).values(
+            name=self.name, kind=self.kind, parent_id=self.parent_id, attempt=self.attempt,
+            status="running", started_at=self.started_at,
+        ))
+        if result is not None:
+            self.id = result.inserted_primary_key[0]
+        return self
+
+    def finish(self, error=None):
+        """寫回結果；error 為例外或訊息 (None 表示成功)。只有第一次呼叫會寫入"""
+        from models import ScraperRun
+        if current_run() is self:
+            _local.run = self._previous
+        if self.id is None or self.finished_at is not None:
+            return
+        self.finished_at = finished_at = datetime.now(timezone.utc)
+        with self._lock:
+            metrics = dict(self.metrics)
+        if error is not None:
+            error = (str(error) or type(error).__name__)[:500]
+        _write(self.bind, update(ScraperRun).where(ScraperRun.id == self.id).values(
+            status="failed" if error is not None else "done", error=error, finished_at=finished_at,
+            duration_seconds=(finished_at - self.started_at).total_seconds(),
+            max_silence_seconds=self.max_silence_seconds, **metrics,
+        ))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc if exc_type is not None else None)
+        return False
+
+
+# --- [歷史查詢] ---
+
+def load_runs(conn, name: str = None, kind: str = None, limit: int = 50):
+    """最近的執行紀錄 (新的在前)"""
+    from models import ScraperRun
+    query = select(ScraperRun.__table__).order_by(ScraperRun.started_at.desc()).limit(limit)
+    if name:
+        query = query.where(ScraperRun.name == name)
+    if kind:
+        query = query.where(ScraperRun.kind == kind)
+    return [dict(row) for row in conn.execute(query).mappings()]
+
+
+def percentile(values, q: float):
+    """最近秩 (nearest-rank) 百分位數；沒有值時回傳 None"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * q // 100))   # ceil(n * q / 100)
+    return values[int(rank) - 1]
+
+
+def _median(runs, field):
+    values = [run[field] for run in runs if run[field] is not None]
+    return statistics.median(values) if values else None
+
+
+def _finished_runs(conn, name: str, kind: str, limit: int):
+    from models import ScraperRun
+    query = (
+        select(ScraperRun.__table__)
+        .where(ScraperRun.name == name, ScraperRun.kind == kind, ScraperRun.status != "running")
+        .order_by(ScraperRun.started_at.desc())
+        .limit(limit)
+    )
+    return [dict(row) for row in conn.execute(query).mappings()]
+
+
+def _timed_out(run) -> bool:
+    """是否為總指揮因超時 (總時間或無輸出時間) 中斷的執行 (原因文字見 orchestrator.py TaskMonitor.check)"""
+    return run["status"] == "failed" and "超過" in (run["error"] or "")
+
+
+def budget_from_runs(runs, fallback_minutes: float, fallback_silence: float):
+    """由第一次執行 (非重試) 的 p95 推算 (超時分鐘, 無輸出秒數)；樣本不足時回傳預設值
+
+    成功的執行與超時中斷的執行 (設限樣本，以中斷時的耗時計) 都列入樣本
+    """
+    samples = [run for run in runs
+               if (run["status"] == "done" or _timed_out(run)) and (run["attempt"] or 1) == 1]
+    if len(samples) < RUN_HISTORY_MIN_SAMPLES:
+        return fallback_minutes, fallback_silence
+    p95_seconds = percentile([run["duration_seconds"] for run in samples], 95)
+    minutes = max(RUN_TIMEOUT_MIN_MINUTES, p95_seconds * RUN_TIMEOUT_MARGIN / 60)
+    p95_silence = percentile([run["max_silence_seconds"] for run in samples], 95)
+    silence = fallback_silence if p95_silence is None else max(RUN_SILENCE_MIN_SECONDS, p95_silence * RUN_TIMEOUT_MARGIN)
+    return minutes, silence
+
+
+def timeout_budget(name: str, fallback_minutes: float, fallback_silence: float, kind: str = "task", bind=None):
+    """總指揮任務的超時預算 (超時分鐘, 無輸出秒數)；無法讀取歷史時回傳預設值"""
+    if not _state["enabled"]:
+        return fallback_minutes, fallback_silence
+    try:
+        bind = bind or _default_bind()
+        with bind.connect() as conn:
+            runs = _finished_runs(conn, name, kind, RUN_HISTORY_WINDOW)
+    except Exception:
+        return fallback_minutes, fallback_silence   # 尚未建立紀錄表或資料庫無法連線
+    return budget_from_runs(runs, fallback_minutes, fallback_silence)
+
+
+def regression_flags(recent, baseline):
+    """比較最近與基準的執行，回傳退化標記 [...]"""
+    if len(baseline) < RUN_HISTORY_MIN_SAMPLES or not recent:
+        return []
+    flags = []
+    recent_done = [run for run in recent if run["status"] == "done"]
+    baseline_done = [run for run in baseline if run["status"] == "done"]
+    if recent_done and baseline_done:
+        now, before = _median(recent_done, "duration_seconds"), _median(baseline_done, "duration_seconds")
+        if now and before and now > before * RUN_REGRESSION_RATIO:
+            flags.append(f"變慢 {now / before:.1f}x")
+        for field, label in (("pages", "頁面數"), ("rows_seen", "解析列數")):
+            now, before = _median(recent_done, field), _median(baseline_done, field)
+            if before and (now or 0) * RUN_REGRESSION_RATIO < before:
+                flags.append(f"{label}減少 ({before:.0f} -> {now or 0:.0f})")
+    recent_failed = sum(run["status"] == "failed" for run in recent) / len(recent)
+    baseline_failed = sum(run["status"] == "failed" for run in baseline) / len(baseline)
+    if recent_failed >= 0.5 and recent_failed > baseline_failed:
+        flags.append(f"失敗率 {recent_failed:.0%} (過去 {baseline_failed:.0%})")
+    return flags
+
+
+def run_trends(conn):
+    """每個 (kind, name) 的趨勢摘要，依名稱排序"""
+    from models import ScraperRun
+    keys = conn.execute(select(ScraperRun.kind, ScraperRun.name).distinct()).all()
+    trends = []
+    for kind, name in sorted(keys, key=lambda key: (key[0], key[1])):
+        runs = _finished_runs(conn, name, kind, RUN_TREND_RECENT + RUN_HISTORY_WINDOW)
+        if not runs:
+            continue
+        recent, baseline = runs[:RUN_TREND_RECENT], runs[RUN_TREND_RECENT:]
+        done = [run for run in runs if run["status"] == "done"]
+        budget = budget_from_runs(runs[:RUN_HISTORY_WINDOW], None, None)[0]
+        trends.append({
+            "name": name,
+            "kind": kind,
+            "runs": len(runs),
+            "success_rate": len(done) / len(runs),
+            "last_started_at": runs[0]["started_at"],
+            "last_status": runs[0]["status"],
+            "recent_median_seconds": _median([run for run in recent if run["status"] == "done"], "duration_seconds"),
+            "baseline_median_seconds": _median([run for run in baseline if run["status"] == "done"], "duration_seconds"),
+            "p95_seconds": percentile([run["duration_seconds"] for run in done], 95),
+            "median_pages": _median(done, "pages"),
+            "median_rows_written": _median(done, "rows_written"),
+            "timeout_budget_minutes": budget,
+            "flags": regression_flags(recent, baseline),
+        })
+    return trends
+
+
+def _minutes(seconds):
+    return f"{seconds / 60:6.1f}" if seconds is not None else "     -"
+
+
+def print_report(bind=None):
+    bind = bind or _default_bind()
+    with bind.connect() as conn:
+        trends = run_trends(conn)
+    if not trends:
+        print("尚無執行紀錄。")
+    for trend in trends:
+        budget = trend["timeout_budget_minutes"]
+        budget = f"{budget:6.1f}" if budget is not None else "  預設"
+        flags = f"  ⚠️ {'、'.join(trend['flags'])}" if trend["flags"] else ""
+        print(f"  {trend['kind']:<12} {trend['name']:<20} {trend['runs']:>3} 次  成功 {trend['success_rate']:>4.0%}  "
+              f"最近 {_minutes(trend['recent_median_seconds'])} / 過去 {_minutes(trend['baseline_median_seconds'])} 分鐘  "
+              f"p95 {_minutes(trend['p95_seconds'])}  超時預算 {budget}{flags}")
+
+
+def print_runs(name: str, limit: int = 20, bind=None):
+    bind = bind or _default_bind()
+    with bind.connect() as conn:
+        runs = load_runs(conn, name=name, limit=limit)
+    if not runs:
+        print(f"{name} 尚無執行紀錄。")
+    for run in runs:
+        error = f"  {run['error']}" if run["error"] else ""
+        print(f"  {run['started_at']:%Y-%m-%d %H:%M}  {run['kind']:<12} #{run['attempt']}  {run['status']:<7} "
+              f"{_minutes(run['duration_seconds'])} 分鐘  頁面 {run['pages'] or 0:>6}  "
+              f"{(run['bytes'] or 0) / 1e6:>7.1f} MB  解析 {run['parse_seconds'] or 0:>6.1f}s  "
+              f"寫入 {run['rows_written'] or 0:>6}  略過 {run['rows_skipped'] or 0:>6}  "
+              f"重試 {run['retries'] or 0:>3}  錯誤 {run['errors'] or 0:>3}{error}")
+
+
+def main():
+    from models import ScraperRun
+
+    parser = argparse.ArgumentParser(description="爬蟲執行紀錄與效能趨勢")
+    parser.add_argument("--name", help="列出某任務最近的執行紀錄")
+    parser.add_argument("--limit", type=int, default=20, help="--name 列出的筆數")
+    parser.add_argument("--prune", type=int, metavar="DAYS", help="刪除 DAYS 天前的紀錄")
+    args = parser.parse_args()
+
+    if args.prune is not None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=args.prune)
+        with _default_bind().begin() as conn:
+            # 先刪子任務 (parent_id 外鍵)，再刪總指揮與其他紀錄
+            old_ids = select(ScraperRun.id).where(ScraperRun.started_at < cutoff)
+            deleted = conn.execute(delete(ScraperRun).where(ScraperRun.parent_id.in_(old_ids))).rowcount
+            deleted += conn.execute(delete(ScraperRun).where(ScraperRun.started_at < cutoff)).rowcount
+        print(f"✅ 已刪除 {args.prune} 天前的 {deleted} 筆執行紀錄。")
+        return
+    if args.name:
+        print_runs(args.name, args.limit)
+        return
+    print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+資料庫版爬蟲的共用骨架
+
+四個 *_db.py 爬蟲原本各自複製 get_or_create_game / get_or_create_set /
+get_or_create_card / save_price，每張卡都要來回查詢資料庫數次。
+本模組提供:
+
+- IdentityCache: 開始時一次載入所有 games / card_sets / cards，之後在記憶體中解析；
+  每筆商品經 entity_resolution 對應到既有卡片 (跨來源共用同一張卡)，
+  只有真正新的系列/卡片才寫入資料庫，而且整批一起寫。
+- DBScraper: 爬蟲基底類別。子類只需設定來源資訊並實作 scrape()，
+  解析出的每張卡呼叫 self.record(...)，寫入由 ingest.PriceIngestor 批次處理。
+- 變動偵測: 每個來源第一次出現時，以一條查詢載入其 (卡, 價格類型) 的最新指紋，
+  之後在記憶體中比對，只把有變動的列送去寫入 (與舊版 save_price「只在變動時寫入」相同)。
+- 串流寫入: 滿批的列交給背景管線 (pipeline.StagePipeline): 對應卡片 + 去重 -> 寫入，
+  與抓取同時進行；佇列有上限，寫入跟不上時 record() 會等待，記憶體用量固定。
+  卡片/指紋快取只由管線的 resolve 階段修改，爬蟲端 (record) 只讀取。
+- 爬取排程: plan(urls) 只回傳到期的系列 (crawl_planner.CrawlPlanner)；
+  record(series=url) 逐系列統計變動數，執行結束時寫回 crawl_stats 以調整下次重訪時間。
+- 斷點續傳: self.checkpoint (checkpoint.ScrapeCheckpoint) 交給 fetcher.crawl_listing，
+  每頁寫入斷點；被終止後重跑會從中斷處繼續，成功結束才清除。指令列 --fresh 強制從頭開始。
+- 執行紀錄: 每次 run() 寫入 scraper_runs 一列 (run_history.RunRecorder)，
+  包含掃描、寫入與指紋相同而略過的列數，供 run_history.py 比較趨勢。
+
+範例:
+    class MyScraper(DBScraper):
+        WEBSITE_NAME = "MercadoP"
+        GAME_CODE = "OP"
+        GAME_NAME = "One Piece Card Game"
+
+        def scrape(self):
+            for url in self.plan(all_series_urls):
+                ...
+                self.record(set_code="OP01", card_number="OP01-001", name="...", price_jpy=100,
+                            stock_status="In Stock", series=url)
+
+    MyScraper().run()
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import engine
+from models import Game, CardSet, Card, MarketPrice
+from ingest import INGEST_BACKGROUND, PriceIngestor, StagedPrice
+from entity_resolution import EntityResolver
+from crawl_planner import CrawlPlanner
+from checkpoint import ScrapeCheckpoint, fresh_requested
+from partitions import ensure_partitions
+from run_history import RunRecorder
+from price_codes import price_fingerprint
+
+
+def _insert_ignore(bind, table):
+    """INSERT ... ON CONFLICT DO NOTHING (依方言選擇語法)"""
+    if bind.dialect.name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if bind.dialect.name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def load_latest_hashes(bind, source: str) -> dict:
+    """一次查出某來源每張卡、每種價格類型的最新指紋 {(card_id, price_type): data_hash}
+
+    同一秒寫入的多筆 (SQLite 的 timestamp 只到秒) 以 id 較大者為最新。
+    """
+    ranked = select(
+        MarketPrice.card_id,
+        MarketPrice.price_type,
+        MarketPrice.data_hash,
+        func.row_number().over(
+            partition_by=(MarketPrice.card_id, MarketPrice.price_type),
+            order_by=(MarketPrice.timestamp.desc(), MarketPrice.id.desc()),
+        ).label("rn"),
+    ).where(MarketPrice.source == source).subquery()
+
+    query = select(ranked.c.card_id, ranked.c.price_type, ranked.c.data_hash).where(ranked.c.rn == 1)
+    with bind.connect() as conn:
+        return {(card_id, price_type): data_hash for card_id, price_type, data_hash in conn.execute(query)}
+
+
+class IdentityCache:
+    """本次執行的 遊戲 / 系列 / 卡片 身分快取"""
+
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self.games = {}   # code -> game_id
+        self.sets = {}    # (game_id, set_code) -> set_id
+        self.cards = {}   # (card_number, version) -> card_id
+        self.entities = EntityResolver(bind)
+
+    def preload(self):
+        with self.bind.connect() as conn:
+            self.games = {code: id_ for id_, code in conn.execute(select(Game.id, Game.code))}
+            # 同一系列若有重複列，沿用最早建立的那一列 (與舊版 .first() 行為一致)
+            for id_, game_id, code in conn.execute(
+                select(CardSet.id, CardSet.game_id, CardSet.code).order_by(CardSet.id.desc())
+            ):
+                self.sets[(game_id, code)] = id_
+            self.cards = self.entities.preload(conn)
+        print(f"✅ 已載入身分快取: {len(self.games)} 個遊戲、{len(self.sets)} 個系列、{len(self.cards)} 張卡片。")
+
+    def resolve(self, rows):
+        """為整批 StagedPrice 填入 card_id (entity_resolution 對應)，缺少的遊戲/系列/卡片以批次方式建立"""
+        matched = [self.entities.match(row) for row in rows]
+        # 版本一律改為標準版本 (同一張卡在各來源的寫法一致)
+        rows = [row._replace(version=signals.version) for row, (signals, _, _) in zip(rows, matched)]
+        unmatched = [row for row, (_, card_id, _) in zip(rows, matched) if card_id is None]
+
+        new_games = {}
+        for row in unmatched:
+            if row.game_code not in self.games:
+                new_games.setdefault(row.game_code, row.game_name)
+        if new_games:
+            self._create_games(new_games)
+
+        new_sets = set()
+        for row in unmatched:
+            key = (self.games[row.game_code], row.set_code)
+            if key not in self.sets:
+                new_sets.add(key)
+        if new_sets:
+            self._create_sets(new_sets)
+
+        new_cards = {}
+        for row in unmatched:
+            key = (row.card_number, row.version)
+            if key not in self.cards and key not in new_cards:
+                new_cards[key] = row
+        if new_cards:
+            self._create_cards(new_cards)
+
+        resolved = []
+        for row, (signals, card_id, method) in zip(rows, matched):
+            if card_id is None:
+                card_id, method = self.cards[(row.card_number, row.version)], "created"
+            self.entities.remember(row.source, signals, card_id, method)
+            resolved.append(row._replace(card_id=card_id))
+        with self.bind.begin() as conn:
+            self.entities.save(conn)
+        return resolved
+
+    def _create_games(self, new_games: dict):
+        with self.bind.begin() as conn:
+            conn.execute(
+                _insert_ignore(self.bind, Game.__table__),
+                [{"code": code, "name": name} for code, name in new_games.items()],
+            )
+            for id_, code in conn.execute(select(Game.id, Game.code).where(Game.code.in_(list(new_games)))):
+                self.games[code] = id_
+
+    def _create_sets(self, new_sets: set):
+        # 其他爬蟲可能同時建立同一系列: 衝突時略過 (idx_card_set_unique)，再統一查回 id
+        with self.bind.begin() as conn:
+            conn.execute(
+                _insert_ignore(self.bind, CardSet.__table__),
+                [{"game_id": game_id, "code": code, "name": f"Series {code}"} for game_id, code in new_sets],
+            )
+            rows = conn.execute(
+                select(CardSet.id, CardSet.game_id, CardSet.code)
+                .where(tuple_(CardSet.game_id, CardSet.code).in_(list(new_sets)))
+                .order_by(CardSet.id.desc())
+            )
+            for id_, game_id, code in rows:
+                self.sets[(game_id, code)] = id_
+
+    def _create_cards(self, new_cards: dict):
+        """new_cards: (卡號, 版本) -> 第一次出現的 StagedPrice"""
+        values = [
+            {
+                "card_set_id": self.sets[(self.games[row.game_code], row.set_code)],
+                "card_number": row.card_number,
+                "name": row.name,
+                "version": row.version,
+                "rarity": row.rarity,
+                "image_url": row.image_url,
+            }
+            for row in new_cards.values()
+        ]
+        # 其他爬蟲可能同時建立同一張卡: 衝突時略過，再統一查回 id
+        with self.bind.begin() as conn:
+            conn.execute(_insert_ignore(self.bind, Card.__table__), values)
+            rows = conn.execute(
+                select(Card.id, Card.card_number, Card.version)
+                .where(tuple_(Card.card_number, Card.version).in_(list(new_cards)))
+            )
+            for id_, card_number, version in rows:
+                self.cards[(card_number, version)] = id_
+                row = new_cards[(card_number, version)]
+                self.entities.index.add(id_, card_number, version, row.rarity, row.set_code, row.name)
+        print(f"      [DB] ✨ 新增卡片資料: {len(new_cards)} 張")
+
+
+class DBScraper:
+    """資料庫版爬蟲基底: 子類實作 scrape()，以 record() 回報每張卡的價格"""
+
+    SCRAPER_NAME = ""       # 顯示名稱，例如 "Mercadop"
+    WEBSITE_NAME = ""       # 價格來源 (market_prices.source)
+    GAME_CODE = ""
+    GAME_NAME = ""
+    PRICE_TYPE = "sell"     # "sell" (售價) 或 "buy" (買取)
+
+    def __init__(self, bind=engine, fresh: bool = None):
+        self.bind = bind
+        self.identity = IdentityCache(bind)
+        # 變動比對已在記憶體完成，寫入時不再逐列查詢最新價格；寫入在背景管線中與抓取並行
+        self.ingestor = PriceIngestor(
+            bind, resolver=self._prepare_batch, check_latest=False, background=INGEST_BACKGROUND
+        )
+        self.latest_hashes = {}   # (card_id, source, price_type) -> 最新 data_hash
+        self.loaded_sources = set()
+        self.total_processed = 0
+        self.planner = CrawlPlanner(self.SCRAPER_NAME or self.WEBSITE_NAME, bind)
+        self.series_stats = defaultdict(lambda: [0, 0])   # 系列網址 -> [卡片數, 變動數] (只由 resolve 階段更新)
+        name = self.SCRAPER_NAME or self.WEBSITE_NAME
+        self.checkpoint = ScrapeCheckpoint(f"db-{name}", fresh=fresh_requested() if fresh is None else fresh)
+
+    def _load_source(self, source: str):
+        hashes = load_latest_hashes(self.bind, source)
+        for (card_id, price_type), data_hash in hashes.items():
+            self.latest_hashes[(card_id, source, price_type)] = data_hash
+        self.loaded_sources.add(source)
+        print(f"✅ 已載入 {source} 的最新價格指紋: {len(hashes)} 筆。")
+
+    def _prepare_batch(self, rows):
+        """解析 card_id，並只保留與最新指紋不同的列 (同一張卡在本批出現多次時以最後一筆為準)
+
+        各系列的變動數也在這裡統計: 商品對應表與最新指紋只在 resolve 階段讀寫，
+        不與抓取執行緒共用。
+        """
+        rows = self.identity.resolve(rows)
+        for source in {row.source for row in rows} - self.loaded_sources:
+            self._load_source(source)
+
+        last_seen = {}
+        for row in rows:
+            key = (row.card_id, row.source, row.price_type)
+            last_seen[key] = row
+            if row.series is not None:
+                # 新卡 (沒有最新指紋) 或指紋與最新一筆不同即算作變動
+                current_hash = price_fingerprint(row.source, row.price_type, row.price_jpy, row.stock_status)
+                stats = self.series_stats[row.series]
+                stats[0] += 1
+                if self.latest_hashes.get(key) != current_hash:
+                    stats[1] += 1
+
+        # 送出寫入前就更新記憶體中的指紋: 管線中排在後面的批次以此比對，不會重複寫入同一價格
+        changed = []
+        for key, row in last_seen.items():
+            current_hash = price_fingerprint(row.source, row.price_type, row.price_jpy, row.stock_status)
+            if self.latest_hashes.get(key) != current_hash:
+                self.latest_hashes[key] = current_hash
+                changed.append(row)
+        return changed
+
+    def record(self, *, set_code: str, card_number: str, name: str, price_jpy: int, stock_status: str,
+               version: str = "Normal", rarity: str = "Unknown", image_url: str = "",
+               source: str = None, price_type: str = None, game_code: str = None, game_name: str = None,
+               series: str = None):
+        """記錄一張卡的價格觀測 (不會立即查詢資料庫)
+
+        series: 這張卡所屬的系列網址，用於統計各系列的變動率 (見 plan())
+        """
+        row = StagedPrice(
+            game_code=game_code or self.GAME_CODE,
+            game_name=game_name or self.GAME_NAME,
+            set_code=set_code,
+            card_number=card_number,
+            version=version,
+            name=name,
+            rarity=rarity,
+            image_url=image_url,
+            source=source or self.WEBSITE_NAME,
+            price_type=price_type or self.PRICE_TYPE,
+            price_jpy=price_jpy,
+            stock_status=stock_status,
+            series=series,
+        )
+        self.ingestor.add_row(row)
+        self.total_processed += 1
+
+    def plan(self, urls):
+        """依爬取排程挑出本次到期的系列網址 (斷點中未完成的系列一律選入)"""
+        return self.planner.select(urls, resume=self.checkpoint.in_progress)
+
+    def _series_complete(self, url: str, scrape_completed: bool) -> bool:
+        """該系列是否已完整爬完: 斷點標記完成，或 (不使用斷點的爬蟲) scrape() 正常結束且沒有未完成的斷點"""
+        if self.checkpoint.is_done(url):
+            return True
+        return scrape_completed and not self.checkpoint.in_progress(url)
+
+    def scrape(self):
+        raise NotImplementedError
+
+    def run(self):
+        name = self.SCRAPER_NAME or self.WEBSITE_NAME
+        # 本次執行的指標寫入 scraper_runs (頁面數、位元組、解析時間由 fetcher 累加)
+        with RunRecorder(name, bind=self.bind) as run_record:
+            self._run(name, run_record)
+
+    def _run(self, name: str, run_record: RunRecorder):
+        print(f"\n>> TCGE-CIS 2.0: {name} 爬蟲 (資料庫版) 啟動...")
+
+        # 確保本月與未來月份的價格分區已建立
+        ensure_partitions(self.bind)
+        self.identity.preload()
+        self.planner.load()
+        self.checkpoint.load()
+        if self.GAME_NAME:
+            print(f"✅ 資料庫連線成功。目標遊戲: {self.GAME_NAME}")
+
+        completed = False
+        try:
+            self.scrape()
+            completed = True
+        finally:
+            # 中途出錯時仍寫入已解析的部分 (等待背景管線寫完)，並只記錄已完整爬完的系列的變動率
+            # 寫入失敗時其例外照常拋出，但排程、斷點與執行紀錄仍要收尾 (此時視為未完成)
+            try:
+                self.ingestor.close()
+            except Exception:
+                completed = False
+                raise
+            finally:
+                try:
+                    self.planner.finish(
+                        {url: stats for url, stats in self.series_stats.items() if self._series_complete(url, completed)},
+                        complete=completed,
+                    )
+                finally:
+                    self.checkpoint.close()
+                    run_record.set(
+                        rows_seen=self.total_processed,
+                        rows_written=self.ingestor.total_inserted,
+                        rows_skipped=self.total_processed - self.ingestor.total_inserted,
+                        write_seconds=self.ingestor.flush_seconds,
+                    )
+        # 只有成功結束才清除斷點 (失敗時保留，重跑從中斷處繼續)
+        self.checkpoint.clear()
+
+        print(f"\n{'='*50}")
+        print(f"🎉 {name} 任務完成！")
+        print(f"📊 總掃描: {self.total_processed}")
+        print(f"💾 更新紀錄: {self.ingestor.total_inserted} (節省了 {self.total_processed - self.ingestor.total_inserted} 筆無效寫入)")
+        entity_stats = self.identity.entities.stats
+        print(f"🔗 商品對應: 查表 {entity_stats['mapped']}、比對 {entity_stats['exact'] + entity_stats['scored']}"
+              f" (評分 {entity_stats['scored']})、新卡 {entity_stats['created']}")
+        print(f"{'='*50}")
@@ -0,0 +1,110 @@
+"""
+爬蟲效能基準 (以錄製頁面重播，不連網)
+
+對每個來源，以 fixture_store 的錄製檔重播一次完整的資料庫版爬蟲，
+寫入暫存目錄中的全新 SQLite 資料庫，分別量測:
+
+- 解析: 每秒頁數與每秒列數 (抓取 + 解析 + record()，不含寫入)
+- 寫入: ingest 每秒處理的列數 (PriceIngestor 批次寫入的累計耗時)
+
+重播時沒有網路延遲與請求間隔，因此量到的是本機的解析與寫入能力；
+修改解析器前後各跑一次即可比較。列數不同代表解析結果改變了。
+
+用法:
+    FETCH_FIXTURES=record python price_scraper_mercadop_db.py   # 先錄製 (每個來源一次)
+    python scraper_benchmark.py                                 # 所有來源
+    python scraper_benchmark.py mercadop cardrush-buy
+"""
+
+import os
+
+# 一律重播，不可連到正式網站 (必須在匯入爬蟲之前設定)
+os.environ["FETCH_FIXTURES"] = "replay"
+# 同步寫入，解析與寫入的耗時才能分開計算
+os.environ["INGEST_BACKGROUND"] = "0"
+
+import argparse
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from checkpoint import ScrapeCheckpoint
+from database import Base
+from fixture_store import open_store
+from price_codes import seed_code_tables
+from price_scraper_cardrush_buy_db import CardrushBuyScraper
+from price_scraper_cardrush_db import CardrushScraper
+from price_scraper_mercadop_db import MercadopScraper
+from price_scraper_uniari_db import UniariScraper
+
+SOURCES = {
+    "mercadop": MercadopScraper,
+    "uniari": UniariScraper,
+    "cardrush": CardrushScraper,
+    "cardrush-buy": CardrushBuyScraper,
+}
+
+
+def bench_source(name, scraper_class, work_dir):
+    """以全新的 SQLite 資料庫重播一個來源，回傳量測結果"""
+    bind = create_engine(f"sqlite:///{os.path.join(work_dir, name + '.db')}")
+    Base.metadata.create_all(bind)
+    with bind.begin() as conn:
+        seed_code_tables(conn)
+
+    scraper = scraper_class(bind=bind, fresh=True)
+    # 斷點寫在暫存目錄，不影響正式執行的斷點；排程一律全量
+    scraper.checkpoint = ScrapeCheckpoint(f"bench-{name}", fresh=True, directory=work_dir)
+    scraper.planner.force_full = True
+
+    store = open_store()
+    served_before, missed_before = store.served, store.missed
+    started = time.perf_counter()
+    scraper.run()
+    elapsed = time.perf_counter() - started
+    bind.dispose()
+
+    ingest_seconds = scraper.ingestor.flush_seconds
+    return {
+        "pages": store.served - served_before,
+        "missed": store.missed - missed_before,
+        "rows": scraper.total_processed,
+        "staged": scraper.ingestor.total_staged,
+        "parse_seconds": max(elapsed - ingest_seconds, 1e-9),
+        "ingest_seconds": max(ingest_seconds, 1e-9),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="爬蟲效能基準 (重播錄製頁面)")
+    parser.add_argument("sources", nargs="*", metavar="SOURCE",
+                        help=f"要量測的來源 (預設全部): {', '.join(SOURCES)}")
+    args = parser.parse_args()
+    unknown = set(args.sources) - set(SOURCES)
+    if unknown:
+        parser.error(f"未知的來源: {', '.join(sorted(unknown))}")
+
+    store = open_store()
+    if not store.hosts():
+        print(f"❌ 找不到錄製檔 ({store.directory})，請先以 FETCH_FIXTURES=record 執行爬蟲。")
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in args.sources or SOURCES:
+            print(f"\n>> 重播: {name}")
+            results[name] = bench_source(name, SOURCES[name], work_dir)
+
+    print(f"\n{'='*78}")
+    print(f"  {'source':<14}{'pages':>6}{'pages/s':>10}{'rows':>9}{'rows/s':>11}{'ingest rows/s':>15}{'missed':>8}")
+    for name, r in results.items():
+        print(f"  {name:<14}{r['pages']:>6}{r['pages'] / r['parse_seconds']:>10.1f}{r['rows']:>9}"
+              f"{r['rows'] / r['parse_seconds']:>11.0f}{r['staged'] / r['ingest_seconds']:>15.0f}{r['missed']:>8}")
+    print(f"{'='*78}")
+    if any(r["missed"] for r in results.values()):
+        print("⚠️ 有請求不在錄製檔中 (以 404 回應)，請重新錄製該來源。")
+
+
+if __name__ == "__main__":
+    main()
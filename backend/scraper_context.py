@@ -0,0 +1,233 @@
+"""
+根目錄 Sheets 爬蟲共用的執行環境 (單一行程)
+
+run_all_scrapers.py 原本為每個腳本啟動一個新的 Python 行程，每個行程都要重新做一次
+Google OAuth 刷新、呼叫兩次 gc.open(sheet_name)、重讀整欄 Card_Master 卡號，
+並啟動一個新的瀏覽器。現在各腳本改為 run(ctx) 函數，由同一個 ScraperContext 提供:
+
+- gc: 授權一次的 gspread 客戶端 (token 由 google-auth 自動刷新，長時間執行也不必重新授權)。
+- worksheet(name): 開啟後快取的工作表 (spreadsheet 只 open 一次)。
+- card_numbers(): Card_Master B 欄卡號的共用集合 (只讀一次)。
+  各腳本照舊把新卡號 add() 進去，下一個腳本直接看到，不會重複新增。
+- light_page(): 長駐瀏覽器 (每個執行緒一個，換種類時才重啟) 上的輕量 context/page；
+  離開 with 區塊只關閉 context，瀏覽器留給下一個腳本。
+- engine: backend 資料庫連線池 (database.engine)，同一行程內共用。
+- fresh: 是否忽略斷點重新開始 (取代各腳本的 --fresh 判斷)。
+
+腳本出錯後呼叫 reset() 重啟瀏覽器並丟棄卡號快取 (未寫入成功的新卡號不能留在集合中)。
+
+backend/orchestrator.py 會在多個工作執行緒同時執行腳本:
+授權、工作表與卡號集合由所有執行緒共用 (延遲建立時加鎖)；
+同步 Playwright 只能在建立它的執行緒使用，因此瀏覽器與 fresh 旗標是每個執行緒各自一份，
+每個工作執行緒最多保留一個長駐瀏覽器 (換用另一種瀏覽器時先關閉舊的)。
+
+用法:
+    def run(ctx):
+        master_worksheet = ctx.worksheet("Card_Master")
+        existing_card_numbers = ctx.card_numbers()
+        with ctx.light_page("firefox") as page:
+            ...
+
+    if __name__ == "__main__":
+        run_standalone(run)     # 單獨執行: python price_scraper_xxx.py [--fresh]
+"""
+
+import io
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+from browser_pool import new_light_context_sync
+from checkpoint import fresh_requested
+from run_history import RunRecorder
+
+# --- [設定區域] ---
+SHEET_NAME = "卡牌價格追蹤系統 - Command Deck"
+MASTER_WORKSHEET_NAME = "Card_Master"
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+
+def authorize():
+    """本地端 Google Sheets 授權 (token.json / credentials.json 位於目前目錄)"""
+    import gspread
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+
+    print(">> 步驟 A: 正在進行本地端 Google Sheets 授權...", flush=True)
+    creds = None
+    if os.path.exists('token.json'):
+        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            try:
+                creds.refresh(Request())
+            except Exception as e:
+                print(f"❌ 刷新 Token 失敗: {e}")
+                creds = None
+        if not creds or not creds.valid:
+            if not os.path.exists('credentials.json'):
+                raise RuntimeError("找不到 'credentials.json'。")
+            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open('token.json', 'w') as token:
+            token.write(creds.to_json())
+    gc = gspread.authorize(creds)
+    print("✅ Google Sheets 授權成功。")
+    return gc
+
+
+class ScraperContext:
+    def __init__(self, fresh: bool = False, sheet_name: str = SHEET_NAME):
+        self.default_fresh = fresh
+        self.sheet_name = sheet_name
+        self._gc = None
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._card_numbers = None
+        self._engine = None
+        self._lock = threading.RLock()
+        self._local = threading.local()   # 每個執行緒: fresh、playwright、browsers
+
+    @property
+    def fresh(self) -> bool:
+        return getattr(self._local, "fresh", self.default_fresh)
+
+    @fresh.setter
+    def fresh(self, value: bool):
+        self._local.fresh = value
+
+    # --- Google Sheets ---
+
+    @property
+    def gc(self):
+        with self._lock:
+            if self._gc is None:
+                self._gc = authorize()
+            return self._gc
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.gc.open(self.sheet_name)
+            return self._spreadsheet
+
+    def worksheet(self, name: str):
+        with self._lock:
+            if name not in self._worksheets:
+                self._worksheets[name] = self.spreadsheet().worksheet(name)
+            return self._worksheets[name]
+
+    def card_numbers(self) -> set:
+        """Card_Master 的卡號集合 (B 欄，不含標頭)；所有腳本共用同一個 set"""
+        with self._lock:
+            if self._card_numbers is None:
+                print("     -> 正在讀取 Card_Number (B 欄)...")
+                self._card_numbers = set(self.worksheet(MASTER_WORKSHEET_NAME).col_values(2)[1:])
+            return self._card_numbers
+
+    # --- 資料庫 ---
+
+    @property
+    def engine(self):
+        with self._lock:
+            if self._engine is None:
+                from database import engine
+                self._engine = engine
+            return self._engine
+
+    # --- 瀏覽器 ---
+
+    def browser(self, browser_type: str = "firefox", channel: str = None):
+        """本執行緒長駐的同步 Playwright 瀏覽器 (同一種類只啟動一次)"""
+        key = (browser_type, channel)
+        browsers = self._browsers()
+        browser = browsers.get(key)
+        if browser is not None and browser.is_connected():
+            return browser
+        # 每個執行緒只保留一個瀏覽器: 換用另一種時先關閉舊的
+        self._close_browsers(keep_playwright=True)
+        if getattr(self._local, "playwright", None) is None:
+            from playwright.sync_api import sync_playwright
+            self._local.playwright = sync_playwright().start()
+        options = {"headless": True}
+        if channel:
+            options["channel"] = channel
+        browser = getattr(self._local.playwright, browser_type).launch(**options)
+        self._browsers()[key] = browser
+        return browser
+
+    def _browsers(self) -> dict:
+        """本執行緒的 (瀏覽器種類, channel) -> Browser"""
+        if not hasattr(self._local, "browsers"):
+            self._local.browsers = {}
+        return self._local.browsers
+
+    def has_browser(self) -> bool:
+        return any(browser.is_connected() for browser in self._browsers().values())
+
+    @contextmanager
+    def light_page(self, browser_type: str = "firefox", channel: str = None):
+        """在長駐瀏覽器上開一個輕量 context 的 page，結束時只關閉 context"""
+        context = new_light_context_sync(self.browser(browser_type, channel))
+        try:
+            yield context.new_page()
+        finally:
+            try:
+                context.close()
+            except Exception:
+                pass   # 瀏覽器已斷線 (下一次 browser() 會重新啟動)
+
+    def _close_browsers(self, keep_playwright: bool = False):
+        for browser in self._browsers().values():
+            try:
+                browser.close()
+            except Exception:
+                pass
+        self._local.browsers = {}
+        playwright = getattr(self._local, "playwright", None)
+        if playwright is not None and not keep_playwright:
+            try:
+                playwright.stop()
+            except Exception:
+                pass
+            self._local.playwright = None
+
+    def close_browsers(self):
+        """關閉本執行緒的瀏覽器 (每個工作執行緒結束前各自呼叫)"""
+        self._close_browsers()
+
+    # --- 生命週期 ---
+
+    def reset(self):
+        """腳本失敗後: 重啟本執行緒的瀏覽器、重新讀取卡號 (授權與工作表保留)"""
+        self.close_browsers()
+        with self._lock:
+            self._card_numbers = None
+
+    def close(self):
+        self.close_browsers()
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def run_standalone(run):
+    """單獨執行一個腳本 (python price_scraper_xxx.py [--fresh])；出錯時以代碼 1 結束"""
+    # 設定 stdout 編碼為 UTF-8 (必須在任何 print 之前)
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    try:
+        # 單獨執行也寫入執行紀錄 (kind="script")，與總指揮排程的任務分開統計
+        with ScraperContext(fresh=fresh_requested()) as ctx, RunRecorder(name, kind="script"):
+            run(ctx)
+    except Exception as e:
+        print(f"\n❌ 錯誤: {e}")
+        sys.exit(1)
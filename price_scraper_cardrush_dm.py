@@ -2,52 +2,38 @@
 # Phase 1, Block 3.2: 價格爬蟲 (Price Scraper) - Card Rush DM 售價 v1.4 (JPY-Only + API 優化)
 # Author: 電王
 # 戰術: 【v1.2 新弾特集】+【v1.3 JPY-Only + API 優化】
+# Update: v1.7 - 系列頁與列表頁改以 HTTP 抓取，各系列並行 (backend/fetcher.py: PageFetcher + crawl_listing)，頁面缺少商品時才改用瀏覽器；
+#                某頁重試後仍失敗時，其他系列跑完後任務失敗 (重跑從斷點繼續)，不再跳到下個專櫃。
+# Update: v1.6 - 寫入 Price_History 的列數計入執行紀錄 (backend/run_history.py)，由 run_history.py 比較每次執行的趨勢。
+# Update: v1.5 - 改為 run(ctx)，由 run_all_scrapers.py 在同一行程內呼叫，共用授權、工作表、Card_Master 卡號與長駐瀏覽器 (backend/scraper_context.py)；失敗時拋出例外；新卡號寫入 Card_Master 成功後才併入共用集合。
 # Update: v1.4 - 新增批次寫入機制，降低長程執行時的資料遺失風險。
 # Update: v1.3 - 徹底移除所有匯率 (HKD) 相關代碼。
 #         此腳本現在只負責抓取 JPY 原始價格並寫入 Sheet (9欄結構)。
 #         【核心】: 將 get_all_records() 替換為 col_values(2)，
 #                   解決因 Card_Master 過大導致的 APIError: [500] 錯誤。
 # =========================================================
-import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import os.path, time, re, random, sys
 from datetime import datetime
-from bs4 import BeautifulSoup
 import pandas as pd
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
-# --- 設定 stdout 編碼為 UTF-8 (必須在任何 print 之前) ---
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+# 列表頁以 HTTP 並行抓取 (每個網站的速率仍由各爬蟲共用)，缺少商品時才改用瀏覽器，見 backend/fetcher.py
+from fetcher import ListingParser, PageFetcher, crawl_listing, gather_limited, run_async
+from extraction import CARDRUSH_LIST_SPEC, parse_price
+# 卡號由共用的辨識引擎解析 (格式來自 card_knowledge_base)，見 backend/card_numbers.py
+from card_numbers import braced_card_number
+# 斷點續傳 (每頁寫入斷點，被終止後重跑從中斷處繼續)，見 backend/checkpoint.py
+from checkpoint import ScrapeCheckpoint
+# 共用的 Sheets 授權、工作表、卡號集合與瀏覽器 (單一行程執行所有腳本)，見 backend/scraper_context.py
+from scraper_context import run_standalone
+# 寫入的價格列數計入本次執行紀錄 (scraper_runs)，見 backend/run_history.py
+from run_history import add_metrics
 
 
 def log(message: str) -> None:
     print(message, flush=True)
 
 
-# --- [步驟 A: 本地端 Google Sheets 授權] ---
-log(">> 步驟 A: 正在進行本地端 Google Sheets 授權...")
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-creds = None
-# ... (授權代碼不變) ...
-if os.path.exists('token.json'): creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        try: creds.refresh(Request())
-        except Exception as e:
-            print(f"❌ 刷新 Token 失敗: {e}");
-            if os.path.exists('credentials.json'):
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-            else: print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-    else:
-        if not os.path.exists('credentials.json'): print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-    with open('token.json', 'w') as token: token.write(creds.to_json())
-gc = gspread.authorize(creds)
-print("✅ Google Sheets 授權成功。")
-
 # --- [DM 設定區域] ---
 sheet_name = "卡牌價格追蹤系統 - Command Deck"
 master_worksheet_name = "Card_Master"
@@ -64,13 +50,10 @@ HISTORY_BATCH_SIZE = 200
 # --- 【v1.3】 匯率換算函數已移除 --- 
 
 # --- [v1.2 函數] ---
-def get_links_from_page(page, url, selector):
+async def get_links_from_page(fetcher, url, selector):
     print(f"      -> 正在訪問: {url}...")
     try:
-        page.goto(url, wait_until='networkidle', timeout=60000)
-        page.wait_for_selector(selector, timeout=30000)
-        html = page.content()
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = await fetcher.fetch_soup(url, wait_selector=selector)
         links = []
         series_links = soup.select(selector)
         for link in series_links:
@@ -86,115 +69,98 @@ def get_links_from_page(page, url, selector):
         print(f"      -> ❌ 掃描 {url} 時失敗: {e}")
         return []
 
+
+def parse_page(records):
+    """一頁的擷取結果 (extraction.CARDRUSH_LIST_SPEC) -> [[卡號, 名稱, card_info], ...]"""
+    page_rows = []
+    for rec in records:
+        if not rec["name"] or not rec["price"]: continue
+
+        item_name = rec["name"].strip()
+        price_jpy = parse_price(rec["price"])
+
+        stock_text = rec["stock_text"] or ""
+        status = "In Stock"
+        if "soldout" in (rec["stock_class"] or "").split() or \
+           "SOLD OUT" in stock_text or "品切れ" in stock_text or \
+           'soldout' in (rec["item_class"] or "").split():
+            status = "Out of Stock"
+
+        found = braced_card_number(item_name, "DM")
+        if not found:
+            continue
+        item_card_number = found.card_number
+
+        image_url = ""
+        if rec["image"]:
+            image_url = rec["image"].strip()
+            # URL 清潔 (繼承 v1.2)
+            image_url = re.sub(r'/\s+', '/', image_url) 
+            image_url = image_url.replace(" ", "%20") 
+            if image_url.startswith('//'): image_url = 'https:' + image_url
+            elif not image_url.startswith('http'):
+                image_url = base_url + image_url 
+
+        card_info = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
+        page_rows.append([item_card_number, item_name, card_info])
+    return page_rows
+
 # --- [主程式開始] ---
-try:
-    print(f"\n>> 價格爬蟲 v1.3 ({website_name} 售價 - JPY-Only + API 優化) 已啟動...")
-    print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
-    master_worksheet = gc.open(sheet_name).worksheet(master_worksheet_name)
-    history_worksheet = gc.open(sheet_name).worksheet(history_worksheet_name)
-    
-    # --- 【v1.3 API 優化】 ---
-    print("     -> 正在讀取 Card_Number (B 欄)...")
-    all_card_numbers = master_worksheet.col_values(2) 
-    existing_card_numbers = set(all_card_numbers[1:]) 
-    print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
-    # --- 【優化結束】 ---
-
-    # --- 【v1.3】 步驟 2 (獲取匯率) 已移除 ---
-
-    with sync_playwright() as p:
-        print("\n>> 步驟 2/5: 正在啟動 Playwright 瀏覽器...") # 步驟重編
-        browser = p.chromium.launch(headless=True, channel="msedge") 
-        page = browser.new_page()
-        print("✅ Playwright 瀏覽器準備就緒。")
-
-        print("\n>> 步驟 3/5: 開始動態掃描 DM「新弾特集」系列專櫃...") # 步驟重編
-        
-        DM_SERIES_URLS = get_links_from_page(page, SERIES_INDEX_URL_1, "div.pickupcategory_division1 ul.pickupcategory_list li a")
-        
-        if not DM_SERIES_URLS:
-            print("❌ 錯誤: 未能獲取任何 DM「新弾特集」URL，任務中止。")
-            browser.close()
-            exit()
-            
-        print(f"✅ 掃描完畢，共發現 {len(DM_SERIES_URLS)} 個「新弾特集」獨立系列專櫃。")
+def run(ctx):
+    try:
+        print(f"\n>> 價格爬蟲 v1.3 ({website_name} 售價 - JPY-Only + API 優化) 已啟動...")
+        print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
+        master_worksheet = ctx.worksheet(master_worksheet_name)
+        history_worksheet = ctx.worksheet(history_worksheet_name)
+
+        # --- 【v1.3 API 優化】 ---
+        existing_card_numbers = ctx.card_numbers()  # 同一行程內共用，只讀一次
+        print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
+        # --- 【優化結束】 ---
+
+        # --- 【v1.3】 步驟 2 (獲取匯率) 已移除 ---
+
+        # --- [v1.7] 不再開啟瀏覽器: 系列頁與列表頁以 HTTP 抓取 ---
+        print("\n>> 步驟 2/5: 以 HTTP 抓取頁面 (頁面缺少商品時才改用瀏覽器)...") # 步驟重編
         all_cardrush_cards = {}
+        # --- 斷點續傳: 已掃蕩的頁面由 crawl_listing 交還 collect_page，未完成的系列從下一頁繼續 (指令列加 --fresh 從頭開始) ---
+        # 斷點保存各頁的擷取結果 (v1.7 起與舊版格式不同，換檔名以免讀入舊斷點)
+        checkpoint = ScrapeCheckpoint("cardrush_dm_listing", fresh=ctx.fresh)
+        checkpoint.load()
+
+        def collect_page(records):
+            # 整頁解析成功才併入 (與斷點內容一致)
+            for item_card_number, item_name, card_info in parse_page(records):
+                all_cardrush_cards[(item_card_number, item_name)] = card_info
+
+        async def sweep():
+            async with PageFetcher() as fetcher:
+                print("\n>> 步驟 3/5: 開始動態掃描 DM「新弾特集」系列專櫃...") # 步驟重編
+
+                series_paths = await get_links_from_page(fetcher, SERIES_INDEX_URL_1, "div.pickupcategory_division1 ul.pickupcategory_list li a")
 
-        for i, series_url_path in enumerate(DM_SERIES_URLS):
-            series_url = base_url + series_url_path 
-            
-            log(f"   -> 正在掃蕩專櫃 {i+1}/{len(DM_SERIES_URLS)}: {series_url}")
-            current_page = 1
-            while True:
-                page_url = f"{series_url}?page={current_page}"
-                if current_page == 1: page_url = series_url
-
-                log(f"      -> 正在掃蕩頁面 {current_page}...")
-                try:
-                    page.goto(page_url, wait_until='networkidle', timeout=30000)
-                    page.wait_for_selector("li.list_item_cell", timeout=10000)
-                    page_html = page.content()
-                    soup = BeautifulSoup(page_html, 'html.parser')
-                    card_items = soup.select("li.list_item_cell")
-                    if not card_items: break
-                    log(f"      -> 在此頁面發現 {len(card_items)} 個商品。")
-
-                    for item in card_items:
-                        item_data = item.find('div', class_='item_data');
-                        if not item_data: continue
-                        name_tag = item.find('span', class_='goods_name'); 
-                        price_tag = item.find('span', class_='figure'); 
-                        stock_tag = item.find('p', class_='stock')
-                        if not name_tag or not price_tag: continue
-                        
-                        item_name = name_tag.text.strip()
-                        price_jpy = int(re.sub(r'[^\d]', '', price_tag.text))
-
-                        status = "In Stock"
-                        if (stock_tag and "soldout" in stock_tag.get('class', [])) or \
-                           (stock_tag and "SOLD OUT" in stock_tag.text) or (stock_tag and "品切れ" in stock_tag.text) or \
-                           'soldout' in item.get('class', []):
-                            status = "Out of Stock"
-
-                        item_card_number = ""
-                        dm_regex = r'\{([^}]+)\}' 
-                        match_num = re.search(dm_regex, item_name)
-                        if match_num:
-                            item_card_number = match_num.group(1).strip()
-                        else:
-                            continue 
-
-                        image_url = ""
-                        image_tag = item.select_one("div.global_photo img")
-                        if image_tag and image_tag.has_attr('src'):
-                            image_url = image_tag['src'].strip()
-                            # URL 清潔 (繼承 v1.2)
-                            image_url = re.sub(r'/\s+', '/', image_url) 
-                            image_url = image_url.replace(" ", "%20") 
-                            if image_url.startswith('//'): image_url = 'https:' + image_url
-                            elif not image_url.startswith('http'):
-                                image_url = base_url + image_url 
-
-                        all_cardrush_cards[(item_card_number, item_name)] = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
-
-                    next_page_link = soup.select_one('a.to_next_page')
-                    if not next_page_link: 
-                        log("      -> 此系列已掃蕩完畢（沒有下一頁）。"); 
-                        break
-                    current_page += 1
-                    time.sleep(random.uniform(1, 3)) 
-                except PlaywrightTimeoutError:
-                    if current_page == 1: print("      -> 警告：此系列可能為空或加載超時...")
-                    else: print(f"      -> 在第 {current_page} 頁等待超時（可能是最後一頁），跳轉到下個系列。")
-                    break
-                except Exception as e: 
-                    print(f"      -> 掃蕩頁面 {current_page} 時失敗。錯誤: {e}"); 
-                    break
+                if not series_paths:
+                    raise RuntimeError("未能獲取任何 DM「新弾特集」URL，任務中止。")
+
+                print(f"✅ 掃描完畢，共發現 {len(series_paths)} 個「新弾特集」獨立系列專櫃。")
+
+                # 各系列並行掃蕩 (同一系列內依「下一頁」連結依序抓取)
+                # 某頁重試後仍失敗時，其他系列照常跑完，再以 ListingFailed 結束任務 (重跑從該頁繼續)
+                with ListingParser() as parser:
+                    await gather_limited([
+                        crawl_listing(fetcher, parser, base_url + path, collect_page, CARDRUSH_LIST_SPEC,
+                                      label=f"[{i+1}/{len(series_paths)}]", checkpoint=checkpoint)
+                        for i, path in enumerate(series_paths)
+                    ])
+                print(f"✅ HTTP 抓取 {fetcher.http_pages} 頁，瀏覽器備援 {fetcher.browser_pages} 頁。")
+
+        run_async(sweep())
 
         print(f"\n✅ 所有 DM 專櫃掃蕩完畢，共捕獲 {len(all_cardrush_cards)} 種卡牌的情報。")
 
         print("\n>> 步驟 4/5: 開始執行情報擴張 (DM) 與價格記錄...") # 步驟重編
         new_cards_to_add = []
+        new_card_numbers = set()   # 待寫入 Card_Master 的卡號 (寫入成功後才併入共用集合)
         price_history_to_add = []
         total_new_cards = 0
         total_price_records = 0
@@ -206,21 +172,29 @@ try:
                 master_worksheet.append_rows(new_cards_to_add, value_input_option='USER_ENTERED')
                 print("      -> ✅ 新 DM 卡牌批次寫入完成！")
                 new_cards_to_add.clear()
+                existing_card_numbers.update(new_card_numbers)
+                new_card_numbers.clear()
 
         def flush_price_history(force=False):
             if price_history_to_add and (force or len(price_history_to_add) >= HISTORY_BATCH_SIZE):
                 print(f"      -> 正在批次寫入 {len(price_history_to_add)} 條 DM 售價至 `Price_History`...")
                 price_history_to_add.sort(key=lambda record: (record[1], record[5]))
                 history_worksheet.append_rows(price_history_to_add, value_input_option='USER_ENTERED')
+                add_metrics(rows_written=len(price_history_to_add))
                 print("      -> ✅ DM 售價批次寫入完成！")
                 price_history_to_add.clear()
+                checkpoint.mark("history_written", history_cursor)
 
-        for (item_card_number, item_name), card_info in all_cardrush_cards.items():
+        # 斷點續傳: 上次中斷前已寫入 Price_History 的筆數 (Card_Master 會重新比對，不受影響)
+        history_written = checkpoint.value("history_written", 0)
+        history_cursor = history_written
+        # 各系列並行抓取，完成順序每次不同: 依 (卡號, 名稱) 排序，重跑時 history_written 才對得上同一批資料
+        for index, ((item_card_number, item_name), card_info) in enumerate(sorted(all_cardrush_cards.items())):
             price_jpy = card_info['price_jpy']; status = card_info['status']; image_url = card_info['image_url']; 
             # --- 【v1.3】 price_hkd 已移除 ---
 
             # --- [情報擴張: Card_Master] ---
-            if item_card_number not in existing_card_numbers:
+            if item_card_number not in existing_card_numbers and item_card_number not in new_card_numbers:
                 print(f"      -> ✨ 發現新 DM 卡牌！ {item_card_number} {item_name}")
                 rarity = "Unknown"; card_type = "Unknown"
                 rarity_match = re.search(r'【([^】]+)】', item_name) 
@@ -229,22 +203,24 @@ try:
                 if type_match: card_type = type_match.group(1)
                 set_id = item_card_number.split('/')[0].split('-')[0] if '/' in item_card_number else "DM_Unknown" 
                 unique_id = f"{item_card_number}_{rarity}" 
-                
+
                 new_cards_to_add.append([
                     unique_id, item_card_number, game_title, set_id,
                     item_name, rarity, image_url, card_type
                 ])
                 # existing_cards_map removed
-                existing_card_numbers.add(item_card_number)
+                new_card_numbers.add(item_card_number)
                 total_new_cards += 1
                 print(f"         -> 已準備將其添加到 `Card_Master`。")
                 flush_new_cards()
 
             # --- [價格記錄: Price_History] ---
+            if index < history_written:
+                continue
             history_unique_id = f"{item_card_number}_{item_name}"
             history_id = f"{history_unique_id}_{website_name}_{timestamp}"
             set_id_history = item_card_number.split('/')[0].split('-')[0] if '/' in item_card_number else "DM_Unknown"
-            
+
             # --- 【v1.3 JPY-Only 結構 (9 欄)】 ---
             price_history_to_add.append([
                 history_id, history_unique_id, website_name,
@@ -256,6 +232,7 @@ try:
                 image_url   # I: Image_URL
             ])
             total_price_records += 1
+            history_cursor = index + 1
             flush_price_history()
 
         print(f"\n✅ 情報處理完畢。共偵測 {total_new_cards} 張新 DM 卡牌，記錄 {total_price_records} 條 DM 價格情報 (JPY)。")
@@ -274,17 +251,14 @@ try:
         else:
             print(f"      -> ✅ 累計寫入 `Price_History` {total_price_records} 條 DM 價格情報。")
 
+        checkpoint.clear()  # 全部寫入完成，下次從頭開始
         print("\n\n🎉🎉🎉 恭喜！Card Rush (DM) 「新弾特集」 (JPY-Only) 征服任務完成！ 🎉🎉🎉")
-        try:
-            browser.close()
-        except Exception:
-            pass
-
-except Exception as e:
-    print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); 
-    print(f"錯誤詳情: {e}")
-    try:
-        if 'browser' in locals() and browser.is_connected(): 
-            browser.close()
-    except Exception:
-        pass
\ No newline at end of file
+
+    except Exception as e:
+        print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); 
+        print(f"錯誤詳情: {e}")
+        raise   # 交給呼叫端: 總指揮據此重試並略過依賴的任務，單獨執行時以代碼 1 結束
+
+
+if __name__ == "__main__":
+    run_standalone(run)
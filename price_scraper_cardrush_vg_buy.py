@@ -2,52 +2,34 @@
 # Phase 1, Block 3.2: 價格爬蟲 (Price Scraper) - Card Rush VG 買取價 v1.3 (JPY-Only + API 優化)
 # Author: 電王
 # 戰術: 【JSON 提取】+【API 式分頁】+【v1.2 JPY-Only + API 優化】
+# Update: v1.6 - 寫入 Price_History 的列數計入執行紀錄 (backend/run_history.py)，由 run_history.py 比較每次執行的趨勢。
+# Update: v1.5 - 改為 run(ctx)，由 run_all_scrapers.py 在同一行程內呼叫，共用授權、工作表、Card_Master 卡號 (backend/scraper_context.py)；失敗時拋出例外；新卡號寫入 Card_Master 成功後才併入共用集合。
+# Update: v1.4 - 不再開啟 Edge: 直接以 HTTP 抓取 Next.js 資料路徑 (_next/data)，各頁並行抓取。
 # Update: v1.3 - 新增批次寫入機制，降低長程執行時的資料遺失風險。
 # Update: v1.2 - 徹底移除所有匯率 (HKD) 相關代碼。
 #         此腳本現在只負責抓取 JPY 原始價格並寫入 Sheet (9欄結構)。
 #         【核心】: 將 get_all_records() 替換為 col_values(2)，
 #                   解決因 Card_Master 過大導致的 APIError: [500] 錯誤。
 # =========================================================
-import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import os.path, time, re, random, json, sys
 from datetime import datetime
 from bs4 import BeautifulSoup
 import pandas as pd
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
-# --- 設定 stdout 編碼為 UTF-8 (必須在任何 print 之前) ---
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+# 買取表直接以 HTTP 抓取 Next.js 資料 (不需要瀏覽器)，見 backend/cardrush_media.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from fetcher import PageFetcher, run_async
+from cardrush_media import crawl_buying_prices
+# 共用的 Sheets 授權、工作表、卡號集合與瀏覽器 (單一行程執行所有腳本)，見 backend/scraper_context.py
+from scraper_context import run_standalone
+# 寫入的價格列數計入本次執行紀錄 (scraper_runs)，見 backend/run_history.py
+from run_history import add_metrics
 
 
 def log(message: str) -> None:
     print(message, flush=True)
 
 
-# --- [步驟 A: 本地端 Google Sheets 授權] --- 
-log(">> 步驟 A: 正在進行本地端 Google Sheets 授權...")
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-creds = None
-# ... (授權代碼不變) ...
-if os.path.exists('token.json'): creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        try: creds.refresh(Request())
-        except Exception as e:
-            print(f"❌ 刷新 Token 失敗: {e}");
-            if os.path.exists('credentials.json'):
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-            else: print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-    else:
-        if not os.path.exists('credentials.json'): print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-    with open('token.json', 'w') as token: token.write(creds.to_json())
-gc = gspread.authorize(creds)
-print("✅ Google Sheets 授權成功。")
-
 # --- [VG 買取設定區域] ---
 sheet_name = "卡牌價格追蹤系統 - Command Deck"
 master_worksheet_name = "Card_Master"
@@ -63,97 +45,66 @@ HISTORY_BATCH_SIZE = 200
 # --- 【v1.2】 匯率換算函數已移除 --- 
 
 # --- [主程式開始] ---
-try:
-    print(f"\n>> 價格爬蟲 v1.2 ({website_name} 買取價 - JPY-Only + API 優化) 已啟動...")
-    print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
-    master_worksheet = gc.open(sheet_name).worksheet(master_worksheet_name)
-    history_worksheet = gc.open(sheet_name).worksheet(history_worksheet_name)
-    
-    # --- 【v1.2 API 優化】 ---
-    print("     -> 正在讀取 Card_Number (B 欄)...")
-    all_card_numbers = master_worksheet.col_values(2) # 2 = B 欄
-    existing_card_numbers = set(all_card_numbers[1:]) # 移除標頭並轉為 Set
-    print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
-    # --- 【優化結束】 ---
-
-    # --- 【v1.2】 步驟 2 (獲取匯率) 已移除 ---
-
-    with sync_playwright() as p:
-        print("\n>> 步驟 2/5: 正在啟動 Playwright 瀏覽器...") # 步驟重編
-        browser = p.chromium.launch(headless=True, channel="msedge")
-        page = browser.new_page()
-        print("✅ Playwright 瀏覽器準備就緒。")
-
-        print("\n>> 步驟 3/5: 開始 API 式分頁掃蕩 (JSON 模式)...") # 步驟重編
-        
+def run(ctx):
+    try:
+        print(f"\n>> 價格爬蟲 v1.2 ({website_name} 買取價 - JPY-Only + API 優化) 已啟動...")
+        print(">> 步驟 1/4: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
+        master_worksheet = ctx.worksheet(master_worksheet_name)
+        history_worksheet = ctx.worksheet(history_worksheet_name)
+
+        # --- 【v1.2 API 優化】 ---
+        existing_card_numbers = ctx.card_numbers()  # 同一行程內共用，只讀一次# 移除標頭並轉為 Set
+        print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
+        # --- 【優化結束】 ---
+
+        # --- 【v1.2】 步驟 2 (獲取匯率) 已移除 ---
+
+        print("\n>> 步驟 2/4: 開始 API 式分頁掃蕩 (Next.js JSON，直接 HTTP，不開瀏覽器)...")
+
         all_cardrush_cards = {}
-        current_page = 1
-        last_page = 1 
-        
-        while current_page <= last_page:
-            page_url = f"{base_url}?displayMode=リスト&limit=100&page={current_page}&sort%5Bkey%5D=amount&sort%5Border%5D=desc&associations%5B%5D=ocha_product&to_json_option%5Bexcept%5D%5B%5D=original_image_source&to_json_option%5Bexcept%5D%5B%5D=created_at&to_json_option%5Binclude%5D%5Bocha_product%5D%5Bonly%5D%5B%5D=id&to_json_option%5Binclude%5D%5Bocha_product%5D%5Bmethods%5D%5B%5D=image_source"
-
-            log(f"     -> 正在掃蕩頁面 {current_page} / {last_page}...")
-            try:
-                page.goto(page_url, wait_until='domcontentloaded', timeout=60000)
-                
-                # 等待 JSON data (v1.1 修正)
-                json_data_element = page.wait_for_selector("script#__NEXT_DATA__", state='attached', timeout=60000) # 增加超時
-                
-                json_data_string = json_data_element.inner_text()
-                data = json.loads(json_data_string)
-                
-                cards_on_page = data['props']['pageProps']['buyingPrices']
-                
-                if current_page == 1:
-                    last_page = data['props']['pageProps']['lastPage'] 
-                    log(f"     -> 偵測到總頁數: {last_page}")
-
-                if not cards_on_page:
-                    log("     -> 此頁面無數據，結束掃蕩。")
-                    break
-
-                for card in cards_on_page:
-                    try:
-                        item_name = card.get('name', 'N/A')
-                        item_card_number = card.get('model_number', 'N/A')
-                        price_jpy = int(card.get('amount', 0))
-                        rarity = card.get('rarity', 'Unknown')
-                        card_type = card.get('nation', 'Unknown') 
-                        
-                        image_url = ""
-                        if card.get('ocha_product') and card['ocha_product'].get('image_source'):
-                            image_url = card['ocha_product']['image_source']
-                            image_url = image_url.strip() 
-                            image_url = re.sub(r'\s+', '%20', image_url) # URL 空格處理
-                        
-                        status = "買取中"
-
-                        if item_card_number == 'N/A':
-                            continue 
-
-                        all_cardrush_cards[(item_card_number, item_name)] = {
-                            'price_jpy': price_jpy, 
-                            'status': status, 
-                            'image_url': image_url,
-                            'rarity': rarity,
-                            'card_type': card_type
-                        }
-                    except Exception as e_inner:
-                        log(f"       -> 解析單張卡牌時失敗: {e_inner} - {card.get('name')}")
-                        
-                log(f"     -> ✅ 頁面 {current_page} 解析完畢，捕獲 {len(cards_on_page)} 條情報。")
-                
-            except Exception as e:
-                log(f"     -> ❌ 掃蕩頁面 {current_page} 時失敗: {e}")
-            
-            current_page += 1
-            time.sleep(random.uniform(1, 3)) 
-
-        print(f"\n✅ 所有 VG 買取頁面掃蕩完畢，共捕獲 {len(all_cardrush_cards)} 種卡牌的情報。")
-
-        print("\n>> 步驟 4/5: 開始執行情報擴張 (VG) 與價格記錄...") # 步驟重編
+
+        def collect_page(cards_on_page, page_number):
+            for card in cards_on_page:
+                try:
+                    item_name = card.get('name', 'N/A')
+                    item_card_number = card.get('model_number', 'N/A')
+                    price_jpy = int(card.get('amount', 0))
+                    rarity = card.get('rarity', 'Unknown')
+                    card_type = card.get('nation', 'Unknown') 
+
+                    image_url = ""
+                    if card.get('ocha_product') and card['ocha_product'].get('image_source'):
+                        image_url = card['ocha_product']['image_source']
+                        image_url = image_url.strip() 
+                        image_url = re.sub(r'\s+', '%20', image_url) # URL 空格處理
+
+                    status = "買取中"
+
+                    if item_card_number == 'N/A':
+                        continue 
+
+                    all_cardrush_cards[(item_card_number, item_name)] = {
+                        'price_jpy': price_jpy, 
+                        'status': status, 
+                        'image_url': image_url,
+                        'rarity': rarity,
+                        'card_type': card_type
+                    }
+                except Exception as e_inner:
+                    log(f"       -> 解析單張卡牌時失敗: {e_inner} - {card.get('name')}")
+
+        # 第 1 頁取得 buildId 與總頁數後，其餘頁面並行抓取 (每網站上限見 backend/host_throttle.py)
+        async def sweep():
+            async with PageFetcher() as fetcher:
+                return await crawl_buying_prices(fetcher, base_url, collect_page)
+
+        pages_done = run_async(sweep())
+
+        print(f"\n✅ 所有 VG 買取頁面掃蕩完畢 ({pages_done} 頁)，共捕獲 {len(all_cardrush_cards)} 種卡牌的情報。")
+
+        print("\n>> 步驟 3/4: 開始執行情報擴張 (VG) 與價格記錄...") # 步驟重編
         new_cards_to_add = []
+        new_card_numbers = set()   # 待寫入 Card_Master 的卡號 (寫入成功後才併入共用集合)
         price_history_to_add = []
         total_new_cards = 0
         total_price_records = 0
@@ -164,12 +115,15 @@ try:
                 master_worksheet.append_rows(new_cards_to_add, value_input_option='USER_ENTERED')
                 log("     -> ✅ 新 VG 卡牌批次寫入完成！")
                 new_cards_to_add.clear()
+                existing_card_numbers.update(new_card_numbers)
+                new_card_numbers.clear()
 
         def flush_price_history(force=False):
             if price_history_to_add and (force or len(price_history_to_add) >= HISTORY_BATCH_SIZE):
                 log(f"     -> 正在批次寫入 {len(price_history_to_add)} 條 VG 買取價格至 `Price_History`...")
                 price_history_to_add.sort(key=lambda record: (record[1], record[5]))
                 history_worksheet.append_rows(price_history_to_add, value_input_option='USER_ENTERED')
+                add_metrics(rows_written=len(price_history_to_add))
                 log("     -> ✅ VG 買取價格批次寫入完成！")
                 price_history_to_add.clear()
 
@@ -179,18 +133,18 @@ try:
             # --- 【v1.2】 price_hkd 已移除 ---
 
             # --- 【v1.2】 新卡檢查 ---
-            if item_card_number not in existing_card_numbers:
+            if item_card_number not in existing_card_numbers and item_card_number not in new_card_numbers:
                 print(f"     -> ✨ 發現新 VG 卡牌！ {item_card_number} {item_name}")
-                
+
                 set_id = item_card_number.split('/')[0].split('-')[0] if '/' in item_card_number else "VG_Unknown"
                 unique_id = f"{item_card_number}_{rarity}"
-                
+
                 new_cards_to_add.append([
                     unique_id, item_card_number, game_title, set_id,
                     item_name, rarity, image_url, card_type
                 ])
                 # existing_cards_map is removed
-                existing_card_numbers.add(item_card_number) 
+                new_card_numbers.add(item_card_number)
                 total_new_cards += 1
                 print(f"       -> 已準備將其添加到 `Card_Master`。")
                 flush_new_cards()
@@ -218,7 +172,7 @@ try:
 
         log(f"\n✅ 情報處理完畢。共偵測 {total_new_cards} 張新 VG 卡牌，記錄 {total_price_records} 條 VG 買取價格 (JPY)。")
 
-        log("\n>> 步驟 5/5: 正在觸發最終批次寫入 (VG 買取)...") # 步驟重編
+        log("\n>> 步驟 4/4: 正在觸發最終批次寫入 (VG 買取)...") # 步驟重編
 
         flush_new_cards(force=True)
         if total_new_cards == 0:
@@ -233,14 +187,11 @@ try:
             log(f"     -> ✅ 累計寫入 `Price_History` {total_price_records} 條 VG 買取價格情報。")
 
         log("\n\n🎉🎉🎉 恭喜！Card Rush (VG) 買取價 (JPY-Only) 征服任務完成！ 🎉🎉🎉")
-        try:
-            browser.close()
-        except Exception:
-            pass
 
-except Exception as e:
-    print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); print(f"錯誤詳情: {e}")
-    try:
-        if 'browser' in locals() and browser.is_connected(): browser.close()
-    except Exception:
-        pass
\ No newline at end of file
+    except Exception as e:
+        print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); print(f"錯誤詳情: {e}")
+        raise   # 交給呼叫端: 總指揮據此重試並略過依賴的任務，單獨執行時以代碼 1 結束
+
+
+if __name__ == "__main__":
+    run_standalone(run)
@@ -1,6 +1,10 @@
 # =========================================================
 # Phase 1, Block 1.2: 價格爬蟲 (Price Scraper) - Mercadop 永久版 v3.5
 # Author: 電王
+# Update: v3.8 - 系列頁與列表頁改以 HTTP 抓取，各系列並行 (backend/fetcher.py: PageFetcher + crawl_listing)，頁面缺少商品時才改用瀏覽器；
+#                某頁重試後仍失敗時，其他系列跑完後任務失敗 (重跑從斷點繼續)，不再略過該頁。
+# Update: v3.7 - 寫入 Price_History 的列數計入執行紀錄 (backend/run_history.py)，由 run_history.py 比較每次執行的趨勢。
+# Update: v3.6 - 改為 run(ctx)，由 run_all_scrapers.py 在同一行程內呼叫，共用授權、工作表、Card_Master 卡號與長駐瀏覽器 (backend/scraper_context.py)；失敗時拋出例外；新卡號寫入 Card_Master 成功後才併入共用集合。
 # Update: 【v3.5 批次寫入 + v3.4 JPY-Only + API 優化 + 新動態 URL】
 #         0. (來自 v3.5) 新增批次寫入機制，減少超時時的資料遺失風險。
 #         1. (來自 v3.3) 修正 Import 錯誤，徹底移除 HKD 相關代碼。
@@ -8,47 +12,28 @@
 #         3. 【核心】: 放棄主頁掃描，改為從 /page/5 (パック別)
 #            動態抓取所有 Booster 和 Deck 系列連結。
 # =========================================================
-import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import os.path, time, re, random, sys
+import os.path, time, random, sys
 from datetime import datetime
-from bs4 import BeautifulSoup
 import pandas as pd
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
-# --- 設定 stdout 編碼為 UTF-8 (必須在任何 print 之前) ---
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+# 列表頁以 HTTP 並行抓取 (每個網站的速率仍由各爬蟲共用)，缺少商品時才改用瀏覽器，見 backend/fetcher.py
+from fetcher import ListingParser, PageFetcher, crawl_listing, gather_limited, run_async
+from extraction import SHOP_LIST_SPEC, parse_price
+# 卡號由共用的辨識引擎解析 (格式來自 card_knowledge_base)，見 backend/card_numbers.py
+from card_numbers import parse_card_number
+# 斷點續傳 (每頁寫入斷點，被終止後重跑從中斷處繼續)，見 backend/checkpoint.py
+from checkpoint import ScrapeCheckpoint
+# 共用的 Sheets 授權、工作表、卡號集合與瀏覽器 (單一行程執行所有腳本)，見 backend/scraper_context.py
+from scraper_context import run_standalone
+# 寫入的價格列數計入本次執行紀錄 (scraper_runs)，見 backend/run_history.py
+from run_history import add_metrics
 
 
 def log(message: str) -> None:
     print(message, flush=True)
 
 
-# --- [步驟 A: 本地端 Google Sheets 授權] ---
-log(">> 步驟 A: 正在進行本地端 Google Sheets 授權...")
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-creds = None
-# ... (授權代碼不變) ...
-if os.path.exists('token.json'): creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        try: creds.refresh(Request())
-        except Exception as e:
-            print(f"❌ 刷新 Token 失敗: {e}");
-            if os.path.exists('credentials.json'):
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-            else: print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-    else:
-        if not os.path.exists('credentials.json'): print("\n❌ 錯誤: 找不到 'credentials.json'。"); sys.exit(1)
-        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES); creds = flow.run_local_server(port=0)
-    with open('token.json', 'w') as token: token.write(creds.to_json())
-gc = gspread.authorize(creds)
-print("✅ Google Sheets 授權成功。")
-
-
 # --- [設定區域] ---
 sheet_name = "卡牌價格追蹤系統 - Command Deck"
 master_worksheet_name = "Card_Master"
@@ -66,20 +51,15 @@ HISTORY_BATCH_SIZE = 200
 # --- 【v3.4】 匯率換算函數已移除 --- 
 
 # --- 【v3.4】 更新：動態獲取系列 URL 的函數 ---
-def get_series_urls(page, series_page_url):
+SERIES_SELECTOR = "div.cate_navi_wrap ul.cate_navi li.cate_li a.cate_aa"
+
+async def get_series_urls(fetcher, series_page_url):
     """
     從 /page/5 (パック別) 抓取所有 Booster 和 Deck 系列的 /product-group/ 連結。
     """
-    print(f"  -> 正在掃描系列頁面以獲取連結: {series_page_url}...")
-    # 目標選擇器: 選擇 BOOSTER 和 DECKS 下方的所有連結
-    selector = "div.cate_navi_wrap ul.cate_navi li.cate_li a.cate_aa" 
+    print(f"  -> 正在掃描系列頁面以獲取連結: {series_page_url}...")
     try:
-        page.goto(series_page_url, wait_until='networkidle', timeout=60000)
-        print(f"  -> 等待選擇器 '{selector}' 出現 (最長 30 秒)...")
-        page.wait_for_selector(selector, timeout=30000) 
-        print(f"  -> ✅ 選擇器已找到。")
-        html = page.content()
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = await fetcher.fetch_soup(series_page_url, wait_selector=SERIES_SELECTOR)
         
         links = []
         # 找到所有 cate_navi_wrap
@@ -89,7 +69,7 @@ def get_series_urls(page, series_page_url):
             # 檢查標題是否包含 BOOSTER 或 DECKS
             title_tag = wrap.find('h2', class_='cate_navi_ttl')
             if title_tag and ('BOOSTER' in title_tag.text or 'DECKS' in title_tag.text):
-                print(f"  -> 正在處理區塊: {title_tag.text.strip()}")
+                print(f"  -> 正在處理區塊: {title_tag.text.strip()}")
                 series_link_tags = wrap.select("ul.cate_navi li.cate_li a.cate_aa")
                 for link_tag in series_link_tags:
                     href = link_tag.get('href')
@@ -99,140 +79,95 @@ def get_series_urls(page, series_page_url):
                         if href_without_params not in links:
                             links.append(href_without_params) 
                             
-        print(f"  -> ✅ 在系列頁面發現 {len(links)} 個 Booster/Deck 系列連結。")
+        print(f"  -> ✅ 在系列頁面發現 {len(links)} 個 Booster/Deck 系列連結。")
         return links
         
-    except PlaywrightTimeoutError: 
-         print(f"  -> ❌ 在系列頁面等待選擇器 '{selector}' 超時 (30秒)。")
-         return []
     except Exception as e:
-        print(f"  -> ❌ 掃描系列頁面獲取連結時失敗: {e}")
+        print(f"  -> ❌ 掃描系列頁面獲取連結時失敗: {e}")
         return []
 # --- 【v3.4 函數結束】 ---
 
+
+def parse_page(records):
+    """一頁的擷取結果 (extraction.SHOP_LIST_SPEC) -> [[卡號, 名稱, card_info], ...]"""
+    page_rows = []
+    for rec in records:
+        if not rec["name"] or not rec["price"]: continue
+        item_name = rec["name"].strip(); price_jpy = parse_price(rec["price"])
+
+        stock_classes = (rec["stock_class"] or "").split(); stock_text = rec["stock_text"] or ""
+        status = "In Stock"
+        if "soldout_mer" in stock_classes or "SOLD OUT" in stock_text or "品切れ" in stock_text or \
+           'soldout' in (rec["item_class"] or "").split(): status = "Out of Stock"
+
+        found = (rec["model"] and parse_card_number(rec["model"], "OP", sets_only=True)) or parse_card_number(item_name, "OP", sets_only=True)
+        if not found: continue
+
+        image_url = ""
+        if rec["image"]:
+            image_url = rec["image"].strip() 
+            if image_url.startswith('//'): image_url = 'https:' + image_url
+            elif image_url.startswith('/'): image_url = base_url + image_url
+
+        card_info = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
+        page_rows.append([found.card_number, item_name, card_info])
+    return page_rows
+
 # --- [主程式開始] ---
-try:
-    print(f"\n>> 價格爬蟲 v3.4 ({website_name} 永久版 - JPY-Only + API 優化 + 新動態 URL) 已啟動...")
-    print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") 
-    master_worksheet = gc.open(sheet_name).worksheet(master_worksheet_name)
-    history_worksheet = gc.open(sheet_name).worksheet(history_worksheet_name)
-    
-    # --- 【v3.4 API 優化】 ---
-    print("     -> 正在讀取 Card_Number (B 欄)...")
-    all_card_numbers = master_worksheet.col_values(2) 
-    existing_card_numbers = set(all_card_numbers[1:]) 
-    print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
-    # --- 【優化結束】 ---
-
-    # --- 【v3.4】 步驟 2 (獲取匯率) 已移除 ---
-
-    with sync_playwright() as p:
-        print("\n>> 步驟 2/5: 正在啟動 Playwright 瀏覽器...") 
-        browser = p.firefox.launch(headless=True)
-        page = browser.new_page()
-        print("✅ Playwright 瀏覽器準備就緒。")
-
-        # --- 【v3.4】 步驟 3: 動態獲取系列 URL ---
-        print(f"\n>> 步驟 3/5: 開始動態掃描 OP 系列專櫃 (從 Pack/Series 頁面)...") 
-        DYNAMIC_SERIES_URLS = get_series_urls(page, SERIES_PAGE_URL) # 不再需要 selector 參數
-        
-        if not DYNAMIC_SERIES_URLS:
-            print("❌ 錯誤: 未能從系列頁面獲取任何 OP 系列 URL，任務中止。")
-            browser.close(); exit()
-        
-        print(f"✅ 動態掃描完畢，將掃蕩 {len(DYNAMIC_SERIES_URLS)} 個系列專櫃。")
+def run(ctx):
+    try:
+        print(f"\n>> 價格爬蟲 v3.4 ({website_name} 永久版 - JPY-Only + API 優化 + 新動態 URL) 已啟動...")
+        print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") 
+        master_worksheet = ctx.worksheet(master_worksheet_name)
+        history_worksheet = ctx.worksheet(history_worksheet_name)
+
+        # --- 【v3.4 API 優化】 ---
+        existing_card_numbers = ctx.card_numbers()  # 同一行程內共用，只讀一次
+        print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
+        # --- 【優化結束】 ---
+
+        # --- 【v3.4】 步驟 2 (獲取匯率) 已移除 ---
+
+        # --- [v3.8] 不再開啟瀏覽器: 系列頁與列表頁為伺服器端渲染，以 HTTP 抓取 ---
+        print("\n>> 步驟 2/5: 以 HTTP 抓取頁面 (頁面缺少商品時才改用瀏覽器)...") 
         all_mercadop_cards = {}
-        # --- 【v3.4 步驟 3 結束】 ---
-
-        # --- 【v3.4】 步驟 4: 掃蕩獲取的系列 URL ---
-        print(f"\n>> 步驟 4/5: 開始掃蕩 {len(DYNAMIC_SERIES_URLS)} 個核心系列專櫃...") 
-
-        for i, series_url_path in enumerate(DYNAMIC_SERIES_URLS):
-            series_url = base_url + series_url_path 
-            print(f"  -> 正在掃蕩專櫃 {i+1}/{len(DYNAMIC_SERIES_URLS)}: {series_url}")
-            current_page = 1
-            consecutive_failures = 0  # 連續失敗計數器
-            max_pages = 100  # 最大頁數限制，防止無限循環
-            
-            while current_page <= max_pages:
-                page_url = f"{series_url}?page={current_page}"
-                if current_page == 1: page_url = series_url
-                print(f"     -> 正在掃蕩頁面 {current_page}...")
-                try:
-                    page.goto(page_url, wait_until='networkidle', timeout=30000) 
-                    page.wait_for_selector("li.list_item_cell", timeout=10000)
-                    page_html = page.content()
-                    soup = BeautifulSoup(page_html, 'html.parser')
-                    card_items = soup.select("li.list_item_cell")
-                    if not card_items: 
-                        print("     -> 此頁面沒有商品，已到達末頁。")
-                        break
-                    print(f"     -> 在此頁面發現 {len(card_items)} 個商品。")
-                    
-                    consecutive_failures = 0  # 成功後重置失敗計數
-
-                    for item in card_items:
-                        item_data = item.find('div', class_='item_data')
-                        if not item_data: continue
-                        name_tag = item_data.find('span', class_='goods_name'); price_tag = item_data.find('span', class_='figure'); stock_tag = item_data.find('p', class_='stock'); model_tag = item_data.find('span', class_='model_number_value')
-                        if not name_tag or not price_tag: continue
-                        item_name = name_tag.text.strip(); price_text = price_tag.text.strip(); price_jpy = int(re.sub(r'[^\d]', '', price_text))
-
-                        status = "In Stock"
-                        if (stock_tag and "soldout_mer" in stock_tag.get('class', [])) or \
-                           (stock_tag and "SOLD OUT" in stock_tag.text) or \
-                           (stock_tag and "品切れ" in stock_tag.text) or \
-                           'soldout' in item.get('class', []): status = "Out of Stock"
-                        elif stock_tag and ("残り" in stock_tag.text or "在庫" in stock_tag.text): status = "In Stock"
-
-                        item_card_number = ""
-                        if model_tag:
-                            match = re.search(r'([A-Z]{2,3}\d{2,3}-?[A-Z]?\d{3})', model_tag.text)
-                            if match: item_card_number = match.group(1)
-                        if not item_card_number:
-                            match_name = re.search(r'([A-Z]{2,3}\d{2,3}-?[A-Z]?\d{3})', item_name)
-                            if match_name: item_card_number = match_name.group(1)
-                        if not item_card_number: continue
-
-                        image_url = ""
-                        image_container = item_data.select_one('div.global_photo')
-                        if image_container and image_container.has_attr('data-src'):
-                            image_url = image_container['data-src'].strip() 
-                            if image_url.startswith('//'): image_url = 'https:' + image_url
-                            elif image_url.startswith('/'): image_url = base_url + image_url
-
-                        all_mercadop_cards[(item_card_number, item_name)] = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
-
-                    next_page_link = soup.select_one('a.to_next_page')
-                    if not next_page_link: print("     -> 此系列已掃蕩完畢（沒有下一頁）。"); break
-                    current_page += 1; time.sleep(random.uniform(1, 3))
-                    
-                except PlaywrightTimeoutError:
-                    consecutive_failures += 1
-                    if current_page == 1: 
-                        print("     -> 警告：第 1 頁等待超時，跳過此專櫃...")
-                        break
-                    else: 
-                        print(f"     -> 在第 {current_page} 頁等待超時...")
-                        if consecutive_failures >= 3:
-                            print(f"     -> 連續 {consecutive_failures} 次超時，跳過此專櫃...")
-                            break
-                        current_page += 1  # 嘗試下一頁
-                        continue
-                        
-                except Exception as e: 
-                    consecutive_failures += 1
-                    print(f"     -> 掃蕩頁面 {current_page} 時失敗。錯誤: {e}")
-                    if consecutive_failures >= 3:
-                        print(f"     -> 連續 {consecutive_failures} 次失敗，跳過此專櫃...")
-                        break
-                    current_page += 1  # 嘗試下一頁
-                    continue
+        # --- 斷點續傳: 已掃蕩的頁面由 crawl_listing 交還 collect_page，未完成的系列從下一頁繼續 (指令列加 --fresh 從頭開始) ---
+        # 斷點保存各頁的擷取結果 (v3.8 起與舊版格式不同，換檔名以免讀入舊斷點)
+        checkpoint = ScrapeCheckpoint("mercadop_listing", fresh=ctx.fresh)
+        checkpoint.load()
+
+        def collect_page(records):
+            # 整頁解析成功才併入 (與斷點內容一致)
+            for item_card_number, item_name, card_info in parse_page(records):
+                all_mercadop_cards[(item_card_number, item_name)] = card_info
+
+        async def sweep():
+            async with PageFetcher() as fetcher:
+                # --- 【v3.4】 步驟 3: 動態獲取系列 URL ---
+                print("\n>> 步驟 3/5: 開始動態掃描 OP 系列專櫃 (從 Pack/Series 頁面)...") 
+                series_paths = await get_series_urls(fetcher, SERIES_PAGE_URL)
+                if not series_paths:
+                    raise RuntimeError("未能從系列頁面獲取任何 OP 系列 URL，任務中止。")
+                print(f"✅ 動態掃描完畢，將掃蕩 {len(series_paths)} 個系列專櫃。")
+
+                # --- 步驟 4: 各系列並行掃蕩 (同一系列內依「下一頁」連結依序抓取) ---
+                # 某頁重試後仍失敗時，其他系列照常跑完，再以 ListingFailed 結束任務 (重跑從該頁繼續)
+                print(f"\n>> 步驟 4/5: 開始掃蕩 {len(series_paths)} 個核心系列專櫃...") 
+                with ListingParser() as parser:
+                    await gather_limited([
+                        crawl_listing(fetcher, parser, base_url + path, collect_page, SHOP_LIST_SPEC,
+                                      label=f"[{i+1}/{len(series_paths)}]", checkpoint=checkpoint)
+                        for i, path in enumerate(series_paths)
+                    ])
+                print(f"✅ HTTP 抓取 {fetcher.http_pages} 頁，瀏覽器備援 {fetcher.browser_pages} 頁。")
+
+        run_async(sweep())
 
         print(f"\n✅ 所有動態獲取的專櫃掃蕩完畢，共捕獲 {len(all_mercadop_cards)} 種卡牌的情報。")
 
         print("\n>> 步驟 4/5: 開始執行情報擴張與價格記錄...") 
         new_cards_to_add = []
+        new_card_numbers = set()   # 待寫入 Card_Master 的卡號 (寫入成功後才併入共用集合)
         price_history_to_add = []
         total_new_cards = 0
         total_price_records = 0
@@ -243,23 +178,31 @@ try:
                 master_worksheet.append_rows(new_cards_to_add, value_input_option='USER_ENTERED')
                 print("     -> ✅ 新卡牌批次寫入完成。")
                 new_cards_to_add.clear()
+                existing_card_numbers.update(new_card_numbers)
+                new_card_numbers.clear()
 
         def flush_price_history(force=False):
             if price_history_to_add and (force or len(price_history_to_add) >= HISTORY_BATCH_SIZE):
                 print(f"     -> 正在批次寫入 {len(price_history_to_add)} 條價格情報至 `Price_History`...")
                 price_history_to_add.sort(key=lambda record: (record[1], record[5]))
                 history_worksheet.append_rows(price_history_to_add, value_input_option='USER_ENTERED')
+                add_metrics(rows_written=len(price_history_to_add))
                 print("     -> ✅ 價格情報批次寫入完成。")
                 price_history_to_add.clear()
+                checkpoint.mark("history_written", history_cursor)
 
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        for (item_card_number, item_name), card_info in all_mercadop_cards.items():
+        # 斷點續傳: 上次中斷前已寫入 Price_History 的筆數 (Card_Master 會重新比對，不受影響)
+        history_written = checkpoint.value("history_written", 0)
+        history_cursor = history_written
+        # 各系列並行抓取，完成順序每次不同: 依 (卡號, 名稱) 排序，重跑時 history_written 才對得上同一批資料
+        for index, ((item_card_number, item_name), card_info) in enumerate(sorted(all_mercadop_cards.items())):
             price_jpy = card_info['price_jpy']; status = card_info['status']; image_url = card_info['image_url']
             # --- 【v3.4】 price_hkd 已移除 ---
 
             # --- 情報擴張 ---
-            if item_card_number not in existing_card_numbers:
+            if item_card_number not in existing_card_numbers and item_card_number not in new_card_numbers:
                 print(f"     -> ✨ 發現新卡牌！ {item_card_number} {item_name}")
                 rarity = "Unknown"; card_type = "Unknown"
                 if "(パラレル)" in item_name or "パラレル" in item_name: rarity = "P"
@@ -282,12 +225,14 @@ try:
                     card_type  
                 ])
                 # existing_cards_map removed
-                existing_card_numbers.add(item_card_number)
+                new_card_numbers.add(item_card_number)
                 print(f"       -> 已準備將其添加到 `Card_Master`。")
                 total_new_cards += 1
                 flush_new_cards()
 
             # --- 價格歷史記錄 ---
+            if index < history_written:
+                continue
             history_unique_id = f"{item_card_number}_{item_name}"
             history_id = f"{history_unique_id}_{website_name}_{timestamp}"
             set_id_history = item_card_number.split('-')[0] if '-' in item_card_number else item_card_number[:4]
@@ -303,6 +248,7 @@ try:
                 image_url   # I: Image_URL
             ])
             total_price_records += 1
+            history_cursor = index + 1
             flush_price_history()
 
         print(f"\n✅ 情報處理完畢。累計發現 {total_new_cards} 張新卡牌，整理 {total_price_records} 條價格情報 (JPY)。")
@@ -318,16 +264,14 @@ try:
         else:
             print("     -> 未捕獲到需要添加到 `Price_History` 的價格情報。")
 
+        checkpoint.clear()  # 全部寫入完成，下次從頭開始
         print("\n\n🎉🎉🎉 恭喜！Mercadop (JPY-Only + 動態 URL) 征服任務完成！ 🎉🎉🎉")
 
-        try:
-            browser.close()
-        except Exception:
-            pass  # 瀏覽器可能已關閉，忽略錯誤
 
-except Exception as e:
-    print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); print(f"錯誤詳情: {e}")
-    try:
-        if 'browser' in locals() and browser.is_connected(): browser.close()
-    except Exception:
-        pass  # 瀏覽器可能已關閉，忽略錯誤
\ No newline at end of file
+    except Exception as e:
+        print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); print(f"錯誤詳情: {e}")
+        raise   # 交給呼叫端: 總指揮據此重試並略過依賴的任務，單獨執行時以代碼 1 結束
+
+
+if __name__ == "__main__":
+    run_standalone(run)
@@ -2,6 +2,10 @@
 # Phase 1, Block 2.1: 價格爬蟲 (Price Scraper) - Union Arena 售價 v1.3 (JPY-Only + API 優化 + 分批寫入)
 # Author: 電王
 # 戰術: 【v1.0 URL 清潔】+【v1.1 JPY-Only + API 優化】+【v1.2 分批寫入】
+# Update: v1.6 - 系列頁與列表頁改以 HTTP 抓取，各系列並行 (backend/fetcher.py: PageFetcher + crawl_listing)，頁面缺少商品時才改用瀏覽器；
+#                某頁重試後仍失敗時，其他系列跑完後任務失敗 (重跑從斷點繼續)，不再跳到下個系列。
+# Update: v1.5 - 寫入 Price_History 的列數計入執行紀錄 (backend/run_history.py)，由 run_history.py 比較每次執行的趨勢。
+# Update: v1.4 - 改為 run(ctx)，由 run_all_scrapers.py 在同一行程內呼叫，共用授權、工作表、Card_Master 卡號與長駐瀏覽器 (backend/scraper_context.py)；失敗時拋出例外；新卡號寫入 Card_Master 成功後才併入共用集合。
 # Update: v1.3 - 新增批次即時寫入機制，降低長程執行時的資料遺失風險。
 # Update: v1.1 - 徹底移除所有匯率 (HKD) 相關代碼。
 #              【核心】: 將 get_all_records() 替換為 col_values(2)，
@@ -11,57 +15,28 @@
 #               修正 Playwright `browser.close()` 的呼叫邏輯。
 # =========================================================
 import gspread
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import os.path, time, re, random, sys
+import os.path, time, random, sys
 from datetime import datetime
-from bs4 import BeautifulSoup
 import pandas as pd
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
-# --- 設定 stdout 編碼為 UTF-8 (必須在任何 print 之前) ---
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+# 列表頁以 HTTP 並行抓取 (每個網站的速率仍由各爬蟲共用)，缺少商品時才改用瀏覽器，見 backend/fetcher.py
+from fetcher import ListingParser, PageFetcher, crawl_listing, gather_limited, run_async
+from extraction import SHOP_LIST_SPEC, parse_price
+# 卡號由共用的辨識引擎解析 (格式來自 card_knowledge_base)，見 backend/card_numbers.py
+from card_numbers import parse_card_number
+# 斷點續傳 (每頁寫入斷點，被終止後重跑從中斷處繼續)，見 backend/checkpoint.py
+from checkpoint import ScrapeCheckpoint
+# 共用的 Sheets 授權、工作表、卡號集合與瀏覽器 (單一行程執行所有腳本)，見 backend/scraper_context.py
+from scraper_context import run_standalone
+# 寫入的價格列數計入本次執行紀錄 (scraper_runs)，見 backend/run_history.py
+from run_history import add_metrics
 
 
 def log(message: str) -> None:
     print(message, flush=True)
 
 
-# --- [步驟 A: 本地端 Google Sheets 授權] --- 
-log(">> 步驟 A: 正在進行本地端 Google Sheets 授權...")
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-creds = None
-
-if os.path.exists('token.json'): 
-    creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        try: 
-            creds.refresh(Request())
-        except Exception as e:
-            print(f"❌ 刷新 Token 失敗: {e}");
-            if os.path.exists('credentials.json'):
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            else: 
-                print("\n❌ 錯誤: 找不到 'credentials.json'。"); 
-                sys.exit(1)
-    else:
-        if not os.path.exists('credentials.json'): 
-            print("\n❌ 錯誤: 找不到 'credentials.json'。"); 
-            sys.exit(1)
-        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-        creds = flow.run_local_server(port=0)
-    
-    with open('token.json', 'w') as token: 
-        token.write(creds.to_json())
-
-gc = gspread.authorize(creds)
-print("✅ Google Sheets 授權成功。")
-
 # --- [UA 設定區域] --- 
 sheet_name = "卡牌價格追蹤系統 - Command Deck"
 master_worksheet_name = "Card_Master"
@@ -108,17 +83,14 @@ def append_rows_with_retry(worksheet, rows, description):
     raise Exception(f"{description}寫入失敗 (重試 {APPEND_RETRY_LIMIT} 次後放棄)。")
 
 # --- [v1.0.3 函數] --- 
-def get_all_series_links(page):
+SERIES_SELECTOR = "aside#left_side_col section.pickupcategory_nav_box li.itemlist_nav_item a"
+
+async def get_all_series_links(fetcher):
     log(f"    -> 正在訪問系列總覽: {SERIES_INDEX_URL}...")
     try:
-        page.goto(SERIES_INDEX_URL, wait_until='domcontentloaded', timeout=60000)
-        log("    -> HTML文檔已加載。正在【耐心觀察】系列選單出現...")
-        page.wait_for_selector("aside#left_side_col section.pickupcategory_nav_box", timeout=45000) 
-        log("    -> ✅ 偵測到系列選單。")
-        html = page.content()
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = await fetcher.fetch_soup(SERIES_INDEX_URL, wait_selector=SERIES_SELECTOR)
         links = []
-        series_links = soup.select("aside#left_side_col section.pickupcategory_nav_box li.itemlist_nav_item a")
+        series_links = soup.select(SERIES_SELECTOR)
         for link in series_links:
             href = link.get('href')
             name = link.select_one("span.nav_label").get_text(strip=True) if link.select_one("span.nav_label") else ""
@@ -134,237 +106,201 @@ def get_all_series_links(page):
         log(f"    -> ❌ 動態掃描系列頁面失敗: {e}")
         return []
 
+
+def parse_page(records):
+    """一頁的擷取結果 (extraction.SHOP_LIST_SPEC) -> [[卡號, 名稱, card_info], ...]"""
+    page_rows = []
+    for rec in records:
+        if not rec["name"] or not rec["price"]: 
+            continue
+
+        item_name = rec["name"].strip()
+        price_jpy = parse_price(rec["price"])
+
+        stock_classes = (rec["stock_class"] or "").split()
+        stock_text = rec["stock_text"] or ""
+        status = "In Stock"
+        if "soldout_mer" in stock_classes or "SOLD OUT" in stock_text or "品切れ" in stock_text or \
+           'soldout' in (rec["item_class"] or "").split(): 
+            status = "Out of Stock"
+
+        found = (rec["model"] and parse_card_number(rec["model"], "UA")) or parse_card_number(item_name, "UA")
+        if not found: 
+            continue
+
+        image_url = ""
+        if rec["image"]:
+            image_url = rec["image"].strip() 
+            image_url = image_url.replace(" ", "%20")  
+            if image_url.startswith('//'): 
+                image_url = 'https:' + image_url
+            elif image_url.startswith('/'): 
+                image_url = base_url + image_url
+
+        card_info = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
+        page_rows.append([found.card_number, item_name, card_info])
+    return page_rows
+
 # --- [主程式開始] ---
-try:
-    print(f"\n>> 價格爬蟲 v1.2 ({website_name} 售價 - JPY-Only + API 優化 + 分批) 已啟動...")
-    print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
-    master_worksheet = gc.open(sheet_name).worksheet(master_worksheet_name)
-    history_worksheet = gc.open(sheet_name).worksheet(history_worksheet_name)
-    
-    # --- 【v1.1 API 優化】 ---
-    print("    -> 正在讀取 Card_Number (B 欄)...")
-    all_card_numbers = master_worksheet.col_values(2) 
-    existing_card_numbers = set(all_card_numbers[1:]) 
-    print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
-
-    with sync_playwright() as p:
-        print("\n>> 步驟 2/5: 正在啟動 Playwright 瀏覽器...") # 步驟重編
-        browser = p.firefox.launch(headless=True)
-        page = browser.new_page()
-        print("✅ Playwright 瀏覽器準備就緒。")
-
-        print("\n>> 步驟 3/5: 開始動態掃描 UA 系列專櫃...") # 步驟重編
-        UA_SERIES_URLS = get_all_series_links(page) 
-        
-        if not UA_SERIES_URLS:
-            print("❌ 錯誤: 未能獲取任何 UA 系列 URL，任務中止。")
-            browser.close(); 
-            exit()
-            
-        all_uniari_cards = {}
+def run(ctx):
+    try:
+        print(f"\n>> 價格爬蟲 v1.2 ({website_name} 售價 - JPY-Only + API 優化 + 分批) 已啟動...")
+        print(">> 步驟 1/5: 正在讀取 `Card_Master` (優化模式)...") # 步驟重編
+        master_worksheet = ctx.worksheet(master_worksheet_name)
+        history_worksheet = ctx.worksheet(history_worksheet_name)
+
+        # --- 【v1.1 API 優化】 ---
+        existing_card_numbers = ctx.card_numbers()  # 同一行程內共用，只讀一次
+        print(f"✅ 讀取成功，資料庫中現有 {len(existing_card_numbers)} 條卡號紀錄以供參考。")
 
-        for i, series_url_path in enumerate(UA_SERIES_URLS):
-            series_url = base_url + series_url_path
-            log(f"  -> 正在掃蕩專櫃 {i+1}/{len(UA_SERIES_URLS)}: {series_url}")
-            current_page = 1
-            while True:
-                page_url = f"{series_url}?page={current_page}"
-                if current_page == 1: 
-                    page_url = series_url
-                log(f"    -> 正在掃蕩頁面 {current_page}...")
-                try:
-                    page.goto(page_url, wait_until='networkidle', timeout=30000) 
-                    page.wait_for_selector("li.list_item_cell", timeout=10000)
-                    page_html = page.content()
-                    soup = BeautifulSoup(page_html, 'html.parser')
-                    card_items = soup.select("li.list_item_cell")
-                    
-                    if not card_items: 
-                        break # 沒有商品，跳出 while True
-                    
-                    log(f"    -> 在此頁面發現 {len(card_items)} 個商品。")
-
-                    for item in card_items:
-                        item_data = item.find('div', class_='item_data');
-                        if not item_data: 
-                            continue
-                        
-                        name_tag = item_data.find('span', class_='goods_name')
-                        price_tag = item_data.find('span', class_='figure')
-                        stock_tag = item_data.find('p', class_='stock')
-                        model_tag = item_data.find('span', class_='model_number_value')
-                        
-                        if not name_tag or not price_tag: 
-                            continue
-                        
-                        item_name = name_tag.text.strip()
-                        price_text = price_tag.text.strip()
-                        price_jpy = int(re.sub(r'[^\d]', '', price_text))
-
-                        status = "In Stock"
-                        if (stock_tag and "soldout_mer" in stock_tag.get('class', [])) or \
-                           (stock_tag and "SOLD OUT" in stock_tag.text) or (stock_tag and "品切れ" in stock_tag.text) or \
-                           'soldout' in item.get('class', []): 
-                            status = "Out of Stock"
-                        elif stock_tag and ("残り" in stock_tag.text or "在庫" in stock_tag.text): 
-                            status = "In Stock"
-
-                        item_card_number = ""
-                        ua_regex = r'([A-Z]{2,}\d{2,}[A-Z]{0,2}/[A-Z0-9-]+-[A-Z0-9]+)'
-                        if model_tag:
-                            match = re.search(ua_regex, model_tag.text)
-                            if match: 
-                                item_card_number = match.group(1).strip()
-                        
-                        if not item_card_number:
-                            match_name = re.search(ua_regex, item_name)
-                            if match_name: 
-                                item_card_number = match_name.group(1).strip()
-                        
-                        if not item_card_number:
-                            ua_regex_alt = r'([A-Z]{0,}[A-Z]{2,}\d{2,}[A-Z]{0,2}/[A-Z0-9-]+-[A-Z0-9]+)'
-                            match_alt = re.search(ua_regex_alt, item_name)
-                            if match_alt: 
-                                item_card_number = match_alt.group(1).strip()
-                        
-                        if not item_card_number: 
-                            continue
-
-                        image_url = ""
-                        image_container = item_data.select_one('div.global_photo')
-                        if image_container and image_container.has_attr('data-src'):
-                            image_url = image_container['data-src'].strip() 
-                            image_url = image_url.replace(" ", "%20")  
-                            if image_url.startswith('//'): 
-                                image_url = 'https:' + image_url
-                            elif image_url.startswith('/'): 
-                                image_url = base_url + image_url
-
-                        all_uniari_cards[(item_card_number, item_name)] = {'price_jpy': price_jpy, 'status': status, 'image_url': image_url}
-
-                    next_page_link = soup.select_one('a.to_next_page')
-                    if not next_page_link: 
-                        log("    -> 此系列已掃蕩完畢（沒有下一頁）。"); 
-                        break # 跳出 while True
-                    
-                    current_page += 1
-                    time.sleep(random.uniform(1, 3))
-                
-                except PlaywrightTimeoutError:
-                    if current_page == 1: 
-                        log("    -> 警告：此系列可能為空或加載超時...")
-                    else: 
-                        log(f"    -> 在第 {current_page} 頁等待超時，跳轉到下個系列。")
-                    break # 跳出 while True
-                except Exception as e: 
-                    log(f"    -> 掃蕩頁面 {current_page} 時失敗。錯誤: {e}"); 
-                    break # 跳出 while True
-        
-        # --- 【v1.2 修正】: 將 browser.close() 移至 "with" 區塊內部 ---
-        log("    -> ✅ 瀏覽器爬蟲任務完成，正在關閉瀏覽器...")
-        browser.close() 
-    
-    # --- "with sync_playwright() as p:" 區塊在此結束 ---
-
-    log(f"\n✅ 所有 UA 專櫃掃蕩完畢，共捕獲 {len(all_uniari_cards)} 種卡牌的情報。")
-
-    log("\n>> 步驟 4/5: 開始執行情報擴張 (UA) 與價格記錄...") # 步驟重編
-    new_cards_to_add = []
-    price_history_to_add = []
-    total_new_cards = 0
-    total_price_records = 0
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    def flush_new_cards(force=False):
-        if new_cards_to_add and (force or len(new_cards_to_add) >= MASTER_BATCH_SIZE):
-            log(f"    -> 正在批次寫入 {len(new_cards_to_add)} 張新 UA 卡牌至 `Card_Master`...")
-            append_rows_with_retry(master_worksheet, new_cards_to_add, "UA 新卡批次")
-            log("    -> ✅ UA 新卡批次寫入完成！")
-            new_cards_to_add.clear()
-
-    def flush_price_history(force=False):
-        if price_history_to_add and (force or len(price_history_to_add) >= HISTORY_BATCH_SIZE):
-            log(f"    -> 正在批次寫入 {len(price_history_to_add)} 條 UA 售價至 `Price_History`...")
-            price_history_to_add.sort(key=lambda record: (record[1], record[5]))
-            append_rows_with_retry(history_worksheet, price_history_to_add, "UA 售價批次")
-            log("    -> ✅ UA 售價批次寫入完成！")
-            price_history_to_add.clear()
-
-    for (item_card_number, item_name), card_info in all_uniari_cards.items():
-        price_jpy = card_info['price_jpy']; status = card_info['status']; image_url = card_info['image_url']
-
-        # --- [情報擴張: Card_Master] ---
-        if item_card_number not in existing_card_numbers:
-            log(f"    -> ✨ 發現新 UA 卡牌！ {item_card_number} {item_name}")
-            rarity = "Unknown"; card_type = "Unknown"
-            if "SR★★" in item_name or "★★" in item_name: rarity = "SR★★"
-            elif "SR★" in item_name or "★" in item_name: rarity = "SR★" 
-            elif "R★" in item_name: rarity = "R★"
-            elif "U★" in item_name: rarity = "U★"
-            elif "C★" in item_name: rarity = "C★"
-            elif "AP" in item_name: rarity = "AP"
-            elif "SR" in item_name: rarity = "SR"
-            elif "R" in item_name: rarity = "R"
-            elif "U" in item_name: rarity = "U"
-            elif "C" in item_name: rarity = "C"
-            elif "L" in item_name: rarity = "L" 
-            if "【キャラクター】" in item_name: card_type = "CHARACTER"
-            elif "【イベント】" in item_name: card_type = "EVENT"
-            elif "【フィールド】" in item_name: card_type = "FIELD"
-            elif "【アクションポイント】" in item_name: card_type = "ACTION POINT"
-            
-            set_id = item_card_number.split('/')[0] if '/' in item_card_number else "UA_Unknown"
-            unique_id = f"{item_card_number}_{rarity}"
-            
-            new_cards_to_add.append([
-                unique_id, item_card_number, game_title, set_id,
-                item_name, rarity, image_url, card_type
+        # --- [v1.6] 不再開啟瀏覽器: 系列頁與列表頁以 HTTP 抓取 ---
+        print("\n>> 步驟 2/5: 以 HTTP 抓取頁面 (頁面缺少商品時才改用瀏覽器)...") # 步驟重編
+        all_uniari_cards = {}
+        # --- 斷點續傳: 已掃蕩的頁面由 crawl_listing 交還 collect_page，未完成的系列從下一頁繼續 (指令列加 --fresh 從頭開始) ---
+        # 斷點保存各頁的擷取結果 (v1.6 起與舊版格式不同，換檔名以免讀入舊斷點)
+        checkpoint = ScrapeCheckpoint("uniari_listing", fresh=ctx.fresh)
+        checkpoint.load()
+
+        def collect_page(records):
+            # 整頁解析成功才併入 (與斷點內容一致)
+            for item_card_number, item_name, card_info in parse_page(records):
+                all_uniari_cards[(item_card_number, item_name)] = card_info
+
+        async def sweep():
+            async with PageFetcher() as fetcher:
+                print("\n>> 步驟 3/5: 開始動態掃描 UA 系列專櫃...") # 步驟重編
+                series_paths = await get_all_series_links(fetcher)
+                if not series_paths:
+                    raise RuntimeError("未能獲取任何 UA 系列 URL，任務中止。")
+
+                # 各系列並行掃蕩 (同一系列內依「下一頁」連結依序抓取)
+                # 某頁重試後仍失敗時，其他系列照常跑完，再以 ListingFailed 結束任務 (重跑從該頁繼續)
+                with ListingParser() as parser:
+                    await gather_limited([
+                        crawl_listing(fetcher, parser, base_url + path, collect_page, SHOP_LIST_SPEC,
+                                      label=f"[{i+1}/{len(series_paths)}]", checkpoint=checkpoint)
+                        for i, path in enumerate(series_paths)
+                    ])
+                log(f"    -> ✅ HTTP 抓取 {fetcher.http_pages} 頁，瀏覽器備援 {fetcher.browser_pages} 頁。")
+
+        run_async(sweep())
+
+        log(f"\n✅ 所有 UA 專櫃掃蕩完畢，共捕獲 {len(all_uniari_cards)} 種卡牌的情報。")
+
+        log("\n>> 步驟 4/5: 開始執行情報擴張 (UA) 與價格記錄...") # 步驟重編
+        new_cards_to_add = []
+        new_card_numbers = set()   # 待寫入 Card_Master 的卡號 (寫入成功後才併入共用集合)
+        price_history_to_add = []
+        total_new_cards = 0
+        total_price_records = 0
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        def flush_new_cards(force=False):
+            if new_cards_to_add and (force or len(new_cards_to_add) >= MASTER_BATCH_SIZE):
+                log(f"    -> 正在批次寫入 {len(new_cards_to_add)} 張新 UA 卡牌至 `Card_Master`...")
+                append_rows_with_retry(master_worksheet, new_cards_to_add, "UA 新卡批次")
+                log("    -> ✅ UA 新卡批次寫入完成！")
+                new_cards_to_add.clear()
+                existing_card_numbers.update(new_card_numbers)
+                new_card_numbers.clear()
+
+        def flush_price_history(force=False):
+            if price_history_to_add and (force or len(price_history_to_add) >= HISTORY_BATCH_SIZE):
+                log(f"    -> 正在批次寫入 {len(price_history_to_add)} 條 UA 售價至 `Price_History`...")
+                price_history_to_add.sort(key=lambda record: (record[1], record[5]))
+                append_rows_with_retry(history_worksheet, price_history_to_add, "UA 售價批次")
+                add_metrics(rows_written=len(price_history_to_add))
+                log("    -> ✅ UA 售價批次寫入完成！")
+                price_history_to_add.clear()
+                checkpoint.mark("history_written", history_cursor)
+
+        # 斷點續傳: 上次中斷前已寫入 Price_History 的筆數 (Card_Master 會重新比對，不受影響)
+        history_written = checkpoint.value("history_written", 0)
+        history_cursor = history_written
+        # 各系列並行抓取，完成順序每次不同: 依 (卡號, 名稱) 排序，重跑時 history_written 才對得上同一批資料
+        for index, ((item_card_number, item_name), card_info) in enumerate(sorted(all_uniari_cards.items())):
+            price_jpy = card_info['price_jpy']; status = card_info['status']; image_url = card_info['image_url']
+
+            # --- [情報擴張: Card_Master] ---
+            if item_card_number not in existing_card_numbers and item_card_number not in new_card_numbers:
+                log(f"    -> ✨ 發現新 UA 卡牌！ {item_card_number} {item_name}")
+                rarity = "Unknown"; card_type = "Unknown"
+                if "SR★★" in item_name or "★★" in item_name: rarity = "SR★★"
+                elif "SR★" in item_name or "★" in item_name: rarity = "SR★" 
+                elif "R★" in item_name: rarity = "R★"
+                elif "U★" in item_name: rarity = "U★"
+                elif "C★" in item_name: rarity = "C★"
+                elif "AP" in item_name: rarity = "AP"
+                elif "SR" in item_name: rarity = "SR"
+                elif "R" in item_name: rarity = "R"
+                elif "U" in item_name: rarity = "U"
+                elif "C" in item_name: rarity = "C"
+                elif "L" in item_name: rarity = "L" 
+                if "【キャラクター】" in item_name: card_type = "CHARACTER"
+                elif "【イベント】" in item_name: card_type = "EVENT"
+                elif "【フィールド】" in item_name: card_type = "FIELD"
+                elif "【アクションポイント】" in item_name: card_type = "ACTION POINT"
+
+                set_id = item_card_number.split('/')[0] if '/' in item_card_number else "UA_Unknown"
+                unique_id = f"{item_card_number}_{rarity}"
+
+                new_cards_to_add.append([
+                    unique_id, item_card_number, game_title, set_id,
+                    item_name, rarity, image_url, card_type
+                ])
+                new_card_numbers.add(item_card_number)
+                total_new_cards += 1
+                log(f"      -> 已準備將其添加到 `Card_Master`。")
+                flush_new_cards()
+
+            # --- [價格記錄: Price_History] ---
+            if index < history_written:
+                continue
+            history_unique_id = f"{item_card_number}_{item_name}"
+            history_id = f"{history_unique_id}_{website_name}_{timestamp}"
+            set_id_history = item_card_number.split('/')[0] if '/' in item_card_number else "UA_Unknown"
+
+            # --- 【v1.1 JPY-Only 結構 (9 欄)】 ---
+            price_history_to_add.append([
+                history_id, history_unique_id, website_name,
+                price_jpy,  # D: Sell_Price_JPY
+                "N/A",      # E: Buy_Price_JPY
+                timestamp,  # F: Timestamp
+                status,     # G: Status
+                set_id_history, # H: Set_ID
+                image_url   # I: Image_URL
             ])
-            existing_card_numbers.add(item_card_number)
-            total_new_cards += 1
-            log(f"      -> 已準備將其添加到 `Card_Master`。")
-            flush_new_cards()
-
-        # --- [價格記錄: Price_History] ---
-        history_unique_id = f"{item_card_number}_{item_name}"
-        history_id = f"{history_unique_id}_{website_name}_{timestamp}"
-        set_id_history = item_card_number.split('/')[0] if '/' in item_card_number else "UA_Unknown"
-
-        # --- 【v1.1 JPY-Only 結構 (9 欄)】 ---
-        price_history_to_add.append([
-            history_id, history_unique_id, website_name,
-            price_jpy,  # D: Sell_Price_JPY
-            "N/A",      # E: Buy_Price_JPY
-            timestamp,  # F: Timestamp
-            status,     # G: Status
-            set_id_history, # H: Set_ID
-            image_url   # I: Image_URL
-        ])
-        total_price_records += 1
-        flush_price_history()
-
-        if total_price_records % 150 == 0:
-            log(f"    -> 已處理 {total_price_records} 筆 UA 售價資料 (目前累積 {len(price_history_to_add)} 筆待寫入)。")
-
-    log(f"\n✅ 情報處理完畢。共偵測 {total_new_cards} 張新 UA 卡牌，記錄 {total_price_records} 條 UA 價格情報 (JPY)。")
-
-    log("\n>> 步驟 5/5: 正在觸發最終批次寫入 (UA)...")
-
-    flush_new_cards(force=True)
-    if total_new_cards == 0:
-        log("    -> 未發現需要添加到 `Card_Master` 的新 UA 卡牌。")
-    else:
-        log(f"    -> ✅ 累計寫入 `Card_Master` {total_new_cards} 張新 UA 卡牌。")
-
-    flush_price_history(force=True)
-    if total_price_records == 0:
-        log("    -> 未捕獲到需要添加到 `Price_History` 的 UA 價格情報。")
-    else:
-        log(f"    -> ✅ 累計寫入 `Price_History` {total_price_records} 條 UA 價格情報。")
-    
-    log("\n\n🎉🎉🎉 恭喜！Union Arena 售價 (JPY-Only) 征服任務完成！ 🎉🎉🎉")
-
-except Exception as e:
-    print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); 
-    print(f"錯誤詳情: {e}")
-    # 【v1.2 修正】: 移除此處的 browser.close()，因為它已在 "with" 區塊內關閉
\ No newline at end of file
+            total_price_records += 1
+            history_cursor = index + 1
+            flush_price_history()
+
+            if total_price_records % 150 == 0:
+                log(f"    -> 已處理 {total_price_records} 筆 UA 售價資料 (目前累積 {len(price_history_to_add)} 筆待寫入)。")
+
+        log(f"\n✅ 情報處理完畢。共偵測 {total_new_cards} 張新 UA 卡牌，記錄 {total_price_records} 條 UA 價格情報 (JPY)。")
+
+        log("\n>> 步驟 5/5: 正在觸發最終批次寫入 (UA)...")
+
+        flush_new_cards(force=True)
+        if total_new_cards == 0:
+            log("    -> 未發現需要添加到 `Card_Master` 的新 UA 卡牌。")
+        else:
+            log(f"    -> ✅ 累計寫入 `Card_Master` {total_new_cards} 張新 UA 卡牌。")
+
+        flush_price_history(force=True)
+        if total_price_records == 0:
+            log("    -> 未捕獲到需要添加到 `Price_History` 的 UA 價格情報。")
+        else:
+            log(f"    -> ✅ 累計寫入 `Price_History` {total_price_records} 條 UA 價格情報。")
+
+        checkpoint.clear()  # 全部寫入完成，下次從頭開始
+        log("\n\n🎉🎉🎉 恭喜！Union Arena 售價 (JPY-Only) 征服任務完成！ 🎉🎉🎉")
+
+    except Exception as e:
+        print(f"\n❌❌❌ 發生嚴重錯誤 ❌❌❌"); 
+        print(f"錯誤詳情: {e}")
+        raise   # 交給呼叫端: 總指揮據此重試並略過依賴的任務，單獨執行時以代碼 1 結束
+
+
+if __name__ == "__main__":
+    run_standalone(run)
@@ -1,9 +1,21 @@
 # =========================================================
-# Phase 3.4: 總指揮腳本 (Master Script) v7.7 - 自動維護版 + 超時保護
+# Phase 3.4: 總指揮腳本 (Master Script) v8.1 - 自動維護版 + 超時保護 + 斷點續傳 + 單一行程 + 並行排程 + 執行紀錄
 # Author: 電王
 # 職責: 1. (新) 自動執行 archive_price_history.py 進行數據清理。
-#       2. (舊) 按順序執行所有的 JPY-Only 價格爬蟲。
+#       2. 依依賴圖並行執行所有的 JPY-Only 價格爬蟲 (不同網站同時進行)。
 #
+# Update v8.1: 每次任務執行寫入 scraper_runs (backend/run_history.py: 耗時、頁面數、寫入列數、重試與錯誤)；
+#              超時限制改由歷史 p95 推算 (超時中斷的執行以中斷時的耗時列入)，紀錄不足時使用 script_timeouts 的固定值。
+# Update v8.0: 以依賴圖 (DAG) 排程取代固定順序 (backend/orchestrator.py):
+#              維護完成後，不同網站的爬蟲同時執行 (瀏覽器數依 CPU/記憶體設上限)；
+#              同網站的任務不同時執行，買取表在同遊戲的售價爬蟲之後 (新卡先由售價來源寫入 Card_Master)。
+#              任務失敗只略過依賴它的任務，重試放回佇列，不再中止其他網站的爬蟲。
+# Update v7.9: 不再為每個腳本啟動子行程: 匯入腳本模組並呼叫 run(ctx)，
+#              共用一次授權的 gspread、已開啟的工作表、Card_Master 卡號集合、資料庫連線池與長駐瀏覽器
+#              (backend/scraper_context.py)。隔離改由 Watchdog 超時中斷 + 例外邊界負責，
+#              失敗後重啟瀏覽器並重讀卡號再重試。
+# Update v7.8: 第一次執行加上 --fresh 從頭開始；超時/socket 錯誤重試時不加，
+#              支援斷點的爬蟲 (backend/checkpoint.py) 會從中斷的系列/頁面繼續
 # Update v7.7: 新增超時保護機制，防止腳本無限卡住
 # Update v7.6: 新增 socket 錯誤自動重試機制
 # Update v7.5: 
@@ -12,25 +24,42 @@
 # 3. 【核心】: 在所有爬蟲任務 *之前*，自動運行 archive_price_history.py。
 # =========================================================
 
-import subprocess
+import importlib
+import os
 import sys
-import time
 from datetime import datetime
-import os
-import threading
 # (v7.5 移除了 gspread 和 requests，因為 v7.4 已改為手動匯率)
 
-def run_script(script_name):
-    # 獲取當前腳本所在的目錄
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(script_dir, script_name)
-    
-    command = [sys.executable, script_path]
-    print(f"\n{'='*50}")
-    print(f">> 正在啟動子腳本: {script_name}")
-    print(f"{'='*50}\n")
-    
-    # --- [v7.7 新增] 設定超時時間（不同腳本不同時間）---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 各腳本共用的授權、工作表、卡號集合與瀏覽器，見 backend/scraper_context.py
+sys.path.insert(0, os.path.join(SCRIPT_DIR, 'backend'))
+from scraper_context import ScraperContext
+# 依賴圖排程、並行上限、超時監看與重試，見 backend/orchestrator.py
+from orchestrator import Orchestrator, ScraperTask, install_activity_streams
+# 執行紀錄與依歷史 p95 推算的超時預算，見 backend/run_history.py
+from run_history import timeout_budget
+
+# --- [v8.0 任務依賴圖] ---
+# (任務名稱, 腳本, 依賴的任務, 目標網站, 是否使用瀏覽器)
+# 同一網站的任務不會同時執行；買取表依賴同遊戲的售價爬蟲，維持原本「售價來源先新增卡牌」的順序。
+# 售價爬蟲以 HTTP 抓取 (backend/fetcher.py)，只在回應缺少商品時才自行開啟備援瀏覽器，不佔用長駐瀏覽器。
+TASKS = [
+    ("archive", "archive_price_history.py", [], None, False),
+    ("mercadop", "price_scraper_mercadop.py", ["archive"], "www.mercardop.jp", False),
+    ("akiba", "price_scraper_akiba.py", ["mercadop"], "akihabara-cardshop.com", False),
+    ("akiba_op_new", "price_scraper_akiba_op_new.py", ["archive"], "akihabara-cardshop.com", False),
+    ("uniari", "price_scraper_uniari.py", ["archive"], "www.merucarduniari.jp", False),
+    ("akiba_ua", "price_scraper_akiba_ua.py", ["uniari"], "akihabara-cardshop.com", False),
+    ("akiba_ua_new", "price_scraper_akiba_ua_new.py", ["archive"], "akihabara-cardshop.com", False),
+    ("cardrush_vg", "price_scraper_cardrush_vg.py", ["archive"], "www.cardrush-vanguard.jp", False),
+    ("cardrush_vg_buy", "price_scraper_cardrush_vg_buy.py", ["cardrush_vg"], "cardrush.media", False),
+    ("cardrush_dm", "price_scraper_cardrush_dm.py", ["archive"], "www.cardrush-dm.jp", False),
+    ("cardrush_dm_kaitori", "price_scraper_cardrush_dm_kaitori.py", ["cardrush_dm"], "cardrush.media", False),
+]
+
+
+def script_timeouts(script_name):
+    """[v7.7] 不同腳本不同的超時時間: (總時間分鐘, 無輸出秒數)；v8.1 起為歷史紀錄不足時的預設值"""
     no_output_timeout_seconds = 600  # 預設 10 分鐘無輸出判定
 
     if "mercadop" in script_name:
@@ -48,242 +77,51 @@ def run_script(script_name):
         timeout_minutes = 30  # 維護腳本：30 分鐘
     else:
         timeout_minutes = 40  # 預設：40 分鐘
-    
-    timeout_seconds = timeout_minutes * 60
-    print(f">> ⏱️ 超時限制: {timeout_minutes} 分鐘\n")
-    
-    # --- [v7.6 新增] 最多重試 2 次 ---
-    max_retries = 2
-    for attempt in range(max_retries + 1):
-        try:
-            env = os.environ.copy()
-            env['PYTHONUTF8'] = '1'
-
-            socket_error_count = 0
-            
-            with subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='replace',
-                bufsize=1,
-                env=env,
-                cwd=script_dir
-            ) as process:
-                start_time_script = time.time()
-                last_output_time = {"value": time.time()}
-                no_output_timeout = no_output_timeout_seconds
-                socket_error_counter = {"count": 0}
-                stop_event = threading.Event()
-
-                def stream_process_output():
-                    try:
-                        for line in iter(process.stdout.readline, ''):
-                            if not line:
-                                break
-                            print(line, end='')
-                            last_output_time["value"] = time.time()
-                            if "socket.send() raised exception" in line:
-                                socket_error_counter["count"] += 1
-                                if socket_error_counter["count"] > 10:
-                                    stop_event.set()
-                                    break
-                    except Exception:
-                        stop_event.set()
-
-                reader_thread = threading.Thread(target=stream_process_output, daemon=True)
-                reader_thread.start()
-
-                try:
-                    while True:
-                        if stop_event.is_set():
-                            print(f"\n⚠️ 檢測到過多 socket 錯誤 ({socket_error_counter['count']})，終止腳本...")
-                            process.kill()
-                            break
-
-                        if process.poll() is not None:
-                            break
-
-                        elapsed = time.time() - start_time_script
-                        if elapsed > timeout_seconds:
-                            print(f"\n\n⚠️⚠️⚠️ 超時警告 ⚠️⚠️⚠️")
-                            print(f"腳本 {script_name} 已運行 {elapsed/60:.1f} 分鐘，超過限制 {timeout_minutes} 分鐘")
-                            print("正在強制終止...")
-                            process.kill()
-                            raise TimeoutError(f"腳本運行超過 {timeout_minutes} 分鐘")
-
-                        time_since_output = time.time() - last_output_time["value"]
-                        if time_since_output > no_output_timeout:
-                            print(f"\n\n⚠️⚠️⚠️ 無輸出超時警告 ⚠️⚠️⚠️")
-                            print(f"腳本 {script_name} 已 {time_since_output/60:.1f} 分鐘沒有輸出，可能卡住")
-                            print("正在強制終止...")
-                            process.kill()
-                            raise TimeoutError(f"腳本超過 {no_output_timeout/60:.0f} 分鐘沒有輸出")
-
-                        time.sleep(0.5)
-
-                except Exception:
-                    process.kill()
-                    raise
-                finally:
-                    reader_thread.join(timeout=5)
-
-                socket_error_count = socket_error_counter["count"]
-
-            # [v7.6] 如果是 socket 錯誤導致的失敗，且還有重試次數
-            if socket_error_count > 10 and attempt < max_retries:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 子腳本 {script_name} 因 socket 錯誤失敗")
-                print(f"   正在進行第 {attempt + 2}/{max_retries + 1} 次重試...")
-                print(f"   等待 15 秒後重新啟動...")
-                print(f"{'='*50}\n")
-                time.sleep(15)  # 等待 15 秒後重試
-                continue
-            
-            if process.returncode != 0 and attempt < max_retries:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 子腳本 {script_name} 執行失敗")
-                print(f"   正在進行第 {attempt + 2}/{max_retries + 1} 次重試...")
-                print(f"   等待 10 秒後重新啟動...")
-                print(f"{'='*50}\n")
-                time.sleep(10)
-                continue
-            
-            if process.returncode != 0:
-                raise subprocess.CalledProcessError(process.returncode, command)
-                
-            print(f"\n{'='*50}")
-            print(f">> ✅ 子腳本 {script_name} 執行完畢。")
-            print(f"{'='*50}\n")
-            time.sleep(5) 
-            return True
-            
-        except subprocess.CalledProcessError as e:
-            if attempt < max_retries:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 子腳本 {script_name} 執行失敗，準備重試...")
-                print(f"   錯誤代碼: {e.returncode}")
-                print(f"   正在進行第 {attempt + 2}/{max_retries + 1} 次重試...")
-                print(f"{'='*50}\n")
-                time.sleep(10)
-                continue
-            else:
-                print(f"\n{'='*50}")
-                print(f"❌ 錯誤: 子腳本 {script_name} 重試 {max_retries + 1} 次後仍失敗。")
-                print(f"   錯誤代碼: {e.returncode}")
-                print(f"{'='*50}\n")
-                return False
-        
-        except TimeoutError as e:
-            if attempt < max_retries:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 子腳本 {script_name} 執行超時")
-                print(f"   錯誤: {e}")
-                print(f"   正在進行第 {attempt + 2}/{max_retries + 1} 次重試...")
-                print(f"{'='*50}\n")
-                time.sleep(10)
-                continue
-            else:
-                print(f"\n{'='*50}")
-                print(f"❌ 錯誤: 子腳本 {script_name} 重試 {max_retries + 1} 次後仍超時。")
-                print(f"{'='*50}\n")
-                return False
-                
-        except FileNotFoundError:
-            print(f"\n{'='*50}")
-            print(f"❌ 錯誤: 找不到腳本 {script_name}。")
-            print(f"   請確保它和 run_all_scrapers.py 在同一個資料夾中。")
-            print(f"{'='*50}\n")
-            return False
-            
-        except Exception as e:
-            if attempt < max_retries:
-                print(f"\n{'='*50}")
-                print(f"⚠️ 執行 {script_name} 時發生錯誤: {e}")
-                print(f"   正在進行第 {attempt + 2}/{max_retries + 1} 次重試...")
-                print(f"{'='*50}\n")
-                time.sleep(10)
-                continue
-            else:
-                print(f"\n{'='*50}")
-                print(f"❌ 執行 {script_name} 時發生未預期錯誤: {e}")
-                print(f"{'='*50}\n")
-                return False
-    
-    return False  # 所有重試都失敗
-
-
-# --- [主執行流程 v7.5] ---
+    return timeout_minutes, no_output_timeout_seconds
+
+
+def load_script(script_name):
+    """[v7.9] 匯入腳本模組並取得 run(ctx)；找不到或無法載入時回傳 None"""
+    module_name = os.path.splitext(script_name)[0]
+    try:
+        return importlib.import_module(module_name).run
+    except Exception as e:
+        print(f"\n{'='*50}")
+        print(f"❌ 錯誤: 無法載入腳本 {script_name}: {e}")
+        print(f"   請確保它和 run_all_scrapers.py 在同一個資料夾中。")
+        print(f"{'='*50}\n")
+        return None
+
+
+def build_tasks():
+    tasks = []
+    for name, script_name, needs, host, browser in TASKS:
+        # [v8.1] 有足夠的歷史紀錄時，超時依過去第一次執行的 p95 推算；紀錄不足時使用 script_timeouts 的預設值
+        timeout_minutes, no_output_timeout_seconds = timeout_budget(name, *script_timeouts(script_name))
+        tasks.append(ScraperTask(
+            name, load_script(script_name), needs=needs, host=host, browser=browser,
+            timeout_minutes=timeout_minutes, no_output_timeout=no_output_timeout_seconds,
+        ))
+    return tasks
+
+
+# --- [主執行流程 v8.0] ---
 if __name__ == "__main__":
+    # --- [v7.9] 所有腳本在同一行程內執行，共用授權、工作表、卡號集合與瀏覽器 ---
+    streams = install_activity_streams()
     start_time = datetime.now()
-    print(f"======= 價格爬蟲總指揮系統 (OP + UA + VG + DM) v7.7 (自動維護版 + 超時保護) 已啟動 =======")
+    print(f"======= 價格爬蟲總指揮系統 (OP + UA + VG + DM) v8.1 (自動維護版 + 超時保護 + 斷點續傳 + 並行排程 + 執行紀錄) 已啟動 =======")
     print(f"開始時間: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print("!! 匯率模式: 手動 (將使用 Card_Search!F1 中您輸入的值) !!")
-    
-    all_success = True
-
-    # --- 【v7.5 新增】維護任務 ---
-    print("\n======= [階段 1/2: 系統維護] =======")
-    if not run_script("archive_price_history.py"):
-        all_success = False # 如果維護失敗，設為 False
 
-    # --- 階段 2: 價格爬取 ---
-    if all_success: # <--- 只有在維護成功時，才繼續執行爬取
-        print("\n======= [階段 2/2: 價格爬取 (10 個任務)] =======")
-        
-        # --- 任務 1: OP 售價 ---
-        if not run_script("price_scraper_mercadop.py"):
-            all_success = False
+    # --- 【v7.5】維護任務 (archive) 先執行，所有爬取任務都依賴它 ---
+    print(f"\n======= [系統維護 + 價格爬取 ({len(TASKS) - 1} 個任務)，依依賴圖並行執行] =======")
+    with ScraperContext() as ctx:
+        orchestrator = Orchestrator(build_tasks(), ctx, streams)
+        all_success = orchestrator.run()
 
-        # --- 任務 2: OP 買取價 (主列表) ---
-        if all_success:
-            if not run_script("price_scraper_akiba.py"): 
-                all_success = False
-                
-        # --- 任務 3: OP 買取價 (新彈) ---
-        if all_success:
-            if not run_script("price_scraper_akiba_op_new.py"):
-                all_success = False
-
-        # --- 任務 4: UA 售價 ---
-        if all_success:
-            if not run_script("price_scraper_uniari.py"):
-                all_success = False
-
-        # --- 任務 5: UA 買取價 (主列表) ---
-        if all_success:
-            if not run_script("price_scraper_akiba_ua.py"):
-                all_success = False
-                
-        # --- 任務 6: UA 買取價 (新彈) ---
-        if all_success:
-            if not run_script("price_scraper_akiba_ua_new.py"):
-                all_success = False
-                
-        # --- 任務 7: VG 售價 (Card Rush) ---
-        if all_success:
-            if not run_script("price_scraper_cardrush_vg.py"):
-                all_success = False
-                
-        # --- 任務 8: VG 買取價 (Card Rush Media) ---
-        if all_success:
-            if not run_script("price_scraper_cardrush_vg_buy.py"):
-                all_success = False
-
-        # --- 任務 9: DM 售價 (Card Rush) ---
-        if all_success:
-            if not run_script("price_scraper_cardrush_dm.py"):
-                all_success = False
-                
-        # --- 任務 10: DM 買取價 (Card Rush Media) ---
-        if all_success:
-            if not run_script("price_scraper_cardrush_dm_kaitori.py"):
-                all_success = False
-    
-    else:
-        # 如果 all_success 在維護階段就失敗了
+    if orchestrator.by_name["archive"].status != "done":
+        # 維護失敗時，所有依賴它的爬取任務都已略過
         print("\n======= ❌ 系統維護 (archive_price_history.py) 失敗，所有爬取任務已中止。 =======")
 
     # --- 總結 ---
@@ -291,7 +129,7 @@ if __name__ == "__main__":
     if all_success:
         print(f"======= 🎉🎉🎉 總指揮系統 (OP + UA + VG + DM) 任務全部完成！ 🎉🎉🎉 =======")
     else:
-        print(f"======= ❌ 總指揮系統任務執行中斷。請檢查日誌。 =======")
-        
+        print(f"======= ❌ 總指揮系統部分任務未完成。請檢查上方的任務總結與日誌。 =======")
+
     print(f"結束時間: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"總耗時: {end_time - start_time}")
\ No newline at end of file
+    print(f"總耗時: {end_time - start_time}")